@@ -76,6 +76,8 @@ from app.users import auth_bp
 from app.treatment_plan import treatment_bp
 from app.apis.patients_api import patients_api_bp
 from app.apis.appointments_api import appointments_api_bp
+from app.apis.appointment_series_api import appointment_series_api_bp
+from app.apis.calendar_feed_api import calendar_feed_api_bp
 from app.apis.inventory_api import inventory_api_bp
 from app.apis.treatment_plan_api import treatment_api_bp
 from app.apis.users_api import auth_api_bp
@@ -87,10 +89,28 @@ app.register_blueprint(treatment_bp)
 app.register_blueprint(auth_bp)
 app.register_blueprint(patients_api_bp)
 app.register_blueprint(appointments_api_bp)
+app.register_blueprint(appointment_series_api_bp)
+app.register_blueprint(calendar_feed_api_bp)
 app.register_blueprint(inventory_api_bp)
 app.register_blueprint(treatment_api_bp)
 app.register_blueprint(auth_api_bp)
 
 # Create the database tables
+from app.models import Appointment
+from app.jobs.blind_index_backfill import setup_blind_indexes
+from app.utils.schema import create_missing_indexes
+from app.utils.name_search import setup_name_search
+from app.utils.scheduling import setup_appointment_durations, setup_conflict_constraint
+
 with app.app_context():
     db.create_all()
+    # Add the blind index columns to a patients table created before them
+    setup_blind_indexes()
+    # Create the names table and trigram (PostgreSQL) or FTS5 (SQLite) index of the patient name search
+    setup_name_search()
+    # Add the duration column to an appointments table created before it
+    setup_appointment_durations()
+    # Create the (patient_id, appointment_date) index of the calendar windows on an existing table
+    create_missing_indexes(Appointment.__table__.c.appointment_date)
+    # Reject overlapping appointments in the database itself (PostgreSQL)
+    setup_conflict_constraint()
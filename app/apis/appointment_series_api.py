@@ -0,0 +1,313 @@
+# app/apis/appointment_series_api.py
+
+from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify
+from app import db
+from app.models import AppointmentSeries, AppointmentSeriesException, Patient
+from app.authentication_decorators import login_required, role_required
+from app.utils.conditional import resource_validators, is_not_modified, not_modified_response, add_validators
+from app.utils.recurrence import (
+    Occurrence, parse_series, expand_series, occurrences_between, is_rule_occurrence, update_series_bounds
+)
+from app.utils.scheduling import (
+    parse_duration, parse_datetime, find_conflicts, find_conflicts_many, conflict_summary
+)
+
+appointment_series_api_bp = Blueprint('appointment_series_api', __name__)
+
+# Longest window of GET /api/appointment_series/occurrences, in days
+MAX_OCCURRENCES_WINDOW_DAYS = 366
+
+# Create a recurring appointment series
+@appointment_series_api_bp.route('/api/appointment_series', methods=['POST'])
+@login_required
+@role_required('admin', 'user')
+def create_appointment_series():
+    """
+    This API endpoint creates a recurring appointment series, e.g. every four weeks for a year.
+
+    The endpoint requires the user to be logged in and have the role 'admin' or 'user'.
+
+    Parameters:
+        - data (dict): JSON data containing the following keys:
+            - patient_id (int): The ID of the patient.
+            - starts_at (str): The date and time of the first occurrence in ISO format.
+            - frequency (str): 'daily', 'weekly' or 'monthly'.
+            - interval (int, optional): The number of days, weeks or months between two occurrences (1 by default).
+            - count (int): The number of occurrences (at most 366), or
+            - until (str): The last occurrence starts at or before this ISO datetime.
+            - duration_minutes (int, optional): The length of each occurrence in minutes (30 by default).
+            - notes (str, optional): Notes for every occurrence.
+
+    The series is stored as one row holding the rule, written in a single transaction, instead of
+    one appointment per occurrence. Every occurrence is checked against the appointments and the
+    other series before anything is written (see app.utils.scheduling.find_conflicts_many).
+
+    Returns:
+        - If successful, a JSON object with a success message, the ID of the new series
+          ('series_id') and the number of occurrences ('count'), with status code 201.
+        - If a field is missing or invalid, an error message and status code 400.
+        - If the patient does not exist, an error message and status code 404.
+        - If occurrences overlap other appointments, an error message and the list of
+          conflicting occurrences ('conflicts'), with status code 409.
+    """
+    data = request.json or {}
+
+    if not data.get('patient_id'):
+        return jsonify({"error": "Patient ID is required"}), 400
+
+    # Read the rule of the series
+    try:
+        rule = parse_series(data)
+        duration_minutes = parse_duration(data.get('duration_minutes'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if db.session.get(Patient, data['patient_id']) is None:
+        return jsonify({"error": "Patient not found"}), 404
+
+    series = AppointmentSeries(
+        patient_id=data['patient_id'],
+        duration_minutes=duration_minutes,
+        notes=data.get('notes', ''),
+        **rule
+    )
+    update_series_bounds(series)
+
+    # Check all the occurrences at once before writing the series
+    conflicts = find_conflicts_many(expand_series(series))
+    if conflicts:
+        return _series_conflict_response(conflicts)
+
+    db.session.add(series)
+    db.session.commit()
+
+    return jsonify({"message": "Appointment series created successfully", "series_id": series.id, "count": series.count}), 201
+
+# Get a recurring appointment series
+@appointment_series_api_bp.route('/api/appointment_series/<int:id>', methods=['GET'])
+@login_required
+@role_required('admin', 'user')
+def get_appointment_series(id):
+    """
+    This API endpoint returns the rule and the exceptions of an appointment series.
+
+    The endpoint requires the user to be logged in and have the role 'admin' or 'user'.
+
+    The endpoint returns a JSON object with the keys 'id', 'patient_id', 'starts_at',
+    'duration_minutes', 'frequency', 'interval', 'count', 'notes' and 'exceptions' (the cancelled
+    or changed occurrences), with an ETag and a Last-Modified header; a matching If-None-Match or
+    If-Modified-Since header gets an empty 304 response.
+
+    If the series is not found, the endpoint returns a 404 error.
+    """
+    series = db.session.get(AppointmentSeries, id)
+    if series is None:
+        return jsonify({"error": "Appointment series not found"}), 404
+
+    # Changing an exception touches the series (see update_series_occurrence), so updated_at covers both
+    etag, last_modified = resource_validators(series)
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+
+    return add_validators(jsonify(series.serialize()), etag, last_modified), 200
+
+# Get the occurrences of one series
+@appointment_series_api_bp.route('/api/appointment_series/<int:id>/occurrences', methods=['GET'])
+@login_required
+@role_required('admin', 'user')
+def get_series_occurrences(id):
+    """
+    This API endpoint returns the occurrences of an appointment series, in date order.
+
+    The endpoint requires the user to be logged in and have the role 'admin' or 'user'.
+
+    Query parameters:
+        - from (str, optional): Only return the occurrences ending after this ISO datetime.
+        - to (str, optional): Only return the occurrences starting before this ISO datetime.
+
+    The occurrences are expanded from the rule for the window only, cancelled occurrences are
+    left out and moved ones are returned at their new time.
+
+    Returns:
+        - A JSON object with the key 'occurrences', a list of dictionaries with the keys
+          'series_id', 'patient_id', 'occurrence_start' (the time the rule gives the occurrence,
+          which identifies it), 'appointment_date', 'duration_minutes' and 'notes'.
+        - If 'from' or 'to' is invalid, an error message and status code 400.
+        - If the series is not found, an error message and status code 404.
+    """
+    try:
+        start = parse_datetime(request.args.get('from'), 'from')
+        end = parse_datetime(request.args.get('to'), 'to')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    series = db.session.get(AppointmentSeries, id)
+    if series is None:
+        return jsonify({"error": "Appointment series not found"}), 404
+
+    occurrences = expand_series(series, start, end)
+    return jsonify({'occurrences': [occurrence.serialize() for occurrence in occurrences]}), 200
+
+# Get the occurrences of all the series in a window
+@appointment_series_api_bp.route('/api/appointment_series/occurrences', methods=['GET'])
+@login_required
+@role_required('admin', 'user')
+def get_occurrences():
+    """
+    This API endpoint returns the occurrences of all the appointment series in a window, in date order.
+
+    The endpoint requires the user to be logged in and have the role 'admin' or 'user'.
+
+    Query parameters:
+        - from (str): The start of the window, an ISO datetime.
+        - to (str): The end of the window, an ISO datetime, at most 366 days after 'from'.
+        - patient_id (int, optional): Only return the occurrences of this patient's series.
+
+    Calendar views show these next to the appointments of GET /api/appointments for the same
+    window. Only the series overlapping the window are loaded, and each one is expanded for the
+    window only (see app.utils.recurrence.occurrences_between).
+
+    Returns:
+        - A JSON object with the key 'occurrences' (see get_series_occurrences).
+        - If a parameter is missing or invalid, an error message and status code 400.
+    """
+    try:
+        start = parse_datetime(request.args.get('from'), 'from')
+        end = parse_datetime(request.args.get('to'), 'to')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        patient_id = int(request.args['patient_id']) if request.args.get('patient_id') else None
+    except ValueError:
+        return jsonify({"error": "patient_id must be an integer"}), 400
+
+    if start is None or end is None:
+        return jsonify({"error": "from and to are required"}), 400
+    if start >= end:
+        return jsonify({"error": "from must be before to"}), 400
+    if end - start > timedelta(days=MAX_OCCURRENCES_WINDOW_DAYS):
+        return jsonify({"error": f"The window is limited to {MAX_OCCURRENCES_WINDOW_DAYS} days"}), 400
+
+    occurrences = occurrences_between(start, end, patient_id=patient_id)
+    return jsonify({'occurrences': [occurrence.serialize() for occurrence in occurrences]}), 200
+
+# Cancel, move or annotate one occurrence of a series
+@appointment_series_api_bp.route('/api/appointment_series/<int:id>/occurrences/<occurrence_start>', methods=['PUT'])
+@login_required
+@role_required('admin', 'user')
+def update_series_occurrence(id, occurrence_start):
+    """
+    This API endpoint changes one occurrence of an appointment series, leaving the others as they are.
+
+    The endpoint requires the user to be logged in and have the role 'admin' or 'user'.
+
+    The occurrence is identified in the URL by the start the rule gives it (its
+    'occurrence_start', e.g. /api/appointment_series/3/occurrences/2024-06-03T09:00:00), even
+    after it was moved.
+
+    Parameters:
+        - data (dict): JSON data containing either:
+            - cancelled (bool): true to cancel the occurrence, false to restore it, or
+            - appointment_date (str, optional): The new date and time of the occurrence.
+            - duration_minutes (int, optional): The new length of the occurrence in minutes.
+            - notes (str, optional): Notes for this occurrence only.
+
+    The change is stored as an exception of the series. A moved occurrence is checked for overlaps
+    like any appointment.
+
+    Returns:
+        - If successful, a JSON object with a success message and the exception ('exception').
+        - If a field is invalid, an error message and status code 400.
+        - If the series is not found, or the rule has no occurrence at that time, status code 404.
+        - If the occurrence would overlap other appointments, an error message and the
+          conflicting appointments ('conflicts'), with status code 409.
+    """
+    try:
+        original = parse_datetime(occurrence_start, 'occurrence_start')
+    except ValueError:
+        return jsonify({"error": "The occurrence must be given by its ISO start (e.g. '2024-06-03T09:00:00')"}), 400
+
+    series = db.session.get(AppointmentSeries, id)
+    if series is None:
+        return jsonify({"error": "Appointment series not found"}), 404
+    if not is_rule_occurrence(series, original):
+        return jsonify({"error": "The series has no occurrence at this time"}), 404
+
+    # Read the change before touching the series
+    data = request.json or {}
+    if data.get('cancelled') is not None and not isinstance(data['cancelled'], bool):
+        return jsonify({"error": "cancelled must be true or false"}), 400
+    try:
+        appointment_date = parse_datetime(data.get('appointment_date'), 'appointment_date')
+        duration_minutes = parse_duration(data['duration_minutes']) if 'duration_minutes' in data else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Merge the change with the previous exception of the occurrence, if any
+    exception = next((e for e in series.exceptions if e.occurrence_start == original), None)
+    if exception is None:
+        exception = AppointmentSeriesException(occurrence_start=original, cancelled=False)
+    cancelled = exception.cancelled if data.get('cancelled') is None else data['cancelled']
+    appointment_date = appointment_date or exception.appointment_date
+    duration_minutes = duration_minutes or exception.duration_minutes
+    notes = data['notes'] if 'notes' in data else exception.notes
+
+    # The occurrence at its (possibly new) time must not overlap anything else
+    if not cancelled:
+        occurrence = Occurrence(series, original, appointment_date, duration_minutes, notes)
+        conflicts = find_conflicts(
+            occurrence.appointment_date, occurrence.duration_minutes, exclude_occurrence=(series.id, original)
+        )
+        if conflicts:
+            return jsonify({"error": "The occurrence overlaps other appointments", "conflicts": conflict_summary(conflicts)}), 409
+
+    exception.cancelled = cancelled
+    exception.appointment_date = appointment_date
+    exception.duration_minutes = duration_minutes
+    exception.notes = notes
+    if exception.id is None:
+        series.exceptions.append(exception)
+
+    update_series_bounds(series)
+    # Touch the series so that its ETag changes with its exceptions
+    series.updated_at = datetime.utcnow()
+    db.session.commit()
+
+    return jsonify({"message": "Occurrence updated successfully", "exception": exception.serialize()}), 200
+
+# Delete a series and all its occurrences
+@appointment_series_api_bp.route('/api/appointment_series/<int:id>', methods=['DELETE'])
+@login_required
+@role_required('admin', 'user')
+def delete_appointment_series(id):
+    """
+    This API endpoint deletes an appointment series with all its occurrences and exceptions.
+
+    The endpoint requires the user to be logged in and have the role 'admin' or 'user'.
+
+    If the series is not found, the endpoint returns a 404 error.
+    """
+    series = db.session.get(AppointmentSeries, id)
+    if series is None:
+        return jsonify({"error": "Appointment series not found"}), 404
+
+    db.session.delete(series)
+    db.session.commit()
+
+    return jsonify({"message": "Appointment series deleted successfully"}), 200
+
+
+def _series_conflict_response(conflicts):
+    """
+    Return the 409 response rejecting a series whose occurrences overlap other appointments.
+
+    :param conflicts: The (occurrence, conflicts) pairs returned by find_conflicts_many
+    """
+    return jsonify({
+        "error": "Occurrences of the series overlap other appointments",
+        "conflicts": [
+            {'occurrence_start': occurrence.occurrence_start.isoformat(), 'conflicts': conflict_summary(overlapping)}
+            for occurrence, overlapping in conflicts
+        ]
+    }), 409
@@ -1,51 +1,241 @@
 from flask import Blueprint, request, jsonify
+from sqlalchemy import tuple_, func
+from sqlalchemy.exc import IntegrityError
 from app import db
-from app.models import Appointment, Patient
+from app.models import Appointment, AppointmentSeries, Patient
 from app.authentication_decorators import login_required, role_required
-from datetime import datetime, timedelta
+from app.utils.conditional import (
+    resource_validators, collection_validators, is_not_modified, not_modified_response, add_validators
+)
+from app.utils.pagination import parse_limit, encode_cursor, decode_cursor
+from app.utils.appointment_stats import appointment_heatmap, MAX_STATS_DAYS
+from app.utils.recurrence import to_naive_utc, occurrences_between
+from app.utils.scheduling import (
+    parse_duration, parse_datetime, parse_time_of_day, find_conflicts, find_all_conflicts, is_conflict_error,
+    find_free_slots, conflict_summary, select_bulk_appointments, reschedule_appointments, cancel_appointments,
+    OPENING_TIME, CLOSING_TIME, MAX_SLOT_SEARCH_DAYS, MAX_BULK_APPOINTMENTS
+)
+from datetime import date, datetime, timedelta
 
 appointments_api_bp = Blueprint('appointments_api', __name__)
 
-# API to get all appointments
+# Days of series occurrences first expanded for a page of appointments; the span doubles until the page is full
+OCCURRENCE_SEARCH_DAYS = 7
+
+# API to get the appointments of a calendar window
 @appointments_api_bp.route('/api/appointments', methods=['GET'])
 @login_required
 @role_required('admin', 'user')
 def get_all_appointments():
     """
-    This is an API endpoint that returns a list of all appointments in the database.
+    This is an API endpoint that returns the appointments and series occurrences, in date order, one page at a time.
     
     The endpoint requires the user to be logged in and have the role 'admin' or 'user'.
+
+    The endpoint accepts the following optional query parameters:
+        from: Only return the appointments starting at or after this ISO datetime
+        to: Only return the appointments starting before this ISO datetime
+        patient_id: Only return the appointments of this patient
+        limit: The number of appointments per page (50 by default, at most 500)
+        cursor: The 'next_cursor' value returned by the previous page
+
+    A calendar view asks for one window, e.g. ?from=2024-05-06&to=2024-05-13 for a week. The
+    appointments are ordered by (appointment_date, id) and the window is a range condition on
+    appointment_date, so a page is one range scan of the appointment_date index, or of the
+    (patient_id, appointment_date) index when patient_id is given. The next page starts after the
+    (appointment_date, id) of the last appointment of the page (keyset pagination, no OFFSET), so
+    deep pages cost the same as the first one.
+
+    The occurrences of the recurring series, which have no row in the appointments table, are
+    merged into the pages: they are expanded from the rules of the series of the window (see
+    _occurrence_page), and ordered after the appointments starting at the same time. The pages
+    are ordered by (appointment_date, series_id, id), with a series_id of 0 for the appointments
+    and an id of 0 for the occurrences, and the cursor holds that key.
     
-    The endpoint returns a JSON object with a key of 'appointments' and a value of a list of dictionaries.
-    Each dictionary in the list represents an appointment and has the following keys:
-        id: The ID of the appointment (an integer)
+    The endpoint returns a JSON object with the keys 'appointments' and 'next_cursor' (an opaque
+    string to pass as ?cursor= to get the next page, or null on the last page). 'appointments' is
+    a list of dictionaries, each representing an appointment or an occurrence with the following keys:
+        id: The ID of the appointment (an integer), or null for an occurrence
+        series_id: The ID of the series of an occurrence (an integer), or null for an appointment
+        occurrence_start: The start the rule gives the occurrence as an ISO string (it differs from
+            appointment_date when the occurrence was moved), or null for an appointment
         patient_id: The ID of the related patient (an integer)
         appointment_date: The date of the appointment as an ISO string (e.g. '2021-01-01T00:00:00')
+        duration_minutes: The length of the appointment in minutes (an integer)
         notes: The notes associated with the appointment (a string)
-    
-    The list of appointments is sorted in ascending order by their ID.
+
+    The response carries an ETag computed over the appointments and the series of the window (no
+    Last-Modified: a deletion would not change it). If the client sends a matching If-None-Match
+    header, an empty 304 response is returned without loading the appointments.
+
+    If a parameter is invalid, the endpoint returns a 400 error.
     """
-    # Get all appointments from the database
-    appointments = Appointment.query.order_by(Appointment.id.asc()).all()
+    # Read the window and the page
+    try:
+        start = parse_datetime(request.args.get('from'), 'from')
+        end = parse_datetime(request.args.get('to'), 'to')
+        patient_id = _parse_patient_id(request.args.get('patient_id'))
+        limit = parse_limit(request.args)
+        after = _decode_calendar_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if start is not None and end is not None and start >= end:
+        return jsonify({"error": "from must be before to"}), 400
+
+    # The conditions of the window, shared by the validators and the page query
+    criteria = []
+    series_criteria = []
+    if start is not None:
+        criteria.append(Appointment.appointment_date >= start)
+        series_criteria.append(AppointmentSeries.last_end > start)
+    if end is not None:
+        criteria.append(Appointment.appointment_date < end)
+        series_criteria.append(AppointmentSeries.first_start < end)
+    if patient_id is not None:
+        criteria.append(Appointment.patient_id == patient_id)
+        series_criteria.append(AppointmentSeries.patient_id == patient_id)
+
+    # Answer 304 if the appointments and series of the window did not change since the client's copy
+    series_etag, _ = collection_validators(AppointmentSeries, *series_criteria)
+    etag, last_modified = collection_validators(Appointment, *criteria, variant=(after, limit, series_etag))
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+
+    # Get one page of the window, starting after the last entry of the previous page
+    query = Appointment.query.filter(*criteria)
+    if after is not None:
+        after_date, after_series_id, after_id = after
+        if after_series_id == 0:
+            query = query.filter(tuple_(Appointment.appointment_date, Appointment.id) > tuple_(after_date, after_id))
+        else:
+            # The page ended on an occurrence, which comes after the appointments of its time
+            query = query.filter(Appointment.appointment_date > after_date)
+    appointments = query.order_by(Appointment.appointment_date.asc(), Appointment.id.asc()).limit(limit + 1).all()
+
+    # The occurrences can only be in the page if they come before the extra appointment
+    bound = appointments[limit].appointment_date if len(appointments) > limit else None
+    entries = sorted(
+        appointments + _occurrence_page(start, end, patient_id, after, limit, bound), key=_page_key
+    )
+
+    # The extra entry tells whether there is a next page
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        last_date, last_series_id, last_id = _page_key(entries[-1])
+        next_cursor = encode_cursor([last_date.isoformat(), last_series_id, last_id])
     
-    # Create a list of dictionaries to represent the appointments
+    # Create a list of dictionaries to represent the appointments and occurrences
     appointments_list = []
-    for a in appointments:
+    for a in entries:
         appointment_dict = {}
-        # The ID of the appointment
+        # The ID of the appointment (None for an occurrence)
         appointment_dict['id'] = a.id
+        # The series and original start of an occurrence (None for an appointment)
+        appointment_dict['series_id'] = a.series_id if a.id is None else None
+        appointment_dict['occurrence_start'] = a.occurrence_start.isoformat() if a.id is None else None
         # The ID of the related patient
         appointment_dict['patient_id'] = a.patient_id
         # The date of the appointment as an ISO string
         appointment_dict['appointment_date'] = a.appointment_date.isoformat()
+        # The length of the appointment in minutes
+        appointment_dict['duration_minutes'] = a.duration_minutes
         # The notes associated with the appointment
         appointment_dict['notes'] = a.notes
         
         # Add the appointment dictionary to the list
         appointments_list.append(appointment_dict)
     
-    # Return the list of appointments as a JSON object
-    return jsonify({'appointments': appointments_list}), 200
+    # Return the page of appointments as a JSON object
+    response = jsonify({'appointments': appointments_list, 'next_cursor': next_cursor})
+    return add_validators(response, etag, last_modified), 200
+
+def _parse_patient_id(value):
+    """
+    Read the patient_id filter of the appointment list and of the bulk requests.
+
+    :return: The patient ID, or None if not given
+    :raises ValueError: If the value is not an integer
+    """
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError("patient_id must be an integer")
+
+def _decode_calendar_cursor(cursor):
+    """
+    Decode an appointment list cursor into its (appointment_date, series_id, id) sort key (see _page_key).
+    """
+    values = decode_cursor(cursor)
+    try:
+        appointment_date, series_id, appointment_id = values
+        if not isinstance(series_id, int) or not isinstance(appointment_id, int):
+            raise ValueError
+        return to_naive_utc(datetime.fromisoformat(appointment_date)), series_id, appointment_id
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+def _page_key(entry):
+    """
+    Return the sort key of an appointment or occurrence in the appointment list.
+
+    Appointments are keyed (appointment_date, 0, id) and occurrences, which
+    have no ID, (appointment_date, series_id, 0): an occurrence comes after
+    the appointments starting at the same time, and two occurrences of the
+    same time are ordered by series.
+    """
+    if entry.id is None:
+        return entry.appointment_date, entry.series_id, 0
+    return entry.appointment_date, 0, entry.id
+
+def _occurrence_page(start, end, patient_id, after, limit, bound):
+    """
+    Return the series occurrences that can be in a page of the appointment list, in page order.
+
+    The occurrences starting in the window after the cursor are expanded a
+    span at a time, from the cursor (or the start of the window, or the first
+    series), OCCURRENCE_SEARCH_DAYS days first and twice as long each time,
+    until more than a page is found. The search also ends with the window,
+    with the last series, and at bound: an occurrence starting after the
+    first appointment that does not fit in the page cannot be in it either.
+    A calendar window of a week is therefore expanded once, and a list
+    without a window costs a few expansions, not one of every series.
+
+    :param start: The start of the window, or None
+    :param end: The end of the window, or None
+    :param patient_id: Only the occurrences of this patient, or None
+    :param after: The sort key of the last entry of the previous page (see _page_key), or None
+    :param limit: The number of entries of a page
+    :param bound: The start of the first appointment past the page, or None
+    :return: A list of at most about limit + 1 Occurrence objects
+    """
+    bounds = db.session.query(func.min(AppointmentSeries.first_start), func.max(AppointmentSeries.last_end))
+    if patient_id is not None:
+        bounds = bounds.filter(AppointmentSeries.patient_id == patient_id)
+    first_start, last_end = bounds.one()
+    if first_start is None:
+        return []
+
+    low = max(value for value in (first_start, start, after[0] if after else None) if value is not None)
+    high = min(value for value in (last_end, end, bound) if value is not None)
+
+    occurrences = []
+    span = timedelta(days=OCCURRENCE_SEARCH_DAYS)
+    span_start = low
+    while span_start < high and len(occurrences) <= limit:
+        span_end = min(span_start + span, high)
+        # Keep the occurrences starting in the span: the ones overlapping its start were in the previous span
+        occurrences += [
+            occurrence for occurrence in occurrences_between(span_start, span_end, patient_id=patient_id)
+            if span_start <= occurrence.appointment_date < span_end
+            and (after is None or _page_key(occurrence) > after)
+        ]
+        span_start = span_end
+        span *= 2
+    return occurrences
 
 # API to get a single appointment by ID
 @appointments_api_bp.route('/api/appointment/<int:id>', methods=['GET'])
@@ -61,8 +251,12 @@ def get_appointment_by_id(id):
         id: The ID of the appointment (an integer)
         patient_id: The ID of the related patient (an integer)
         appointment_date: The date of the appointment as an ISO string (e.g. '2021-01-01T00:00:00')
+        duration_minutes: The length of the appointment in minutes (an integer)
         notes: The notes associated with the appointment (a string)
     
+    The response carries a strong ETag and a Last-Modified header derived from updated_at; a
+    matching If-None-Match or If-Modified-Since header gets an empty 304 response.
+
     If the appointment is not found, the endpoint returns a 404 error.
     """
     # Get the appointment from the database
@@ -72,6 +266,11 @@ def get_appointment_by_id(id):
     if not appointment:
         # If the appointment was not found, return a 404 error
         return jsonify({"error": "Appointment not found"}), 404
+
+    # If the client already has this version, answer 304 without serializing it
+    etag, last_modified = resource_validators(appointment)
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
     
     # Create a dictionary to represent the appointment
     appointment_data = {
@@ -81,12 +280,14 @@ def get_appointment_by_id(id):
         'patient_id': appointment.patient_id,
         # The date of the appointment as an ISO string
         'appointment_date': appointment.appointment_date.isoformat(),
+        # The length of the appointment in minutes
+        'duration_minutes': appointment.duration_minutes,
         # The notes associated with the appointment
         'notes': appointment.notes
     }
     
     # Return the appointment dictionary as a JSON object
-    return jsonify(appointment_data), 200
+    return add_validators(jsonify(appointment_data), etag, last_modified), 200
 
 # API to add a new appointment
 @appointments_api_bp.route('/api/appointments', methods=['POST'])
@@ -102,11 +303,18 @@ def create_appointment():
         - data (dict): JSON data containing the following keys:
             - patient_id (int): The ID of the patient for the appointment.
             - appointment_date (str): The date and time of the appointment in ISO format.
+            - duration_minutes (int, optional): The length of the appointment in minutes (30 by default).
             - notes (str, optional): Additional notes for the appointment.
 
+    The practice has a single schedule, so the new appointment must not overlap any
+    other appointment (see app.utils.scheduling.find_conflicts).
+
     Returns:
         - If successful, returns a JSON object with a success message and the ID of the new appointment.
-        - If 'patient_id' or 'appointment_date' is missing in the data, returns an error message and status code 400.
+        - If 'patient_id' or 'appointment_date' is missing in the data, or the date or the duration
+          is invalid, returns an error message and status code 400.
+        - If the appointment overlaps other appointments, returns an error message with the IDs of
+          the conflicting appointments ('conflicts') and status code 409.
         - If an error occurs during appointment creation, returns an error message and status code 500.
     """
     # Get the JSON data from the POST request
@@ -116,12 +324,25 @@ def create_appointment():
     if not data.get('patient_id') or not data.get('appointment_date'):
         # If the required fields are missing, return an error message and status code 400
         return jsonify({"error": "Patient ID and appointment date are required"}), 400
+
+    # Read the start and the length of the appointment
+    try:
+        appointment_date = parse_datetime(data['appointment_date'], 'appointment_date')
+        duration_minutes = parse_duration(data.get('duration_minutes'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Reject a double booking (an index range probe on appointment_date)
+    conflicts = find_conflicts(appointment_date, duration_minutes)
+    if conflicts:
+        return _conflict_response(conflicts)
     
     try:
         # Create a new Appointment object with the data
         new_appointment = Appointment(
             patient_id=data['patient_id'],
-            appointment_date=datetime.fromisoformat(data['appointment_date']),
+            appointment_date=appointment_date,
+            duration_minutes=duration_minutes,
             notes=data.get('notes', '')
         )
         
@@ -133,6 +354,12 @@ def create_appointment():
         
         # Return a JSON object with a success message and the ID of the new appointment
         return jsonify({"message": "Appointment created successfully", "appointment_id": new_appointment.id}), 201
+    except IntegrityError as e:
+        # On PostgreSQL, a concurrent booking of the same time is rejected by the exclusion constraint
+        db.session.rollback()
+        if is_conflict_error(e):
+            return _conflict_response(find_conflicts(appointment_date, duration_minutes))
+        return jsonify({"error": str(e)}), 500
     except Exception as e:
         # If an error occurs during appointment creation, return an error message and status code 500
         return jsonify({"error": str(e)}), 500
@@ -147,8 +374,12 @@ def update_appointment(id):
 
     This function handles the updating of an appointment from the database.
     It checks if the appointment exists and, if found, updates the appointment's
-    patient ID, appointment date, and notes. The user must be logged in and
-    have the appropriate role to perform this action.
+    patient ID, appointment date, duration (duration_minutes) and notes. The
+    user must be logged in and have the appropriate role to perform this action.
+
+    If the new date or duration makes the appointment overlap another one, the
+    update is rejected with status code 409 and the IDs of the conflicting
+    appointments ('conflicts'). An invalid date or duration returns a 400 error.
 
     Parameters:
         id (int): The ID of the appointment to be updated. This is passed as a
@@ -165,13 +396,29 @@ def update_appointment(id):
     # Get the JSON data from the PUT request
     data = request.json
 
+    # Read the new start and length of the appointment, keeping the current ones if not provided
+    try:
+        appointment_date = parse_datetime(data.get('appointment_date'), 'appointment_date') or appointment.appointment_date
+        if 'duration_minutes' in data:
+            duration_minutes = parse_duration(data['duration_minutes'])
+        else:
+            duration_minutes = appointment.duration_minutes
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Only a change of time can create a double booking
+    if (appointment_date, duration_minutes) != (appointment.appointment_date, appointment.duration_minutes):
+        conflicts = find_conflicts(appointment_date, duration_minutes, exclude_id=appointment.id)
+        if conflicts:
+            return _conflict_response(conflicts)
+
     try:
         # Update the appointment's patient ID if it was provided
         appointment.patient_id = data.get('patient_id', appointment.patient_id)
 
-        # Update the appointment's date if it was provided
-        if data.get('appointment_date'):
-            appointment.appointment_date = datetime.fromisoformat(data['appointment_date'])
+        # Update the appointment's date and duration
+        appointment.appointment_date = appointment_date
+        appointment.duration_minutes = duration_minutes
 
         # Update the appointment's notes if they were provided
         appointment.notes = data.get('notes', appointment.notes)
@@ -181,6 +428,12 @@ def update_appointment(id):
 
         # Return a JSON object with a success message and the ID of the updated appointment
         return jsonify({"message": "Appointment updated successfully", "appointment_id": appointment.id}), 200
+    except IntegrityError as e:
+        # On PostgreSQL, a concurrent booking of the same time is rejected by the exclusion constraint
+        db.session.rollback()
+        if is_conflict_error(e):
+            return _conflict_response(find_conflicts(appointment_date, duration_minutes, exclude_id=id))
+        return jsonify({"error": str(e)}), 500
     except Exception as e:
         # If an error occurs during appointment update, return an error message and status code 500
         return jsonify({"error": str(e)}), 500
@@ -221,3 +474,321 @@ def delete_appointment(id):
     except Exception as e:
         # If an error occurs during appointment deletion, return an error message and status code 500
         return jsonify({"error": str(e)}), 500
+
+
+# API to audit the existing appointments for double bookings
+@appointments_api_bp.route('/api/appointments/conflicts', methods=['GET'])
+@login_required
+@role_required('admin', 'user')
+def get_appointment_conflicts():
+    """
+    This API endpoint lists the pairs of overlapping appointments.
+
+    New and updated appointments are checked for overlaps, but appointments
+    created before durations existed, or by other means, may still overlap.
+    This endpoint finds them with a single sweep over the appointments in
+    start order (see app.utils.scheduling.find_all_conflicts).
+
+    The endpoint requires the user to be logged in and have the role 'admin' or 'user'.
+
+    Query parameters:
+        - from (str, optional): Only report overlaps ending after this ISO datetime.
+        - to (str, optional): Only report overlaps of appointments starting before this ISO datetime.
+
+    Returns:
+        - A JSON object with the keys 'count' (the number of conflicts) and 'conflicts', a list of
+          dictionaries with the keys 'appointment_ids' (the two overlapping appointments, earliest
+          first), 'overlap_start' and 'overlap_end' (ISO strings).
+        - If 'from' or 'to' is not an ISO datetime, returns an error message and status code 400.
+    """
+    # Read the audited period
+    try:
+        start = parse_datetime(request.args.get('from'), 'from')
+        end = parse_datetime(request.args.get('to'), 'to')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if start is not None and end is not None and start >= end:
+        return jsonify({"error": "from must be before to"}), 400
+
+    conflicts = find_all_conflicts(start, end)
+    return jsonify({'count': len(conflicts), 'conflicts': conflicts}), 200
+
+
+# API to find the free slots of a period
+@appointments_api_bp.route('/api/appointments/free_slots', methods=['GET'])
+@login_required
+@role_required('admin', 'user')
+def get_free_slots():
+    """
+    This API endpoint returns the free slots of each day of a period, for booking appointments.
+
+    The endpoint requires the user to be logged in and have the role 'admin' or 'user'.
+
+    Query parameters:
+        - from (str): The first day of the period, as an ISO date (e.g. '2024-05-06').
+        - to (str, optional): The last day of the period, included (the 'from' day by default).
+          The period is at most 31 days long.
+        - opens (str, optional): The opening time of each day (e.g. '09:00', the default).
+        - closes (str, optional): The closing time of each day (e.g. '17:00', the default).
+        - slot_minutes (int, optional): The length of the slots in minutes (30 by default).
+
+    The busy times of each day are cached, so the slots of days already looked at are computed
+    without any query; the days missing from the cache are loaded with one range query over the
+    appointment_date index, and each day is swept once in start order (see
+    app.utils.scheduling.find_free_slots). Creating, updating or deleting an appointment drops
+    the cached busy times of its day.
+
+    Returns:
+        - A JSON object with the keys 'slot_minutes' and 'days', a list with one dictionary per
+          day, with the keys 'date' (an ISO date) and 'slots' (a list of dictionaries with the
+          keys 'start' and 'end', ISO datetimes).
+        - If a parameter is missing or invalid, returns an error message and status code 400.
+    """
+    # Read the period, the opening hours and the slot length
+    try:
+        if not request.args.get('from'):
+            raise ValueError("from is required")
+        first_day = _parse_date(request.args['from'], 'from')
+        last_day = _parse_date(request.args['to'], 'to') if request.args.get('to') else first_day
+        opens = parse_time_of_day(request.args.get('opens'), 'opens', OPENING_TIME)
+        closes = parse_time_of_day(request.args.get('closes'), 'closes', CLOSING_TIME)
+        slot_minutes = parse_duration(request.args.get('slot_minutes'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if last_day < first_day:
+        return jsonify({"error": "to must not be before from"}), 400
+    if (last_day - first_day).days >= MAX_SLOT_SEARCH_DAYS:
+        return jsonify({"error": f"The period is limited to {MAX_SLOT_SEARCH_DAYS} days"}), 400
+    if opens >= closes:
+        return jsonify({"error": "opens must be before closes"}), 400
+
+    days = find_free_slots(first_day, last_day, opens, closes, slot_minutes)
+    return jsonify({'slot_minutes': slot_minutes, 'days': days}), 200
+
+
+# API to get the booking heatmap of a period
+@appointments_api_bp.route('/api/appointments/stats/heatmap', methods=['GET'])
+@login_required
+@role_required('admin')
+def get_appointment_heatmap():
+    """
+    This API endpoint returns the number of appointments booked in each hour of each day of a period.
+
+    The endpoint requires the user to be logged in and have the role 'admin'.
+
+    Query parameters:
+        - from (str): The first day of the period, as an ISO date (e.g. '2024-01-01').
+        - to (str, optional): The last day of the period, included (the 'from' day by default).
+          The period is at most 731 days long.
+
+    The appointments are counted by the database (a GROUP BY on the day and the hour over a range
+    scan of the appointment_date index, or a numpy.bincount over the start times on SQLite) and
+    are never loaded as objects; the occurrences of appointment series are counted as well. The
+    counts of finished days are cached, so a heatmap of the past year only counts today and the
+    days ahead again; creating, updating or deleting an appointment drops the counts of its day.
+
+    Returns:
+        - A JSON object with the keys:
+            - 'days': a list with one dictionary per day, with the keys 'date' (an ISO date),
+              'hours' (a list of 24 counts, the first one for 00:00-01:00) and 'total'.
+            - 'weekdays': a list of 7 lists of 24 counts, the hourly totals of each day of the
+              week over the period, from Monday to Sunday.
+            - 'total': the number of appointments of the period.
+        - If a parameter is missing or invalid, returns an error message and status code 400.
+    """
+    # Read the period
+    try:
+        if not request.args.get('from'):
+            raise ValueError("from is required")
+        first_day = _parse_date(request.args['from'], 'from')
+        last_day = _parse_date(request.args['to'], 'to') if request.args.get('to') else first_day
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if last_day < first_day:
+        return jsonify({"error": "to must not be before from"}), 400
+    if (last_day - first_day).days >= MAX_STATS_DAYS:
+        return jsonify({"error": f"The period is limited to {MAX_STATS_DAYS} days"}), 400
+
+    heatmap = appointment_heatmap(first_day, last_day)
+
+    # The day-of-week view adds up the days of the same weekday
+    weekdays = [[0] * 24 for _ in range(7)]
+    days = []
+    for day, hours in heatmap.items():
+        weekday = weekdays[day.weekday()]
+        for hour, count in enumerate(hours):
+            weekday[hour] += count
+        days.append({'date': day.isoformat(), 'hours': hours, 'total': sum(hours)})
+
+    return jsonify({'days': days, 'weekdays': weekdays, 'total': sum(day['total'] for day in days)}), 200
+
+
+# API to move many appointments at once
+@appointments_api_bp.route('/api/appointments/bulk_reschedule', methods=['POST'])
+@login_required
+@role_required('admin', 'user')
+def bulk_reschedule_appointments():
+    """
+    This API endpoint moves many appointments by the same time, e.g. when a dentist is out sick.
+
+    The endpoint requires the user to be logged in and have the role 'admin' or 'user'.
+
+    Parameters:
+        - data (dict): JSON data containing the following keys:
+            - ids (list of int): The IDs of the appointments to move, or
+            - filter (dict): The appointments to move, with the keys 'from' and 'to' (ISO
+              datetimes: the appointments starting in [from, to)) and, optionally, 'patient_id'.
+            - shift_minutes (int): The number of minutes to move the appointments by, negative
+              to move them earlier (e.g. 10080 for one week later).
+
+    At most 500 appointments are moved at once. The appointments at their new times are checked
+    for overlaps with two range queries, and are then moved with a single set-based UPDATE in one
+    transaction (see app.utils.scheduling.reschedule_appointments). The move is all or nothing:
+    if any appointment would overlap another one, none is moved. Occurrences of recurring series
+    are not appointments and are moved with the series endpoints.
+
+    Returns:
+        - A JSON object with the counts 'rescheduled', 'not_found' and 'conflicts', and 'results':
+          one dictionary per requested appointment with the keys 'id' and 'status' -
+          'rescheduled' (with the new 'appointment_date'), 'not_found', 'conflict' (with the
+          conflicting appointments in 'conflicts') or 'unchanged' (when others conflict).
+        - Status code 200 if the appointments were moved, 409 if none was moved because of
+          conflicts, or 400 if the request is invalid.
+    """
+    data = request.json or {}
+
+    shift_minutes = data.get('shift_minutes')
+    if isinstance(shift_minutes, bool) or not isinstance(shift_minutes, int) or shift_minutes == 0:
+        return jsonify({"error": "shift_minutes must be a non-zero whole number of minutes"}), 400
+    if abs(shift_minutes) > 366 * 24 * 60:
+        return jsonify({"error": "shift_minutes must be at most one year"}), 400
+    shift = timedelta(minutes=shift_minutes)
+
+    try:
+        ids, rows = _select_bulk(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        conflicts = {moved.id: overlapping for moved, overlapping in reschedule_appointments(rows, shift)}
+    except IntegrityError as e:
+        # On PostgreSQL, an appointment booked concurrently into the new times is rejected at commit
+        db.session.rollback()
+        if is_conflict_error(e):
+            return jsonify({"error": "The appointments overlap appointments booked meanwhile; retry the request"}), 409
+        return jsonify({"error": str(e)}), 500
+
+    results = []
+    for row in rows:
+        if conflicts:
+            result = {'id': row.id, 'status': 'conflict' if row.id in conflicts else 'unchanged'}
+            if row.id in conflicts:
+                result['conflicts'] = conflict_summary(conflicts[row.id])
+        else:
+            result = {'id': row.id, 'status': 'rescheduled', 'appointment_date': (row.appointment_date + shift).isoformat()}
+        results.append(result)
+    results += _not_found_results(ids, rows)
+
+    summary = {
+        'rescheduled': 0 if conflicts else len(rows),
+        'not_found': len(results) - len(rows),
+        'conflicts': len(conflicts),
+        'results': results
+    }
+    return jsonify(summary), 409 if conflicts else 200
+
+# API to cancel many appointments at once
+@appointments_api_bp.route('/api/appointments/bulk_cancel', methods=['POST'])
+@login_required
+@role_required('admin', 'user')
+def bulk_cancel_appointments():
+    """
+    This API endpoint cancels (deletes) many appointments at once.
+
+    The endpoint requires the user to be logged in and have the role 'admin' or 'user'.
+
+    Parameters:
+        - data (dict): JSON data containing either 'ids' (the IDs of the appointments to cancel)
+          or 'filter' (a dictionary with the keys 'from', 'to' and, optionally, 'patient_id'),
+          like bulk_reschedule_appointments.
+
+    At most 500 appointments are cancelled at once, with a single set-based DELETE in one
+    transaction.
+
+    Returns:
+        - A JSON object with the counts 'cancelled' and 'not_found', and 'results': one
+          dictionary per requested appointment with the keys 'id' and 'status' ('cancelled' or
+          'not_found').
+        - If the request is invalid, an error message and status code 400.
+    """
+    data = request.json or {}
+
+    try:
+        ids, rows = _select_bulk(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    cancel_appointments(rows)
+
+    results = [{'id': row.id, 'status': 'cancelled'} for row in rows] + _not_found_results(ids, rows)
+    return jsonify({'cancelled': len(rows), 'not_found': len(results) - len(rows), 'results': results}), 200
+
+def _select_bulk(data):
+    """
+    Read the 'ids' or 'filter' of a bulk request and select the appointments.
+
+    :return: A tuple (requested IDs or None for a filter, selected rows)
+    :raises ValueError: If the request is invalid
+    """
+    if 'ids' in data:
+        ids = data['ids']
+        if not isinstance(ids, list) or not ids or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            raise ValueError("ids must be a non-empty list of appointment IDs")
+        if len(ids) > MAX_BULK_APPOINTMENTS:
+            raise ValueError(f"At most {MAX_BULK_APPOINTMENTS} appointments can be changed at once")
+        ids = list(dict.fromkeys(ids))
+        return ids, select_bulk_appointments(ids=ids)
+
+    criteria = data.get('filter')
+    if not isinstance(criteria, dict):
+        raise ValueError("ids or filter is required")
+    start = parse_datetime(criteria.get('from'), 'from')
+    end = parse_datetime(criteria.get('to'), 'to')
+    if start is None or end is None:
+        raise ValueError("filter must have from and to")
+    if start >= end:
+        raise ValueError("from must be before to")
+    patient_id = _parse_patient_id(criteria.get('patient_id'))
+    return None, select_bulk_appointments(start=start, end=end, patient_id=patient_id)
+
+def _not_found_results(ids, rows):
+    """
+    Return the results of the requested IDs that matched no appointment.
+    """
+    if ids is None:
+        return []
+    found = {row.id for row in rows}
+    return [{'id': i, 'status': 'not_found'} for i in ids if i not in found]
+
+def _parse_date(value, name):
+    """
+    Read an ISO date argument ('2024-05-06').
+
+    :raises ValueError: If the value is not an ISO date
+    """
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO date (e.g. '2024-05-06')")
+
+
+def _conflict_response(conflicts):
+    """
+    Return the 409 response rejecting an appointment that overlaps other appointments.
+
+    :param conflicts: The overlapping appointments and series occurrences
+    """
+    return jsonify({"error": "The appointment overlaps other appointments", "conflicts": conflict_summary(conflicts)}), 409
@@ -0,0 +1,308 @@
+# app/apis/calendar_feed_api.py
+
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import Blueprint, Response, request, jsonify, session, url_for, stream_with_context
+from sqlalchemy import func
+from app import db
+from app.models import Appointment, AppointmentSeries, Patient, CalendarFeedToken
+from app.authentication_decorators import login_required, role_required
+from app.utils.conditional import collection_validators, is_not_modified, not_modified_response, add_validators
+from app.utils.feed_tokens import FEED_ROLES, create_feed_token, verify_feed_token, revoke_feed_token
+from app.utils.icalendar import calendar_header, calendar_footer, format_event
+from app.utils.recurrence import occurrences_between
+from app.utils.scheduling import parse_datetime
+
+calendar_feed_api_bp = Blueprint('calendar_feed_api', __name__)
+
+# Default window of a feed: from FEED_PAST_DAYS days ago to FEED_FUTURE_DAYS days ahead
+FEED_PAST_DAYS = 30
+FEED_FUTURE_DAYS = 180
+
+# Longest window of a feed, in days
+MAX_FEED_DAYS = 400
+
+# Appointments fetched from the database, and written to the response, per batch
+FEED_BATCH_SIZE = 500
+
+
+def feed_access_required(f):
+    """
+    Checks that the request may read the calendar feeds: with a feed token, or with a logged-in session.
+
+    Calendar applications cannot log in, so a request carrying a 'token' query
+    parameter is authenticated by the token alone (see
+    app.utils.feed_tokens): an invalid or revoked token gets a 401 error.
+    Without a token, the user must be logged in and have the role 'admin'
+    or 'user', as for the other endpoints.
+
+    :param f: The feed endpoint.
+    :return: The wrapped function.
+    """
+    session_required = role_required(*FEED_ROLES)(f)
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        value = request.args.get('token')
+        if value is None:
+            return session_required(*args, **kwargs)
+        if verify_feed_token(value) is None:
+            return jsonify({"error": "Invalid or revoked feed token"}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+# Practice calendar feed
+@calendar_feed_api_bp.route('/api/calendar/appointments.ics', methods=['GET'])
+@feed_access_required
+def practice_calendar_feed():
+    """
+    This API endpoint returns the schedule of the practice as an iCalendar (.ics) feed.
+
+    The endpoint requires a feed token in the 'token' query parameter (see
+    /api/calendar/feed_tokens), which is how calendar applications subscribe, or a logged-in
+    user with the role 'admin' or 'user'.
+
+    Calendar applications subscribe to the feed and poll it every few minutes. The feed holds
+    one VEVENT per appointment and per occurrence of an appointment series in a bounded window,
+    by default from 30 days ago to 180 days ahead, which the following optional query parameters
+    change:
+        from: The start of the window (an ISO date or datetime)
+        to: The end of the window (an ISO date or datetime), at most 400 days after from
+
+    The response carries an ETag computed over the appointments, the series and the patient names
+    of the window with a few aggregate queries. A client polling with If-None-Match gets an empty
+    304 response when nothing changed, without any appointment being loaded or formatted. There is
+    no Last-Modified header, and If-Modified-Since is ignored: a deleted appointment would not make
+    the feed any newer (see collection_validators).
+
+    Otherwise, the feed is streamed: the appointments are read from a range scan of the
+    appointment_date index in batches of 500 and each batch is written as soon as it is
+    formatted, so the memory used does not depend on the size of the window.
+
+    If a parameter is invalid, the endpoint returns a 400 error.
+    """
+    return _calendar_feed('Dental clinic appointments')
+
+# Calendar feed of one patient
+@calendar_feed_api_bp.route('/api/calendar/patients/<int:patient_id>.ics', methods=['GET'])
+@feed_access_required
+def patient_calendar_feed(patient_id):
+    """
+    This API endpoint returns the appointments of one patient as an iCalendar (.ics) feed.
+
+    The endpoint requires a feed token in the 'token' query parameter or a logged-in user with the
+    role 'admin' or 'user', like the practice feed.
+
+    It accepts the same 'from' and 'to' query parameters as the practice feed
+    (/api/calendar/appointments.ics) and supports conditional requests the same way. The
+    appointments are read from a range scan of the (patient_id, appointment_date) index.
+
+    If the patient does not exist, the endpoint returns a 404 error. If a parameter is invalid,
+    the endpoint returns a 400 error.
+    """
+    patient = db.session.get(Patient, patient_id)
+    if patient is None:
+        return jsonify({"error": "Patient not found"}), 404
+
+    return _calendar_feed(f'Appointments of {patient.first_name} {patient.last_name}', patient_id)
+
+# Create a feed token
+@calendar_feed_api_bp.route('/api/calendar/feed_tokens', methods=['POST'])
+@login_required
+@role_required('admin', 'user')
+def create_calendar_feed_token():
+    """
+    This API endpoint creates a feed token for the logged-in user and returns the subscription URLs.
+
+    The endpoint requires the user to be logged in and have the role 'admin' or 'user'.
+
+    Calendar applications (Google Calendar, Apple Calendar, Outlook) subscribe to a URL and cannot
+    log in, so the returned URLs carry the signed token in their 'token' query parameter:
+        token: The signed token
+        practice_url: The subscription URL of the practice feed
+        patient_url_template: The subscription URL of a patient feed, with {patient_id} to replace
+
+    Anyone holding the URL can read the feeds until the token is revoked, so it must be kept
+    private. The response has a 201 status code.
+    """
+    token, value = create_feed_token(session['user_id'])
+    db.session.commit()
+
+    result = token.serialize()
+    result['token'] = value
+    result['practice_url'] = url_for('calendar_feed_api.practice_calendar_feed', token=value, _external=True)
+    result['patient_url_template'] = url_for(
+        'calendar_feed_api.patient_calendar_feed', patient_id=0, token=value, _external=True
+    ).replace('/patients/0.ics', '/patients/{patient_id}.ics')
+    return jsonify(result), 201
+
+# List the feed tokens of the logged-in user
+@calendar_feed_api_bp.route('/api/calendar/feed_tokens', methods=['GET'])
+@login_required
+@role_required('admin', 'user')
+def list_calendar_feed_tokens():
+    """
+    This API endpoint returns the feed tokens of the logged-in user, active and revoked, newest first.
+
+    The endpoint requires the user to be logged in and have the role 'admin' or 'user'. The signed
+    tokens themselves are only returned when they are created.
+    """
+    tokens = db.session.execute(
+        db.select(CalendarFeedToken)
+        .where(CalendarFeedToken.user_id == session['user_id'])
+        .order_by(CalendarFeedToken.id.desc())
+    ).scalars()
+    return jsonify([token.serialize() for token in tokens]), 200
+
+# Revoke a feed token
+@calendar_feed_api_bp.route('/api/calendar/feed_tokens/<int:id>', methods=['DELETE'])
+@login_required
+@role_required('admin', 'user')
+def revoke_calendar_feed_token(id):
+    """
+    This API endpoint revokes a feed token: the subscriptions using it stop receiving the feeds.
+
+    The endpoint requires the user to be logged in and have the role 'admin' or 'user'. Users can
+    revoke their own tokens; admins can revoke any token. The token is kept, marked as revoked.
+
+    If the token does not exist (or belongs to another user, for a non-admin), the endpoint
+    returns a 404 error.
+    """
+    token = db.session.get(CalendarFeedToken, id)
+    if token is None or (token.user_id != session['user_id'] and session.get('role') != 'admin'):
+        return jsonify({"error": "Feed token not found"}), 404
+
+    revoke_feed_token(token)
+    db.session.commit()
+    return jsonify({"message": "Feed token revoked", "token": token.serialize()}), 200
+
+
+def _calendar_feed(name, patient_id=None):
+    """
+    Answer a feed request: 400 for an invalid window, 304 if unchanged, or the streamed feed.
+
+    :param name: The name of the calendar
+    :param patient_id: The patient of the feed, or None for the whole practice
+    """
+    try:
+        start, end = _parse_window()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # The conditions of the window, shared by the validators and the feed query
+    criteria = [Appointment.appointment_date >= start, Appointment.appointment_date < end]
+    series_criteria = [AppointmentSeries.first_start < end, AppointmentSeries.last_end > start]
+    if patient_id is not None:
+        criteria.append(Appointment.patient_id == patient_id)
+        series_criteria.append(AppointmentSeries.patient_id == patient_id)
+
+    # Answer 304 if the appointments, the series and the patient names of the window did not change
+    etag, last_modified = _feed_validators(criteria, series_criteria, (name, start, end))
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+
+    response = Response(
+        stream_with_context(_generate_feed(name, criteria, start, end, patient_id)),
+        mimetype='text/calendar'
+    )
+    response.headers['Content-Disposition'] = 'inline; filename="appointments.ics"'
+    return add_validators(response, etag, last_modified)
+
+
+def _parse_window():
+    """
+    Read the window of a feed from the 'from' and 'to' query parameters, with their defaults.
+
+    :return: A tuple (start, end)
+    :raises ValueError: If a parameter is invalid or the window is empty or too long
+    """
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    start = parse_datetime(request.args.get('from'), 'from') or today - timedelta(days=FEED_PAST_DAYS)
+    end = parse_datetime(request.args.get('to'), 'to') or start + timedelta(days=FEED_PAST_DAYS + FEED_FUTURE_DAYS)
+
+    if start >= end:
+        raise ValueError("from must be before to")
+    if end - start > timedelta(days=MAX_FEED_DAYS):
+        raise ValueError(f"The window is limited to {MAX_FEED_DAYS} days")
+    return start, end
+
+
+def _feed_validators(criteria, series_criteria, variant):
+    """
+    Return the ETag of a feed, and no Last-Modified time (see collection_validators).
+
+    The feed changes when one of its appointments or series changes, and when
+    a patient of the window is renamed (the names are in the event titles), so
+    the validators combine the aggregates of the three: the ETags of the
+    series and of the patients are part of the variant of the appointments'.
+
+    :param criteria: The conditions on the appointments of the window
+    :param series_criteria: The conditions on the series of the window
+    :param variant: Values that select the representation (the name and the window)
+    :return: A tuple (etag, None)
+    """
+    series_etag, _ = collection_validators(AppointmentSeries, *series_criteria)
+
+    patient_ids = db.select(Appointment.patient_id).where(*criteria).union(
+        db.select(AppointmentSeries.patient_id).where(*series_criteria)
+    )
+    patients_modified = db.session.query(
+        func.max(func.coalesce(Patient.updated_at, Patient.created_at))
+    ).filter(Patient.id.in_(patient_ids)).scalar()
+
+    return collection_validators(
+        Appointment, *criteria,
+        variant=(variant, series_etag, patients_modified.isoformat() if patients_modified else None)
+    )
+
+
+def _generate_feed(name, criteria, start, end, patient_id):
+    """
+    Yield the feed in pieces: the header, one piece per batch of appointments, the series occurrences and the footer.
+
+    Only the columns the events need are selected, with the patient names
+    joined in, and the rows are fetched FEED_BATCH_SIZE at a time.
+    """
+    host = request.host
+
+    yield calendar_header(name)
+
+    rows = db.session.execute(
+        db.select(
+            Appointment.id, Appointment.appointment_date, Appointment.duration_minutes, Appointment.notes,
+            func.coalesce(Appointment.updated_at, Appointment.created_at), Patient.first_name, Patient.last_name
+        )
+        .join(Patient, Patient.id == Appointment.patient_id)
+        .where(*criteria)
+        .order_by(Appointment.appointment_date, Appointment.id)
+        .execution_options(yield_per=FEED_BATCH_SIZE)
+    )
+    for batch in rows.partitions():
+        yield ''.join(
+            format_event(
+                f'appointment-{appointment_id}@{host}', appointment_date, duration_minutes,
+                f'Appointment: {first_name} {last_name}', notes, changed_at
+            )
+            for appointment_id, appointment_date, duration_minutes, notes, changed_at, first_name, last_name in batch
+        )
+
+    # The series of the window are few: they are expanded for the window only
+    occurrences = occurrences_between(start, end, patient_id=patient_id)
+    if occurrences:
+        names = {
+            patient: f'{first_name} {last_name}'
+            for patient, first_name, last_name in db.session.execute(
+                db.select(Patient.id, Patient.first_name, Patient.last_name)
+                .where(Patient.id.in_({occurrence.patient_id for occurrence in occurrences}))
+            )
+        }
+        yield ''.join(
+            format_event(
+                f'series-{occurrence.series_id}-{occurrence.occurrence_start:%Y%m%dT%H%M%S}@{host}',
+                occurrence.appointment_date, occurrence.duration_minutes,
+                f'Appointment: {names.get(occurrence.patient_id, "")}', occurrence.notes
+            )
+            for occurrence in occurrences
+        )
+
+    yield calendar_footer()
@@ -1,7 +1,12 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, session
 from app import db
-from app.models import InventoryItem
+from app.models import InventoryItem, InventoryMovement
 from app.authentication_decorators import login_required, role_required
+from app.utils.conditional import (
+    resource_validators, collection_validators, is_not_modified, not_modified_response, add_validators
+)
+from app.utils.pagination import parse_page_args, keyset_page
+from app.utils.stock import parse_adjustments, adjust_stock, record_initial_stock
 
 inventory_api_bp = Blueprint('inventory_api', __name__)
 
@@ -35,7 +40,16 @@ def get_all_inventory_items():
 
     The list of dictionaries is then returned as a JSON response, with a status
     code of 200.
+
+    The response carries a collection-level ETag (and no Last-Modified, see
+    collection_validators). If the client sends a matching If-None-Match
+    header, an empty 304 response is returned without loading the items.
     """
+    # Answer 304 if the inventory did not change since the client's copy
+    etag, last_modified = collection_validators(InventoryItem)
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+
     # Retrieve all inventory items from the database
     items = InventoryItem.query.all()
 
@@ -60,7 +74,7 @@ def get_all_inventory_items():
     ]
 
     # Return the list of dictionaries as a JSON response, with a status code of 200
-    return jsonify(items_list), 200
+    return add_validators(jsonify(items_list), etag, last_modified), 200
 
 # API to get a single inventory item by ID
 @inventory_api_bp.route('/api/inventory/<int:id>', methods=['GET'])
@@ -93,6 +107,10 @@ def get_inventory_item_by_id(id):
     will only allow users with the role 'admin' or 'user' to access this
     endpoint.
 
+    The response carries a strong ETag and a Last-Modified header derived from
+    updated_at; a matching If-None-Match or If-Modified-Since header gets an
+    empty 304 response.
+
     If the item is not found in the database, the API endpoint will return a
     JSON response with an error message, and a status code of 404.
     """
@@ -104,6 +122,11 @@ def get_inventory_item_by_id(id):
     if not item:
         return jsonify({"error": "Item not found"}), 404
 
+    # If the client already has this version, answer 304 without serializing it
+    etag, last_modified = resource_validators(item)
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+
     # Convert the InventoryItem object into a dictionary
     item_data = {
         # The ID of the inventory item
@@ -121,7 +144,7 @@ def get_inventory_item_by_id(id):
     }
 
     # Return the dictionary as a JSON response, with a status code of 200
-    return jsonify(item_data), 200
+    return add_validators(jsonify(item_data), etag, last_modified), 200
 
 # API to add a new inventory item
 @inventory_api_bp.route('/api/inventory', methods=['POST'])
@@ -176,8 +199,10 @@ def add_inventory_item():
         unit=data.get('unit', '')
     )
 
-    # Add the new item to the database
+    # Add the new item to the database, with its quantity as the first movement of its ledger
     db.session.add(new_item)
+    db.session.flush()
+    record_initial_stock(new_item, session.get('user_id'))
 
     # Commit the database changes
     db.session.commit()
@@ -198,15 +223,21 @@ def update_inventory_item(id):
     and then updates the name, description, quantity, threshold, and unit fields with the new data.
     Finally, it commits the changes to the database.
 
+    A new quantity is applied as a stock movement: the item row is locked while the difference
+    with the current quantity is computed, and the difference is applied and recorded in the
+    inventory ledger (see app.utils.stock.adjust_stock). To add or remove stock, prefer
+    POST /api/inventory/<id>/adjust, which does not need to know the current quantity.
+
     Parameters:
         id (int): The ID of the inventory item to be updated. This is passed as a URL parameter in the route.
 
     Returns:
         - If the item is found and updated successfully, returns a JSON response with a success message and a status code of 200.
         - If the item is not found, returns a JSON response with an error message and a status code of 404.
+        - If the quantity is not a non-negative integer, returns an error message and a status code of 400.
     """
-    # Retrieve the inventory item from the database using its ID
-    item = InventoryItem.query.get(id)
+    # Retrieve the inventory item from the database using its ID, locking it until the commit
+    item = db.session.get(InventoryItem, id, with_for_update=True, populate_existing=True)
 
     # Check if the item exists
     if not item:
@@ -215,13 +246,27 @@ def update_inventory_item(id):
     # Get the JSON data from the PUT request
     data = request.json
 
+    # Read the new quantity before changing anything
+    delta = 0
+    if 'quantity' in data:
+        try:
+            quantity = int(data['quantity'])
+        except (TypeError, ValueError):
+            return jsonify({"error": "quantity must be an integer"}), 400
+        if quantity < 0:
+            return jsonify({"error": "quantity must not be negative"}), 400
+        delta = quantity - item.quantity
+
     # Update the item with the new data
     item.name = data.get('name', item.name)  # Update name
     item.description = data.get('description', item.description)  # Update description
-    item.quantity = int(data.get('quantity', item.quantity))  # Update quantity
     item.threshold = int(data.get('threshold', item.threshold))  # Update threshold
     item.unit = data.get('unit', item.unit)  # Update unit
 
+    # Apply the new quantity as a movement of the ledger
+    if delta:
+        adjust_stock([{'item_id': id, 'delta': delta, 'reason': 'Quantity edited'}], session.get('user_id'))
+
     # Commit the changes to the database
     db.session.commit()
 
@@ -275,3 +320,139 @@ def delete_inventory_item(id):
     # Return a JSON response with a success message and a status code of 200
     # This indicates that the item was deleted successfully
     return jsonify({"message": "Inventory item deleted successfully"}), 200
+
+# API to add or remove stock of an inventory item
+@inventory_api_bp.route('/api/inventory/<int:id>/adjust', methods=['POST'])
+@login_required
+@role_required('admin', 'user')
+def adjust_inventory_item(id):
+    """
+    API endpoint to add stock to, or take stock out of, an inventory item.
+
+    Parameters:
+        - id (int): The ID of the inventory item.
+        - data (dict): JSON data with either:
+            - delta (int): The change of the quantity, negative for stock taken out (e.g. -2
+              when two boxes of gloves are used), and reason (str, optional), or
+            - adjustments (list): Several such changes, e.g. one per use, applied together.
+
+    Unlike PUT /api/inventory/<id>, the client sends the change, not the new quantity: the
+    database applies it to the current quantity with a single UPDATE, so two assistants taking
+    stock at the same time both get counted. Every change is recorded in the inventory ledger
+    (see GET /api/inventory/<id>/movements). The adjustments of a request are applied in one
+    transaction: all of them or none.
+
+    Returns:
+        - A JSON object with the keys 'quantity' (the new quantity of the item) and 'movements'
+          (one dictionary per adjustment, with the keys 'item_id', 'delta', 'quantity_after'
+          and 'movement_id'), with a status code of 200.
+        - If the data is invalid, returns an error message and a status code of 400.
+        - If the item is not found, returns an error message and a status code of 404.
+        - If the quantity would go below zero, returns an error message with the quantity left
+          and a status code of 409; nothing is changed.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "A JSON object is required"}), 400
+
+    try:
+        entries = data['adjustments'] if 'adjustments' in data else [data]
+        adjustments = parse_adjustments(entries, item_id=id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    results, errors = adjust_stock(adjustments, session.get('user_id'))
+    if errors:
+        db.session.rollback()
+        return _adjustment_error_response(errors)
+
+    db.session.commit()
+    return jsonify({'quantity': results[-1]['quantity_after'], 'movements': results}), 200
+
+# API to adjust the stock of several inventory items at once
+@inventory_api_bp.route('/api/inventory/adjust', methods=['POST'])
+@login_required
+@role_required('admin', 'user')
+def adjust_inventory_items():
+    """
+    API endpoint to apply a batch of stock adjustments to several inventory items in one transaction.
+
+    Parameters:
+        - data (dict): JSON data with the key 'adjustments', a list of at most 100 dictionaries
+          with the keys 'item_id' (int), 'delta' (int, non-zero, negative for stock taken out)
+          and 'reason' (str, optional), e.g. the supplies used for one treatment or received in
+          one delivery.
+
+    Each item is changed with a single atomic UPDATE (the adjustments of the same item are
+    added up first), and every adjustment is recorded in the inventory ledger. The batch is all
+    or nothing: if an item is missing or would go below zero, nothing is changed.
+
+    Returns:
+        - A JSON object with the key 'movements' (one dictionary per adjustment, in order, with
+          the keys 'item_id', 'delta', 'quantity_after' and 'movement_id'), with a status code of 200.
+        - If the data is invalid, returns an error message and a status code of 400.
+        - If items are not found, returns the errors of every item with a status code of 404.
+        - If items would go below zero, returns the errors of every item with a status code of 409.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "A JSON object is required"}), 400
+
+    try:
+        adjustments = parse_adjustments(data.get('adjustments'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    results, errors = adjust_stock(adjustments, session.get('user_id'))
+    if errors:
+        db.session.rollback()
+        return _adjustment_error_response(errors)
+
+    db.session.commit()
+    return jsonify({'movements': results}), 200
+
+# API to get the stock movements of an inventory item
+@inventory_api_bp.route('/api/inventory/<int:id>/movements', methods=['GET'])
+@login_required
+@role_required('admin', 'user')
+def get_inventory_item_movements(id):
+    """
+    API endpoint returning the ledger of an inventory item: its stock movements, oldest first.
+
+    Query parameters:
+        - limit (int, optional): The number of movements per page (50 by default, at most 500).
+        - cursor (str, optional): The 'next_cursor' value returned by the previous page.
+
+    The movements are read from the (item_id, id) index one page at a time (keyset
+    pagination).
+
+    Returns:
+        - A JSON object with the keys 'movements' (a list of dictionaries with the keys 'id',
+          'item_id', 'delta', 'quantity_after', 'reason', 'user_id' and 'created_at') and
+          'next_cursor' (null on the last page), with a status code of 200.
+        - If a parameter is invalid, returns an error message and a status code of 400.
+        - If the item is not found, returns an error message and a status code of 404.
+    """
+    try:
+        after, limit = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if db.session.get(InventoryItem, id) is None:
+        return jsonify({"error": "Item not found"}), 404
+
+    movements, next_cursor = keyset_page(
+        InventoryMovement.query.filter(InventoryMovement.item_id == id), InventoryMovement.id, after, limit
+    )
+    return jsonify({'movements': [movement.serialize() for movement in movements], 'next_cursor': next_cursor}), 200
+
+
+def _adjustment_error_response(errors):
+    """
+    Return the response rejecting a batch of stock adjustments: 404 if an item is missing, 409 otherwise.
+
+    :param errors: The errors returned by adjust_stock
+    """
+    if any(error['error'] == 'not_found' for error in errors):
+        return jsonify({"error": "Inventory item not found", "errors": errors}), 404
+    return jsonify({"error": "Not enough stock", "errors": errors}), 409
@@ -1,34 +1,72 @@
-from flask import Blueprint, request, jsonify, session
+import io
+import csv
+import json
+from flask import Blueprint, request, jsonify, session, Response, stream_with_context
+from sqlalchemy import literal, null, tuple_, union_all
+from sqlalchemy.exc import IntegrityError
 from app import db
-from app.utils.encryption import encrypt_data, decrypt_data
 from app.models import Patient, Appointment, InventoryItem, TreatmentPlan
 from datetime import datetime, timedelta
 from app.authentication_decorators import login_required, role_required
+from app.utils.pagination import parse_page_args, parse_limit, keyset_page, encode_cursor, decode_cursor
+from app.utils.name_search import search_patients_by_name
+from app.utils.recurrence import to_naive_utc
+from app.jobs.patient_import import read_ndjson, read_csv, import_patients
+from app.utils.fieldsets import parse_fields
+from app.utils.conditional import (
+    resource_validators, collection_validators, is_not_modified, not_modified_response, add_validators
+)
 
 # Create a Blueprint instance
 patients_api_bp = Blueprint('patients_api', __name__)
 
+# Number of patients read, decrypted and written per batch by the streaming export
+EXPORT_BATCH_SIZE = 500
+
+# Columns of the patient export, in order
+EXPORT_FIELDS = ['id', 'first_name', 'last_name', 'date_of_birth', 'contact_number', 'email', 'medical_history']
+
+# Fields of the patient list when ?fields= is not given (the medical history is left out)
+LIST_FIELDS = ['id', 'first_name', 'last_name', 'date_of_birth', 'contact_number', 'email']
+
 # RESTful API route to get all patients
 @patients_api_bp.route('/api/patients', methods=['GET'])
 @login_required
 @role_required('admin', 'user')
 def get_patients_api():
     """
-    This function is an API endpoint that is used to retrieve all patients from the database.
-
-    The function first queries the database for all patients, ordered by their ID in ascending order.
-    It then stores the result in a list called 'patients'.
-
-    The function then initializes an empty list called 'patients_data' to store the decrypted
-    patient data.
-
-    The function then loops through each patient in the 'patients' list and decrypts the sensitive
-    fields of contact number, email, and medical history for each patient. These decrypted values
-    are then stored in a dictionary with the keys 'id', 'first_name', 'last_name', 'date_of_birth',
-    'contact_number', 'email', and 'medical_history'. The decrypted patient data is then appended
-    to the 'patients_data' list.
-
-    Finally, the function returns a JSON response containing the 'patients_data' list.
+    This function is an API endpoint that is used to retrieve the patients from the database, one page at a time.
+
+    The endpoint accepts the following optional query parameters:
+        limit: The number of patients per page (50 by default, at most 500)
+        after: The ID of the last patient already received; the page starts after it
+        cursor: The 'next_cursor' value returned by the previous page, instead of 'after'
+        fields: A comma-separated list of the fields to return (sparse fieldset), among 'id',
+            'first_name', 'last_name', 'date_of_birth', 'contact_number', 'email' and
+            'medical_history', e.g. ?fields=id,first_name,last_name for a patient picker
+
+    The function queries the database for one page of patients, ordered by their ID in ascending order.
+    The page starts with an 'id > after' condition (keyset pagination), so every page is a single
+    range scan of the primary key index and only the rows of the page are fetched and decrypted.
+
+    The function then decrypts the sensitive fields of contact number and email of all patients
+    in a single batch using Patient.serialize_many, which returns one dictionary per patient with
+    the keys 'id', 'first_name', 'last_name', 'date_of_birth', 'contact_number', and 'email', in
+    the same order as the query result. The medical history is a deferred column and is left out
+    of the list, so it is neither fetched nor decrypted; use /api/patient/<id> to get it.
+
+    When ?fields= is given, only the columns of the requested fields are selected (the 'id' is
+    always included) and only the requested encrypted fields are decrypted, so a projection such as
+    ?fields=id,first_name,last_name does no decryption at all.
+
+    The response carries a collection-level ETag (computed with one aggregate query over the
+    patients table, and no Last-Modified, see collection_validators). If the client sends a
+    matching If-None-Match header, an empty 304 response is returned before any patient is fetched
+    or decrypted.
+
+    Finally, the function returns a JSON object with the keys 'patients' (the list of patients of
+    the page) and 'next_cursor' (an opaque string to pass as ?cursor= to get the next page, or
+    null on the last page).
 
     The function is protected by the login_required decorator, which will
     redirect to the login page if the user is not logged in.
@@ -37,38 +75,156 @@ def get_patients_api():
     will only allow users with the role 'admin' or 'user' to access this
     endpoint.
 
-    The function will return a status code of 200 if the request is successful.
+    The function will return a status code of 200 if the request is successful, 304 if the
+    client's copy is current, or 400 if a pagination parameter or a field is invalid.
     """
-    patients = Patient.query.order_by(Patient.id.asc()).all()
-
-    # Decrypt sensitive fields before sending them in response
-    patients_data = []
-    for patient in patients:
-        # Decrypt contact number
-        contact_number_decrypted = decrypt_data(patient.contact_number)
-
-        # Decrypt email
-        email_decrypted = decrypt_data(patient.email)
-
-        # Decrypt medical history
-        medical_history_decrypted = decrypt_data(patient.medical_history)
-
-        # Store decrypted patient data in a dictionary
-        patient_data = {
-            'id': patient.id,
-            'first_name': patient.first_name,
-            'last_name': patient.last_name,
-            'date_of_birth': patient.date_of_birth,
-            'contact_number': contact_number_decrypted,
-            'email': email_decrypted,
-            'medical_history': medical_history_decrypted
-        }
+    try:
+        after, limit = parse_page_args(request.args)
+        fields = parse_fields(request.args, Patient.FIELDS, LIST_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Any change to the patients table changes the validators of every page
+    etag, last_modified = collection_validators(Patient, variant=(after, limit, fields))
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+
+    # Fetch one page of patients, ordered by ID, selecting only the columns of the requested fields
+    patients, next_cursor = keyset_page(Patient.query.options(*Patient.load_options(fields)), Patient.id, after, limit)
+
+    # Decrypt the requested sensitive fields of all patients in one batch before sending them in response
+    # By default the medical history is not part of the list, so it is neither loaded nor decrypted
+    patients_data = Patient.serialize_many(patients, fields=fields)
+
+    # Return JSON response with decrypted patient data and the cursor of the next page
+    response = jsonify({'patients': patients_data, 'next_cursor': next_cursor})
+    return add_validators(response, etag, last_modified), 200
+
+# RESTful API route to export all patients as a stream
+@patients_api_bp.route('/api/patients/export', methods=['GET'])
+@login_required
+@role_required('admin', 'user')
+def export_patients_api():
+    """
+    This function is an API endpoint that streams a full dump of the patients table.
+
+    The endpoint accepts optional query parameters:
+        format: 'ndjson' (one JSON object per line, the default) or 'csv'
+        fields: A comma-separated list of the fields to export (sparse fieldset); the columns
+            of the other fields are not read and their values are not decrypted
 
-        # Append decrypted patient data to list
-        patients_data.append(patient_data)
+    By default every patient is exported with the keys 'id', 'first_name', 'last_name', 'date_of_birth'
+    (as an ISO string, e.g. '2021-01-01'), 'contact_number', 'email' and 'medical_history'.
 
-    # Return JSON response with decrypted patient data
-    return jsonify(patients_data), 200
+    Instead of building one big list, the response is generated while it is being sent:
+    the patients are read with a server-side cursor in batches of EXPORT_BATCH_SIZE rows
+    (yield_per), the sensitive fields of each batch are decrypted together with
+    Patient.serialize_many, and the batch is written out before the next one is read.
+    The worker therefore never holds more than one batch of decrypted rows in memory,
+    and the first bytes are sent as soon as the first batch is ready, whatever the size
+    of the table.
+
+    Returns a streamed response with status code 200, or 400 if the format or a field is not supported.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "format must be 'ndjson' or 'csv'"}), 400
+
+    try:
+        fields = parse_fields(request.args, EXPORT_FIELDS, EXPORT_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Stream the patients in ID order with a server-side cursor, selecting only the exported columns
+    # (by default the medical history is included)
+    statement = db.select(Patient).options(*Patient.load_options(fields)).order_by(Patient.id.asc())
+
+    def generate():
+        if export_format == 'csv':
+            yield _csv_line(fields)
+
+        result = db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        for patients in result.scalars().partitions():
+            # Decrypt the whole batch at once, then write it out
+            lines = []
+            for patient_data in Patient.serialize_many(patients, fields=fields):
+                if 'date_of_birth' in patient_data:
+                    patient_data['date_of_birth'] = patient_data['date_of_birth'].isoformat()
+                if export_format == 'csv':
+                    lines.append(_csv_line([patient_data[field] for field in fields]))
+                else:
+                    lines.append(json.dumps(patient_data) + '\n')
+            yield ''.join(lines)
+
+    if export_format == 'csv':
+        mimetype = 'text/csv'
+        filename = 'patients.csv'
+    else:
+        mimetype = 'application/x-ndjson'
+        filename = 'patients.ndjson'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    ), 200
+
+def _csv_line(values):
+    """
+    Format one row of values as a CSV line.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+# RESTful API route to create many patients at once
+@patients_api_bp.route('/api/patients/bulk', methods=['POST'])
+@login_required
+@role_required('admin', 'user')
+def bulk_import_patients_api():
+    """
+    This function is an API endpoint that creates patients in bulk, for example to onboard a new clinic.
+
+    The request body is a stream of patients, in one of two formats:
+        ndjson: One JSON object per line (Content-Type: application/x-ndjson, the default)
+        csv: A CSV file with a header line (Content-Type: text/csv)
+    The format can also be given explicitly with the ?format=ndjson or ?format=csv query parameter.
+
+    Every patient has the same fields as for POST /api/patient: 'first_name', 'last_name',
+    'date_of_birth' (an ISO string, e.g. '2021-01-01'), 'contact_number', 'email', and optionally
+    'medical_history'.
+
+    The body is read as a stream and imported with the import_patients() job in chunks of
+    IMPORT_CHUNK_SIZE patients: each chunk is validated, its sensitive fields are encrypted in one
+    batch over the encryption worker pool, it is written with a single COPY (PostgreSQL) or a
+    few multi-row INSERT statements, and it is committed. Invalid patients, and patients whose email
+    is already registered, are skipped and reported without aborting the rest of the import.
+
+    Returns a JSON object with the keys 'imported' (the number of patients created), 'failed'
+    (the number of rejected patients) and 'errors' (a list of {'line': ..., 'error': ...} objects
+    giving the line number and reason of each rejected patient), and status code 200.
+    Returns status code 400 if the format is not supported or the CSV header is invalid.
+    """
+    import_format = request.args.get('format')
+    if import_format is None:
+        import_format = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+    if import_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "format must be 'ndjson' or 'csv'"}), 400
+
+    # Read the body line by line instead of loading it in memory at once
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+
+    try:
+        records = read_csv(stream) if import_format == 'csv' else read_ndjson(stream)
+        # read_csv checks the header as soon as it is started
+        report = import_patients(records)
+    except UnicodeDecodeError:
+        # The chunks read before the undecodable line are already imported
+        return jsonify({"error": "The request body must be UTF-8 encoded"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(report), 200
 
 # RESTful API route to get a single patient by ID
 @patients_api_bp.route('/api/patient/<int:id>', methods=['GET'])
@@ -89,36 +245,155 @@ def get_patient_api(id):
         email: The email address of the patient (a string)
         medical_history: The medical history of the patient (a string)
     
-    If the patient is not found, the endpoint returns a 404 error.
+    The endpoint accepts an optional query parameter:
+        fields: A comma-separated list of the keys to return (sparse fieldset), e.g.
+            ?fields=first_name,last_name; the 'id' is always returned. Only the columns of the
+            requested fields are selected and only the requested encrypted fields are decrypted.
+
+    The response carries a strong ETag and a Last-Modified header derived from the patient's
+    updated_at. If the client sends a matching If-None-Match or If-Modified-Since header, an empty
+    304 response is returned without decrypting or serializing the patient.
+
+    If the patient is not found, the endpoint returns a 404 error, and if a field is unknown, a 400 error.
     """
-    # Get the patient from the database that matches the given ID
-    patient = Patient.query.get(id)
+    try:
+        fields = parse_fields(request.args, Patient.FIELDS, Patient.FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Get the patient from the database that matches the given ID, with only the requested columns
+    # and the timestamps the validators are computed from
+    patient = Patient.query.options(
+        *Patient.load_options(fields, Patient.created_at, Patient.updated_at)
+    ).filter_by(id=id).first()
 
     # If the patient is not found, return a 404 error
     if not patient:
         # Return a JSON object with an error message
         return jsonify({"error": "Patient not found"}), 404
 
-    # Decrypt the sensitive fields (contact number, email, medical history) before sending them in response
-    patient_data = {
-        # The ID of the patient (an integer)
-        'id': patient.id,
-        # The first name of the patient (a string)
-        'first_name': patient.first_name,
-        # The last name of the patient (a string)
-        'last_name': patient.last_name,
-        # The date of birth of the patient as an ISO string (e.g. '2021-01-01')
-        'date_of_birth': patient.date_of_birth,
-        # The contact number of the patient (a string)
-        'contact_number': decrypt_data(patient.contact_number),
-        # The email address of the patient (a string)
-        'email': decrypt_data(patient.email),
-        # The medical history of the patient (a string)
-        'medical_history': decrypt_data(patient.medical_history)
-    }
+    # If the client already has this version, answer 304 before decrypting anything
+    etag, last_modified = resource_validators(patient, fields)
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+
+    # Only the requested sensitive fields (contact number, email, medical history) are decrypted
+    patient_data = Patient.serialize_many([patient], fields=fields)[0]
 
     # Return a JSON object with the decrypted patient data
-    return jsonify(patient_data), 200
+    return add_validators(jsonify(patient_data), etag, last_modified), 200
+
+# RESTful API route to get the history of a patient as a single stream of events
+@patients_api_bp.route('/api/patient/<int:id>/timeline', methods=['GET'])
+@login_required
+@role_required('admin', 'user')
+def get_patient_timeline_api(id):
+    """
+    This is an API endpoint that returns the appointments and treatment plans of a patient as one timeline.
+
+    The endpoint requires the user to be logged in and have the role 'admin' or 'user'.
+
+    Instead of calling /api/patient/<id>, /api/treatment_plans/patient/<id> and the appointments
+    list and merging the results client-side, the front end gets every event of the patient in
+    one date-ordered stream, most recent first. The events are:
+        appointment: dated by the appointment date, with the keys 'type', 'id', 'date' and 'notes'
+        treatment_plan: dated by the creation of the plan, with the keys 'type', 'id', 'date',
+            'diagnosis', 'treatment_details' and 'status'
+    Dates are ISO strings (e.g. '2021-01-01T09:30:00').
+
+    The endpoint accepts the following optional query parameters:
+        limit: The number of events per page (50 by default, at most 500)
+        cursor: The 'next_cursor' value returned by the previous page
+
+    Each page is a single query: the appointments and treatment plans of the patient are combined
+    with UNION ALL, ordered by (date, type, id) and cut after the cursor (keyset pagination), so the
+    database only returns the rows of the page, whatever the length of the history.
+
+    Returns a JSON object with the keys 'events' (the events of the page) and 'next_cursor' (an
+    opaque string to pass as ?cursor= to get the next page, or null on the last page), and status
+    code 200. Returns status code 400 if a parameter is invalid, and 404 if the patient does not exist.
+    """
+    try:
+        limit = parse_limit(request.args)
+        after = _decode_timeline_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    events = _timeline_query(id)
+    sort_key = (events.c.date, events.c.type, events.c.id)
+
+    query = db.select(events)
+    if after is not None:
+        # Most recent first: the next page holds the events that sort before the last one seen
+        query = query.where(tuple_(*sort_key) < tuple_(*after))
+    rows = db.session.execute(query.order_by(*[column.desc() for column in sort_key]).limit(limit + 1)).all()
+
+    # An empty first page is either a patient without history or a missing patient
+    if not rows and after is None and db.session.get(Patient, id) is None:
+        return jsonify({"error": "Patient not found"}), 404
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([last.date.isoformat(), last.type, last.id])
+
+    return jsonify({'events': [_timeline_event(row) for row in rows], 'next_cursor': next_cursor}), 200
+
+def _timeline_query(patient_id):
+    """
+    Return the UNION ALL subquery of the appointments and treatment plans of a patient.
+
+    Both sides have the same columns: type, id, date, notes (the appointment notes or the
+    plan diagnosis), details (the treatment details) and status (the plan status).
+    """
+    appointments = db.select(
+        literal('appointment').label('type'),
+        Appointment.id.label('id'),
+        Appointment.appointment_date.label('date'),
+        Appointment.notes.label('notes'),
+        null().label('details'),
+        null().label('status')
+    ).where(Appointment.patient_id == patient_id)
+
+    treatment_plans = db.select(
+        literal('treatment_plan').label('type'),
+        TreatmentPlan.id.label('id'),
+        TreatmentPlan.created_at.label('date'),
+        TreatmentPlan.diagnosis.label('notes'),
+        TreatmentPlan.treatment_details.label('details'),
+        TreatmentPlan.status.label('status')
+    ).where(TreatmentPlan.patient_id == patient_id, TreatmentPlan.created_at.isnot(None))
+
+    return union_all(appointments, treatment_plans).subquery('events')
+
+def _decode_timeline_cursor(cursor):
+    """
+    Decode a timeline cursor into its (date, type, id) sort key.
+    """
+    values = decode_cursor(cursor)
+    try:
+        date, event_type, event_id = values
+        if event_type not in ('appointment', 'treatment_plan') or not isinstance(event_id, int):
+            raise ValueError
+        return to_naive_utc(datetime.fromisoformat(date)), event_type, event_id
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+def _timeline_event(row):
+    """
+    Format one row of the timeline query as an event dictionary.
+    """
+    if row.type == 'appointment':
+        return {'type': row.type, 'id': row.id, 'date': row.date.isoformat(), 'notes': row.notes}
+    return {
+        'type': row.type,
+        'id': row.id,
+        'date': row.date.isoformat(),
+        'diagnosis': row.notes,
+        'treatment_details': row.details,
+        'status': row.status
+    }
 
 # RESTful API route to add a new patient
 @patients_api_bp.route('/api/patient', methods=['POST'])
@@ -147,7 +422,8 @@ def add_patient_api():
         message: A success message (a string)
         patient_id: The ID of the newly created patient (an integer)
 
-    The endpoint will return a 201 status code on success.
+    The endpoint will return a 201 status code on success, or a 409 status code if a
+    patient with the same email address already exists.
     """
     # Get the JSON data from the request body
     data = request.json  
@@ -157,16 +433,21 @@ def add_patient_api():
         first_name=data['first_name'],  # The first name of the patient
         last_name=data['last_name'],  # The last name of the patient
         date_of_birth=data['date_of_birth'],  # The date of birth of the patient as an ISO string
-        contact_number=encrypt_data(data['contact_number']),  # The contact number of the patient (encrypted)
-        email=encrypt_data(data['email']),  # The email address of the patient (encrypted)
-        medical_history=encrypt_data(data.get('medical_history', ''))  # The medical history of the patient (encrypted)
+        contact_number=data['contact_number'],  # The contact number of the patient (encrypted and indexed by the model)
+        email=data['email'],  # The email address of the patient (encrypted and indexed by the model)
+        medical_history=data.get('medical_history', '')  # The medical history of the patient (encrypted by the model)
     )
 
     # Add the new Patient object to the database
     db.session.add(new_patient)
 
-    # Commit the changes to the database
-    db.session.commit()
+    try:
+        # Commit the changes to the database
+        db.session.commit()
+    except IntegrityError:
+        # The unique email blind index rejected the row, so the email is already registered
+        db.session.rollback()
+        return jsonify({"error": "A patient with this email already exists"}), 409
 
     # Return a JSON response with a success message and the ID of the newly created patient
     return jsonify({"message": "Patient added successfully", "patient_id": new_patient.id}), 201
@@ -195,6 +476,7 @@ def update_patient_api(id):
     Returns:
         A JSON response with a success message if the patient is updated successfully.
         A JSON response with an error message and status code 404 if the patient is not found in the database.
+        A JSON response with an error message and status code 409 if the email belongs to another patient.
     """
 
     # Retrieve the patient object from the database based on the provided ID
@@ -212,13 +494,19 @@ def update_patient_api(id):
     patient.last_name = data['last_name']  # The updated last name of the patient
     patient.date_of_birth = data['date_of_birth']  # The updated date of birth of the patient
 
-    # Encrypt the contact number, email, and medical history before storing them in the database
-    patient.contact_number = encrypt_data(data['contact_number'])  # The updated contact number of the patient
-    patient.email = encrypt_data(data['email'])  # The updated email address of the patient
-    patient.medical_history = encrypt_data(data['medical_history'])  # The updated medical history of the patient
+    # The contact number, email, and medical history are encrypted by the model as they are assigned,
+    # and the blind indexes of the contact number and email are refreshed at the same time
+    patient.contact_number = data['contact_number']  # The updated contact number of the patient
+    patient.email = data['email']  # The updated email address of the patient
+    patient.medical_history = data['medical_history']  # The updated medical history of the patient
 
-    # Commit the changes to the database
-    db.session.commit()
+    try:
+        # Commit the changes to the database
+        db.session.commit()
+    except IntegrityError:
+        # The unique email blind index rejected the update, so the email belongs to another patient
+        db.session.rollback()
+        return jsonify({"error": "A patient with this email already exists"}), 409
 
     # Return a JSON response with a success message
     return jsonify({"message": "Patient updated successfully"}), 200
@@ -257,6 +545,59 @@ def delete_patient_api(id):
     # Return a JSON response with a success message
     return jsonify({"message": "Patient deleted successfully"}), 200
 
+# RESTful API route to find patients by email or phone number
+@patients_api_bp.route('/api/patient/lookup', methods=['GET'])
+@login_required
+@role_required('admin', 'user')
+def lookup_patient_api():
+    """
+    Handles GET requests to find patients by exact email address or phone number.
+
+    The endpoint requires the user to be logged in and have the role 'admin' or 'user'.
+
+    The endpoint expects exactly one of the following query parameters:
+        email: The email address of the patient (e.g. /api/patient/lookup?email=john@example.com)
+        phone: The phone number of the patient, e.g. a caller ID (e.g. /api/patient/lookup?phone=5550102030)
+
+    The email and phone number are stored encrypted, so they cannot be searched directly.
+    Instead, the blind index of the given value is computed and looked up with a single
+    probe of the indexed email_index or contact_number_index column. Only the matching
+    patients are decrypted.
+
+    The optional fields query parameter selects the keys to return (sparse fieldset), as for
+    /api/patient/<id>; only the requested encrypted fields are decrypted.
+
+    Returns:
+        A JSON object with a key 'patients' holding the list of matching patients, and status code 200.
+        A JSON response with an error message and status code 400 if neither or both parameters are given,
+        or if a field is unknown.
+        A JSON response with an error message and status code 404 if no patient matches.
+    """
+    email = request.args.get('email')
+    phone = request.args.get('phone')
+
+    # Exactly one of the two parameters must be provided
+    if bool(email) == bool(phone):
+        return jsonify({"error": "Provide either an email or a phone parameter"}), 400
+
+    try:
+        fields = parse_fields(request.args, Patient.FIELDS, Patient.FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if email:
+        # The email index is unique, so there is at most one match
+        patient = Patient.find_by_email(email)
+        patients = [patient] if patient else []
+    else:
+        # Several patients may share a phone number
+        patients = Patient.find_by_contact_number(phone)
+
+    if not patients:
+        return jsonify({"error": "No patient found"}), 404
+
+    return jsonify({'patients': Patient.serialize_many(patients, fields=fields)}), 200
+
 # RESTful API route to search a patient by name
 @patients_api_bp.route('/api/patient/search', methods=['POST'])
 @login_required
@@ -269,6 +610,9 @@ def search_patient_api():
 
     The endpoint expects a JSON payload with a single key-value pair: 'patient_name'.
 
+    The name is matched with the trigram-indexed fuzzy name search (see app.utils.name_search), so partial
+    names and typos match; the best matching patient is returned.
+
     If the patient is found in the database, the endpoint returns a JSON response with the patient's details
     and a list of appointments and treatment plans associated with the patient, and status code 200.
 
@@ -281,37 +625,27 @@ def search_patient_api():
     # Extract the patient name from the payload
     patient_name = data.get('patient_name')
 
-    # Query the database to find a patient with a matching name
-    # The query is case-insensitive and will match any part of the first or last name
-    # We use the ilike() method to perform a case-insensitive search
-    patient = Patient.query.filter(
-        (Patient.first_name.ilike(f'%{patient_name}%')) |
-        (Patient.last_name.ilike(f'%{patient_name}%'))
-    ).first()
+    # Find the best matching patient with the indexed fuzzy name search
+    # The search is case-insensitive, matches partial names and tolerates typos
+    # The medical history is part of the response, so it is loaded with the patient instead of lazily
+    # The appointments and treatment plans are loaded eagerly with one extra query each (selectin loading)
+    matches = search_patients_by_name(patient_name, limit=1, options=(
+        db.undefer(Patient.medical_history),
+        db.selectinload(Patient.appointments),
+        db.selectinload(Patient.treatment_plans)
+    ))
+    patient = matches[0] if matches else None
 
     # If no patient was found, return an error message with status code 404
     if not patient:
         return jsonify({"error": f"No patient found with name: {patient_name}"}), 404
 
-    # Create a dictionary to hold the patient's details
-    patient_data = {}
+    # Decrypt the patient's contact number, email and medical history in one batch
+    patient_data = Patient.serialize_many([patient])[0]
 
-    # Populate the patient data dictionary with the patient's details
-    patient_data['id'] = patient.id
-    patient_data['first_name'] = patient.first_name
-    patient_data['last_name'] = patient.last_name
-    patient_data['date_of_birth'] = patient.date_of_birth
-    # Decrypt the patient's contact number and email
-    patient_data['contact_number'] = decrypt_data(patient.contact_number)
-    patient_data['email'] = decrypt_data(patient.email)
-    # Decrypt the patient's medical history
-    patient_data['medical_history'] = decrypt_data(patient.medical_history)
-
-    # Query the database to find all appointments associated with the patient
-    appointments = Appointment.query.filter_by(patient_id=patient.id).all()
-
-    # Query the database to find all treatment plans associated with the patient
-    treatment_plans = TreatmentPlan.query.filter_by(patient_id=patient.id).all()
+    # The appointments and treatment plans associated with the patient were loaded with the patient
+    appointments = patient.appointments
+    treatment_plans = patient.treatment_plans
 
     # Create a dictionary to hold the patient's appointments and treatment plans
     patient_data_with_associations = {}
@@ -4,6 +4,9 @@ from flask import Blueprint, request, jsonify, redirect, url_for
 from app import db
 from app.models import TreatmentPlan, Patient, Appointment
 from app.authentication_decorators import login_required, role_required
+from app.utils.conditional import (
+    resource_validators, collection_validators, is_not_modified, not_modified_response, add_validators
+)
 
 treatment_api_bp = Blueprint('treatment_plan_api', __name__)
 
@@ -26,9 +29,18 @@ def view_treatment_plans():
 
     The list of treatment plans is returned as a JSON response with a 200 status code.
 
+    The response carries a collection-level ETag (and no Last-Modified, see collection_validators). If
+    the client sends a matching If-None-Match header, an empty 304 response is returned without
+    loading the treatment plans.
+
     Returns:
         str: A JSON response containing a list of treatment plans.
     """
+    # Answer 304 if the treatment plans did not change since the client's copy
+    etag, last_modified = collection_validators(TreatmentPlan)
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+
     # Retrieve all treatment plans from the database
     treatment_plans = TreatmentPlan.query.all()
 
@@ -44,7 +56,45 @@ def view_treatment_plans():
     ]
 
     # Return the list of treatment plans as a JSON response with a 200 status code
-    return jsonify(result), 200
+    return add_validators(jsonify(result), etag, last_modified), 200
+
+# View a single treatment plan (GET)
+@treatment_api_bp.route('/api/treatment_plans/<int:id>', methods=['GET'])
+@login_required
+@role_required('admin', 'user')
+def view_treatment_plan(id):
+    """
+    This route is responsible for handling GET requests to view a single treatment plan.
+
+    It is protected by the login_required decorator to ensure that only authenticated users can access it.
+    Additionally, the role_required decorator restricts access to users with 'admin' or 'user' roles.
+
+    The treatment plan is returned as a dictionary with keys: 'id', 'patient_id', 'diagnosis', 'treatment_details', and 'status'.
+
+    The response carries a strong ETag and a Last-Modified header derived from updated_at. If the client sends a
+    matching If-None-Match or If-Modified-Since header, an empty 304 response is returned without serializing the plan.
+
+    Parameters:
+        id (int): The ID of the treatment plan to retrieve.
+
+    Returns:
+        A JSON response containing the treatment plan, with status code 200.
+        A JSON response with an error message and status code 404 if the treatment plan does not exist.
+    """
+    # Retrieve the treatment plan from the database
+    treatment_plan = TreatmentPlan.query.get(id)
+
+    # If the treatment plan does not exist, return an error response with status code 404
+    if not treatment_plan:
+        return jsonify({"error": "Treatment plan not found"}), 404
+
+    # If the client already has this version, answer 304 without serializing it
+    etag, last_modified = resource_validators(treatment_plan)
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+
+    # Return the treatment plan as a JSON response with a 200 status code
+    return add_validators(jsonify(treatment_plan.serialize()), etag, last_modified), 200
 
 # Add a new treatment plan (POST)
 @treatment_api_bp.route('/api/treatment_plans', methods=['POST'])
@@ -182,7 +232,13 @@ def view_treatment_plans_by_patient(patient_id):
     Returns:
         A JSON response containing a list of treatment plans for the given patient ID.
         A JSON response with an error message and status code 404 if no treatment plans are found for the given patient ID.
+        An empty response with status code 304 if the client's copy (If-None-Match) is current;
+        the collection-level ETag is computed with one aggregate query over the patient's treatment plans.
     """
+    # Answer 304 if the patient's treatment plans did not change since the client's copy
+    etag, last_modified = collection_validators(TreatmentPlan, TreatmentPlan.patient_id == patient_id)
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
     
     # Query the database for all treatment plans with the given patient ID
     treatment_plans = TreatmentPlan.query.filter_by(patient_id=patient_id).all()
@@ -209,4 +265,4 @@ def view_treatment_plans_by_patient(patient_id):
         result.append(treatment_plan)
     
     # Return a JSON response with the list of treatment plans
-    return jsonify(result), 200
+    return add_validators(jsonify(result), etag, last_modified), 200
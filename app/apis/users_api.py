@@ -5,6 +5,7 @@ from app.models import User, InventoryItem, Appointment
 from app import db
 from datetime import datetime, timedelta
 from functools import wraps
+from app.utils.scheduling import appointments_between
 
 auth_api_bp = Blueprint('auth_api', __name__)
 
@@ -315,8 +316,9 @@ def index():
     It verifies that the user is logged in and has the necessary permissions to access the data.
     If the user is not authorized, an error message is returned with status code 401.
     The function queries and returns the upcoming appointments within the next two days 
-    and the low inventory items based on the defined thresholds. 
-    The response includes structured JSON data containing upcoming appointments with their IDs, 
+    (occurrences of recurring series included) and the low inventory items based on the defined thresholds. 
+    The response includes structured JSON data containing upcoming appointments with their IDs 
+    (None for a series occurrence, which has its series ID instead), 
     patient IDs, and appointment dates, low inventory items with IDs, names, and quantities, 
     and user details like username and role.
     """
@@ -331,11 +333,9 @@ def index():
     # Calculate two days from today's date
     two_days_from_now = today + timedelta(days=2)
 
-    # Query the Appointment table to get all upcoming appointments within the next two days
+    # Get all upcoming appointments, and occurrences of recurring series, within the next two days
     # The appointments are sorted by their dates in ascending order
-    upcoming_appointments = Appointment.query.filter(
-        Appointment.appointment_date.between(today, two_days_from_now)
-    ).order_by(Appointment.appointment_date.asc()).all()
+    upcoming_appointments = appointments_between(today, two_days_from_now)
 
     # Query the InventoryItem table to get all items that are low in stock
     # Low in stock means the quantity is less than the threshold
@@ -349,6 +349,7 @@ def index():
         # Create a dictionary to store each appointment's data
         appointment_dict = {
             'id': appt.id,
+            'series_id': appt.series_id if appt.id is None else None,
             'patient_id': appt.patient_id,
             'date': appt.appointment_date
         }
@@ -2,9 +2,13 @@
 
 from flask import Blueprint, request, jsonify, render_template, redirect, url_for, session
 from app import db
-from app.models import Appointment, Patient, InventoryItem
+from app.models import Appointment, AppointmentSeries, Patient, InventoryItem
 from datetime import datetime, timedelta
 from app.authentication_decorators import login_required, role_required
+from app.utils.recurrence import expand_series
+from app.utils.scheduling import (
+    parse_duration, parse_datetime, find_conflicts, conflict_summary, appointments_between
+)
 
 # Create a Blueprint instance
 appointments_bp = Blueprint('appointments', __name__)
@@ -38,9 +42,7 @@ def index():
     today = datetime.utcnow()
     two_days_from_now = today + timedelta(days=2)
 
-    upcoming_appointments = Appointment.query.filter(
-        Appointment.appointment_date.between(today, two_days_from_now)
-    ).order_by(Appointment.appointment_date.asc()).all()
+    upcoming_appointments = appointments_between(today, two_days_from_now)
     
     # Query for items that are low in stock
     low_inventory_items = InventoryItem.query.filter(InventoryItem.quantity < InventoryItem.threshold).all()
@@ -70,6 +72,8 @@ def add_appointment():
         The new Appointment object is added to the database via the db.session.add() method.
         The database is committed via the db.session.commit() method.
         After adding the appointment, the user is redirected to the appointment list.
+        An invalid date or duration returns a 400 error, and an appointment overlapping
+        other appointments is rejected with a 409 error listing them.
     """
     if request.method == 'GET':
         # Fetch all patients for the dropdown menu
@@ -80,14 +84,29 @@ def add_appointment():
     # When the form is submitted via POST
     # Retrieve the form data
     data = request.form
+
+    # Read the start and the length of the appointment
+    try:
+        appointment_date = parse_datetime(data['appointment_date'], 'appointment_date')
+        duration_minutes = parse_duration(data.get('duration_minutes'))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if appointment_date is None:
+        return {"error": "Appointment date is required"}, 400
+
+    # Reject a double booking
+    conflicts = find_conflicts(appointment_date, duration_minutes)
+    if conflicts:
+        return {"error": "The appointment overlaps other appointments", "conflicts": conflict_summary(conflicts)}, 409
     
     # Create a new Appointment object with the form data
     new_appointment = Appointment(
         # The patient_id is retrieved from the form data
         patient_id=data['patient_id'],
-        # The appointment_date is retrieved from the form data
-        # Assume it's already a datetime object
-        appointment_date=data['appointment_date'],
+        # The appointment_date is parsed from the form data (e.g. '2021-01-01T09:30')
+        appointment_date=appointment_date,
+        # The length of the appointment in minutes
+        duration_minutes=duration_minutes,
         # The notes are retrieved from the form data
         # If the notes field is empty, set it to an empty string
         notes=data.get('notes', '')
@@ -116,18 +135,35 @@ def get_appointments():
 
     This route retrieves all appointments from the database. It's accessible by both
     admins and users. The appointments are sorted in ascending order based on their ID.
+    The names of their patients, which the template shows, are loaded by the same query.
+
+    The occurrences of the recurring series, which have no row in the appointments
+    table, are listed in a second table in date order. The series are loaded with
+    their exceptions and patient names in two queries, and each series is expanded
+    from its rule (at most MAX_SERIES_OCCURRENCES occurrences per series).
 
     Returns:
-        A rendered template at list_appointments.html containing the list of appointments.
+        A rendered template at list_appointments.html containing the list of appointments
+        and the list of series occurrences.
     """
     # Print the session information
     print(session)
     
-    # Retrieve all appointments from the database and order them by ID in ascending order
-    appointments = Appointment.query.order_by(Appointment.id.asc()).all()
+    # Retrieve all appointments from the database and order them by ID in ascending order,
+    # joining in the patient names instead of loading each patient on first access
+    appointments = Appointment.query.options(Patient.name_options(Appointment.patient)).order_by(Appointment.id.asc()).all()
+
+    # Expand the recurring series into their occurrences, in date order
+    series = AppointmentSeries.query.options(
+        db.selectinload(AppointmentSeries.exceptions), Patient.name_options(AppointmentSeries.patient)
+    ).all()
+    occurrences = sorted(
+        (occurrence for one_series in series for occurrence in expand_series(one_series)),
+        key=lambda occurrence: (occurrence.appointment_date, occurrence.series_id)
+    )
     
     # Render the 'list_appointments.html' template with the retrieved appointments
-    return render_template('list_appointments.html', appointments=appointments)
+    return render_template('list_appointments.html', appointments=appointments, occurrences=occurrences)
 
 # Update Appointment Route (GET for form, POST to update)
 @appointments_bp.route('/update_appointment/<int:id>', methods=['GET', 'POST'])
@@ -145,7 +181,8 @@ def update_appointment(id):
     
     POST Request:
         - Receives updated appointment data from the form submission.
-        - Updates the appointment's patient ID, appointment date, and notes with the new data.
+        - Updates the appointment's patient ID, appointment date, duration, and notes with the new data.
+        - Rejects the update with a 409 error if the appointment would overlap other appointments.
         - Saves the changes to the database.
         - Redirects the user to the list of appointments after the update.
     
@@ -173,8 +210,24 @@ def update_appointment(id):
 
     # Process POST request for updating appointment
     data = request.form
+
+    # Read the new start and length of the appointment
+    try:
+        appointment_date = parse_datetime(data['appointment_date'], 'appointment_date')
+        duration_minutes = parse_duration(data.get('duration_minutes') or appointment.duration_minutes)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if appointment_date is None:
+        return {"error": "Appointment date is required"}, 400
+
+    # Reject a double booking, ignoring the appointment itself
+    conflicts = find_conflicts(appointment_date, duration_minutes, exclude_id=appointment.id)
+    if conflicts:
+        return {"error": "The appointment overlaps other appointments", "conflicts": conflict_summary(conflicts)}, 409
+
     appointment.patient_id = data['patient_id']
-    appointment.appointment_date = data['appointment_date']
+    appointment.appointment_date = appointment_date
+    appointment.duration_minutes = duration_minutes
     appointment.notes = data.get('notes', '')
 
     # Commit the changes to the database
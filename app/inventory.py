@@ -5,6 +5,8 @@ from app import db
 from app.models import InventoryItem, Appointment, Patient
 from datetime import datetime, timedelta
 from app.authentication_decorators import login_required, role_required
+from app.utils.stock import adjust_stock, record_initial_stock
+from app.utils.scheduling import appointments_between
 
 inventory_bp = Blueprint('inventory', __name__, template_folder='templates')
 
@@ -35,10 +37,8 @@ def index():
     # Calculate the date two days from now
     two_days_from_now = today + timedelta(days=2)
 
-    # Query upcoming appointments within the next two days
-    upcoming_appointments = Appointment.query.filter(
-        Appointment.appointment_date.between(today, two_days_from_now)
-    ).order_by(Appointment.appointment_date.asc()).all()
+    # Query upcoming appointments and series occurrences within the next two days
+    upcoming_appointments = appointments_between(today, two_days_from_now)
     
     # Query for items that are low in stock based on the threshold
     low_inventory_items = InventoryItem.query.filter(InventoryItem.quantity < InventoryItem.threshold).all()
@@ -93,7 +93,7 @@ def add_inventory_item():
     For the POST request:
         - Retrieves the form data.
         - Creates a new InventoryItem object with the provided name, description, quantity, threshold, and unit.
-        - Adds the new item to the database.
+        - Adds the new item to the database, and its quantity as the first movement of its ledger.
         - Commits the session changes.
         - Redirects the user to the inventory list page.
     
@@ -112,6 +112,8 @@ def add_inventory_item():
         unit=data.get('unit', '')
     )
     db.session.add(new_item)
+    db.session.flush()
+    record_initial_stock(new_item, session.get('user_id'))
     db.session.commit()
     return redirect(url_for('inventory.view_inventory'))
 
@@ -129,12 +131,17 @@ def update_inventory_item(id):
     
     For the POST request:
         - Retrieves the form data.
-        - Updates the item in the database with the provided name, description, quantity, threshold, and unit.
+        - Updates the item in the database with the provided name, description, threshold, and unit.
+        - Applies the change of quantity made in the form as a stock movement (see
+          app.utils.stock.adjust_stock): the form sends the quantity it was loaded with, and only
+          the difference is added to the current quantity, so stock taken out by someone else
+          while the form was open is not overwritten. The movement is recorded in the ledger.
         - Commits the session changes.
         - Redirects the user to the inventory list page.
     
     :param id: The ID of the item to be updated
-    :return: GET request renders the template, POST request redirects to the inventory list
+    :return: GET request renders the template, POST request redirects to the inventory list,
+        or an error with status code 409 if the quantity would go below zero
     """
     # Retrieve the inventory item from the database using its ID
     item = InventoryItem.query.get(id)
@@ -151,10 +158,20 @@ def update_inventory_item(id):
     data = request.form
     item.name = data['name']  # Update name
     item.description = data.get('description', '')  # Update description, default to empty string if not provided
-    item.quantity = int(data['quantity'])  # Update quantity, convert to integer
     item.threshold = int(data['threshold'])  # Update threshold, convert to integer
     item.unit = data.get('unit', '')  # Update unit, default to empty string if not provided
 
+    # Apply the change made in the form to the current quantity, as a movement of the ledger
+    original_quantity = int(data.get('original_quantity', item.quantity))
+    delta = int(data['quantity']) - original_quantity
+    if delta:
+        _, errors = adjust_stock([{'item_id': id, 'delta': delta, 'reason': 'Quantity edited'}], session.get('user_id'))
+        if errors:
+            db.session.rollback()
+            if errors[0]['error'] == 'not_found':
+                return {"error": "Item not found"}, 404
+            return {"error": "Not enough stock", "quantity": errors[0]['quantity']}, 409
+
     # Commit the changes to the database
     db.session.commit()
     
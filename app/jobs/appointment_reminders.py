@@ -0,0 +1,373 @@
+# app/jobs/appointment_reminders.py
+
+from datetime import datetime, timedelta
+from sqlalchemy import tuple_, insert
+from app import db
+from app.models import Appointment, AppointmentSeries, ReminderWatermark, ReminderDelivery
+from app.utils.encrypted_types import preload_decrypted
+from app.utils.recurrence import occurrences_between, is_rule_occurrence
+
+# How long before an appointment each kind of reminder is sent
+REMINDER_LEADS = {
+    '24h': timedelta(hours=24),
+    '2h': timedelta(hours=2),
+}
+
+# Channels every reminder is sent on, when the patient has the matching contact detail
+REMINDER_CHANNELS = ('email', 'sms')
+
+# Sending attempts before a delivery is marked as failed
+MAX_DELIVERY_ATTEMPTS = 3
+
+
+def send_due_reminders(sender, batch_size=200, now=None):
+    """
+    Record the reminders that are due and send the pending ones.
+
+    This is one run of the reminder scheduler (see the send_reminders
+    command, which runs it periodically). It calls schedule_reminders and
+    then deliver_pending.
+
+    :param sender: A ReminderSender (see app.utils.reminder_senders)
+    :param batch_size: The number of appointments or deliveries per batch and per commit
+    :param now: The current time (datetime.utcnow() by default)
+    :return: A dictionary with the keys of the results of both steps
+    """
+    now = now or datetime.utcnow()
+    result = schedule_reminders(batch_size=batch_size, now=now)
+    result.update(deliver_pending(sender, batch_size=batch_size, now=now))
+    return result
+
+
+def schedule_reminders(batch_size=200, now=None):
+    """
+    Record a pending delivery for every reminder that has become due.
+
+    Instead of scanning all the upcoming appointments at every run, the job
+    keeps one watermark per kind of reminder: the (appointment_date, id) of
+    the last appointment it handled. Each run only reads the appointments
+    between the watermark and now plus the lead of the reminder, in
+    (appointment_date, id) order with keyset pagination on the
+    (appointment_date, id) pair, so a run costs the number of appointments
+    that became due since the previous one, not the size of the calendar.
+
+    For each batch, the deliveries already recorded are selected in one query
+    and the missing ones inserted with one statement; the watermark is moved
+    to the last appointment of the batch in the same transaction. A run that
+    is interrupted therefore resumes after the last committed batch, and the
+    unique key of the deliveries means an appointment is never recorded
+    twice for the same reminder, even if two schedulers overlap.
+
+    Appointments that are already closer than half the lead (booked or moved
+    at the last minute, or while the scheduler was stopped) do not get that
+    reminder: the next, shorter one will cover them. An appointment moved to
+    a later time is picked up again when the watermark reaches its new time.
+    On the first run, the watermark starts at the current time.
+
+    The occurrences of appointment series get the same reminders (see
+    _schedule_series_reminders).
+
+    :param batch_size: The number of appointments per batch and per commit
+    :param now: The current time (datetime.utcnow() by default)
+    :return: A dictionary with the keys 'scheduled' (number of deliveries
+        recorded) and 'scanned' (number of appointments and occurrences read)
+    """
+    now = now or datetime.utcnow()
+    table = ReminderDelivery.__table__
+
+    scheduled = 0
+    scanned = 0
+
+    for kind, lead in REMINDER_LEADS.items():
+        horizon = now + lead
+
+        while True:
+            # Locking the watermark keeps two schedulers from handling the same batch
+            watermark = db.session.get(ReminderWatermark, kind, with_for_update=True, populate_existing=True)
+            if watermark is None:
+                watermark = ReminderWatermark(kind=kind, appointment_date=now, appointment_id=0)
+                db.session.add(watermark)
+
+            rows = db.session.execute(
+                db.select(Appointment.id, Appointment.appointment_date)
+                .where(
+                    tuple_(Appointment.appointment_date, Appointment.id)
+                    > tuple_(watermark.appointment_date, watermark.appointment_id),
+                    Appointment.appointment_date <= horizon
+                )
+                .order_by(Appointment.appointment_date, Appointment.id)
+                .limit(batch_size)
+            ).all()
+
+            if not rows:
+                db.session.commit()
+                break
+
+            due = [(appointment_id, date) for appointment_id, date in rows if date - now >= lead / 2]
+            if due:
+                # Reminders already recorded for these appointments, in one query
+                existing = set(db.session.execute(
+                    db.select(ReminderDelivery.appointment_id, ReminderDelivery.appointment_date, ReminderDelivery.channel)
+                    .where(
+                        ReminderDelivery.kind == kind,
+                        ReminderDelivery.appointment_id.in_([appointment_id for appointment_id, _ in due])
+                    )
+                ).all())
+
+                new_rows = [
+                    {'appointment_id': appointment_id, 'kind': kind, 'appointment_date': date, 'channel': channel}
+                    for appointment_id, date in due
+                    for channel in REMINDER_CHANNELS
+                    if (appointment_id, date, channel) not in existing
+                ]
+                if new_rows:
+                    db.session.execute(insert(table), new_rows)
+                    scheduled += len(new_rows)
+
+            scanned += len(rows)
+            watermark.appointment_id, watermark.appointment_date = rows[-1]
+
+            # The deliveries and the watermark are committed together
+            db.session.commit()
+
+        series_scheduled, series_scanned = _schedule_series_reminders(kind, lead, now)
+        scheduled += series_scheduled
+        scanned += series_scanned
+
+    return {'scheduled': scheduled, 'scanned': scanned}
+
+
+def _schedule_series_reminders(kind, lead, now):
+    """
+    Record a pending delivery of one kind of reminder for the series occurrences that have become due.
+
+    Occurrences are not rows, so they cannot be paged through like the
+    appointments. Their watermark (kind '<kind>-series') is the end of the
+    window handled by the previous run instead: each run expands the series
+    for the window between the watermark and now plus the lead only (see
+    occurrences_between), records the missing deliveries, keyed on the
+    series and the start the rule gives the occurrence, and moves the
+    watermark to the end of the window, in one transaction. The same rules
+    as for the appointments apply: occurrences closer than half the lead are
+    left to the next reminder, and an occurrence moved to a later time is
+    picked up again when the window reaches its new time.
+
+    :param kind: The kind of reminder (a key of REMINDER_LEADS)
+    :param lead: How long before the occurrence the reminder is sent
+    :param now: The current time
+    :return: A tuple (number of deliveries recorded, number of occurrences read)
+    """
+    horizon = now + lead
+    watermark_kind = f'{kind}-series'
+
+    watermark = db.session.get(ReminderWatermark, watermark_kind, with_for_update=True, populate_existing=True)
+    if watermark is None:
+        watermark = ReminderWatermark(kind=watermark_kind, appointment_date=now, appointment_id=0)
+        db.session.add(watermark)
+
+    window_start = watermark.appointment_date
+    if window_start >= horizon:
+        db.session.commit()
+        return 0, 0
+
+    # occurrences_between returns the occurrences overlapping the window: keep the ones starting in it
+    occurrences = [
+        occurrence for occurrence in occurrences_between(window_start, horizon)
+        if window_start <= occurrence.appointment_date < horizon
+    ]
+    due = [occurrence for occurrence in occurrences if occurrence.appointment_date - now >= lead / 2]
+
+    scheduled = 0
+    if due:
+        existing = set(db.session.execute(
+            db.select(
+                ReminderDelivery.series_id, ReminderDelivery.occurrence_start,
+                ReminderDelivery.appointment_date, ReminderDelivery.channel
+            )
+            .where(
+                ReminderDelivery.kind == kind,
+                ReminderDelivery.series_id.in_({occurrence.series_id for occurrence in due})
+            )
+        ).all())
+
+        new_rows = [
+            {
+                'series_id': occurrence.series_id, 'occurrence_start': occurrence.occurrence_start,
+                'kind': kind, 'appointment_date': occurrence.appointment_date, 'channel': channel
+            }
+            for occurrence in due
+            for channel in REMINDER_CHANNELS
+            if (occurrence.series_id, occurrence.occurrence_start, occurrence.appointment_date, channel) not in existing
+        ]
+        if new_rows:
+            db.session.execute(insert(ReminderDelivery.__table__), new_rows)
+            scheduled = len(new_rows)
+
+    # The deliveries and the watermark are committed together
+    watermark.appointment_date = horizon
+    db.session.commit()
+    return scheduled, len(occurrences)
+
+
+def deliver_pending(sender, batch_size=200, now=None):
+    """
+    Send the pending reminder deliveries in batches.
+
+    Each batch of pending deliveries is locked with SKIP LOCKED (on
+    PostgreSQL), so several senders can run side by side without sending the
+    same reminder twice. The appointments and patients of the batch are
+    loaded with one query, and the contact details they need are decrypted in
+    one go with preload_decrypted. The messages are then handed to the sender
+    as one batch, and the outcome of each delivery is recorded and committed.
+
+    A delivery is skipped, instead of sent, when its appointment (or series
+    occurrence) was cancelled, moved to another time, or has already started,
+    or when the patient has no contact detail for its channel. A delivery whose sending
+    fails stays pending and is retried at the next run, until it has failed
+    MAX_DELIVERY_ATTEMPTS times. The delivery ID is passed as the idempotency
+    key of the message, so a provider that supports it drops a message sent
+    again after a crash between sending and recording.
+
+    :param sender: A ReminderSender (see app.utils.reminder_senders)
+    :param batch_size: The number of deliveries per batch and per commit
+    :param now: The current time (datetime.utcnow() by default)
+    :return: A dictionary with the keys 'sent', 'failed', 'retrying' and
+        'skipped' (numbers of deliveries)
+    """
+    now = now or datetime.utcnow()
+    counts = {'sent': 0, 'failed': 0, 'retrying': 0, 'skipped': 0}
+    last_id = 0
+
+    while True:
+        # Keyset pagination on the ID, so the deliveries left pending for a retry are not read again in this run
+        deliveries = (
+            ReminderDelivery.query
+            .filter(ReminderDelivery.status == 'pending', ReminderDelivery.id > last_id)
+            .order_by(ReminderDelivery.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        if not deliveries:
+            break
+        last_id = deliveries[-1].id
+
+        # The current (patient, start) of the appointment or occurrence of each delivery, None if cancelled
+        targets = _delivery_targets(deliveries)
+        preload_decrypted(
+            list({patient.id: patient for patient, _ in filter(None, targets.values())}.values()),
+            'email', 'contact_number'
+        )
+
+        sending = []
+        messages = []
+        for delivery in deliveries:
+            target = targets.get(delivery.id)
+            reason = None
+            if target is None:
+                reason = "The appointment was cancelled"
+            elif target[1] != delivery.appointment_date:
+                reason = "The appointment was moved"
+            elif target[1] <= now:
+                reason = "The appointment has already started"
+            else:
+                recipient = _recipient(target[0], delivery.channel)
+                if not recipient:
+                    reason = f"No {delivery.channel} contact for the patient"
+
+            if reason:
+                delivery.status = 'skipped'
+                delivery.error = reason
+                counts['skipped'] += 1
+                continue
+
+            sending.append(delivery)
+            messages.append(_message(delivery, target[0], target[1], recipient))
+
+        results = sender.send_batch(messages) if messages else []
+
+        for delivery, error in zip(sending, results):
+            delivery.attempts += 1
+            if error is None:
+                delivery.status = 'sent'
+                delivery.sent_at = datetime.utcnow()
+                delivery.error = None
+                counts['sent'] += 1
+            else:
+                delivery.error = error
+                if delivery.attempts >= MAX_DELIVERY_ATTEMPTS:
+                    delivery.status = 'failed'
+                    counts['failed'] += 1
+                else:
+                    counts['retrying'] += 1
+
+        db.session.commit()
+
+    return counts
+
+
+def _delivery_targets(deliveries):
+    """
+    Return the patient and the current start of the appointment or series occurrence of each delivery.
+
+    The appointments are loaded with their patients in one query, and the
+    series with their patients and exceptions in two more. An occurrence is
+    current if the rule of its series still has it and no exception cancels
+    it; its start is the one of its exception if it was moved.
+
+    :return: A dictionary {delivery ID: (patient, start) or None if the appointment or occurrence is gone}
+    """
+    appointments = {
+        appointment.id: appointment
+        for appointment in Appointment.query.options(db.joinedload(Appointment.patient)).filter(
+            Appointment.id.in_({delivery.appointment_id for delivery in deliveries if delivery.appointment_id})
+        )
+    }
+    series = {
+        item.id: item
+        for item in AppointmentSeries.query.options(
+            db.joinedload(AppointmentSeries.patient), db.selectinload(AppointmentSeries.exceptions)
+        ).filter(AppointmentSeries.id.in_({delivery.series_id for delivery in deliveries if delivery.series_id}))
+    }
+
+    targets = {}
+    for delivery in deliveries:
+        if delivery.appointment_id is not None:
+            appointment = appointments.get(delivery.appointment_id)
+            targets[delivery.id] = (appointment.patient, appointment.appointment_date) if appointment else None
+            continue
+
+        item = series.get(delivery.series_id)
+        if item is None or not is_rule_occurrence(item, delivery.occurrence_start):
+            targets[delivery.id] = None
+            continue
+        exception = next(
+            (exception for exception in item.exceptions if exception.occurrence_start == delivery.occurrence_start), None
+        )
+        if exception is not None and exception.cancelled:
+            targets[delivery.id] = None
+        else:
+            start = exception.appointment_date if exception is not None and exception.appointment_date else delivery.occurrence_start
+            targets[delivery.id] = (item.patient, start)
+    return targets
+
+
+def _recipient(patient, channel):
+    """
+    Return the email address or the phone number of a patient for a channel.
+    """
+    return patient.email if channel == 'email' else patient.contact_number
+
+
+def _message(delivery, patient, appointment_date, recipient):
+    """
+    Build the message of a delivery.
+    """
+    when = appointment_date.strftime('%A %d %B %Y at %H:%M')
+    return {
+        'channel': delivery.channel,
+        'recipient': recipient,
+        'subject': 'Appointment reminder',
+        'body': f"Dear {patient.first_name} {patient.last_name}, this is a reminder of your appointment on {when}.",
+        'idempotency_key': f'reminder-{delivery.id}',
+    }
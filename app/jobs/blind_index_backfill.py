@@ -0,0 +1,119 @@
+# app/jobs/blind_index_backfill.py
+
+from sqlalchemy.exc import SQLAlchemyError
+from app import app, db
+from app.models import Patient
+from app.utils.encryption import email_blind_index, phone_blind_index
+from app.utils.encrypted_types import preload_decrypted
+from app.utils.schema import add_missing_column, create_missing_indexes
+
+
+def setup_blind_indexes():
+    """
+    Add the blind index columns, and their indexes, to a patients table created before them.
+
+    db.create_all() does not alter existing tables. Without this step, every
+    query of a patient on a database created before the blind indexes fails
+    with "column patients.email_index does not exist".
+
+    The upgrade of an existing database runs in this order:
+
+    1. At startup, this function adds the nullable email_index and
+       contact_number_index columns, then their indexes. Every email_index is
+       still NULL when its unique index is created, so the index cannot fail
+       (NULLs never collide) and new patients are checked against it at once:
+       creating a patient relies on it to reject a duplicate email address.
+    2. The backfill_blind_indexes console command fills in the indexes of the
+       existing patients. It leaves the email index of a duplicate empty, so
+       it never breaks the unique index.
+    3. If the unique index could not be created in step 1 (columns added by
+       hand and already holding duplicates), the error is logged and the
+       index is tried again at the next start, once the duplicates are fixed.
+
+    The function is idempotent and is called at startup after db.create_all().
+    """
+    columns = (Patient.__table__.c.email_index, Patient.__table__.c.contact_number_index)
+    added = [add_missing_column(column) for column in columns]
+    db.session.commit()
+    if any(added):
+        app.logger.info("Added the blind index columns: run backfill_blind_indexes to fill them in")
+
+    for column in columns:
+        try:
+            create_missing_indexes(column)
+        except SQLAlchemyError as e:
+            app.logger.warning("Could not create the index of patients.%s: %s", column.name, e)
+
+
+def backfill_blind_indexes(batch_size=500, after_id=0):
+    """
+    Fill in the email and contact number blind indexes of existing patients.
+
+    Patients created before the blind index columns existed have NULL in
+    email_index and contact_number_index. This job walks those patients in
+    batches ordered by ID (keyset pagination on the primary key, so every
+    batch is a cheap index range scan), decrypts the email addresses and
+    contact numbers of the whole batch in one preload_decrypted call, computes the
+    blind indexes and commits once per batch.
+
+    The job is resumable: it only touches rows whose indexes are missing, and
+    the after_id parameter allows restarting it after the last committed ID.
+
+    email_index is unique. If an email address is already indexed for another
+    patient (or appears twice in the same batch), the email index of the later
+    patient is left empty and its ID is reported as a duplicate, so that the
+    backfill never aborts on existing duplicate data.
+
+    :param batch_size: The number of patients processed per batch and per commit
+    :param after_id: Only patients with an ID greater than this are processed
+    :return: A dictionary with the keys 'updated' (number of patients updated),
+        'duplicates' (IDs of patients whose email is already indexed) and
+        'last_id' (the ID of the last processed patient)
+    """
+    updated = 0
+    duplicates = []
+    last_id = after_id
+
+    while True:
+        # Next batch of patients with a missing index, in primary key order
+        patients = Patient.query.filter(
+            Patient.id > last_id,
+            (Patient.email_index.is_(None)) | (Patient.contact_number_index.is_(None))
+        ).order_by(Patient.id.asc()).limit(batch_size).all()
+
+        if not patients:
+            break
+
+        # Decrypt the emails and contact numbers of the whole batch at once
+        preload_decrypted(patients, 'email', 'contact_number')
+
+        email_indexes = [email_blind_index(patient.email) for patient in patients]
+        phone_indexes = [phone_blind_index(patient.contact_number) for patient in patients]
+
+        # Email indexes of this batch that already belong to another patient
+        candidate_indexes = [index for index in email_indexes if index is not None]
+        taken_indexes = set(
+            row.email_index for row in db.session.query(Patient.email_index).filter(
+                Patient.email_index.in_(candidate_indexes)
+            )
+        ) if candidate_indexes else set()
+
+        for patient, email_index, phone_index in zip(patients, email_indexes, phone_indexes):
+            if patient.email_index is None and email_index is not None:
+                if email_index in taken_indexes:
+                    duplicates.append(patient.id)
+                else:
+                    patient.email_index = email_index
+                    taken_indexes.add(email_index)
+
+            if patient.contact_number_index is None:
+                patient.contact_number_index = phone_index
+
+            updated += 1
+
+        last_id = patients[-1].id
+
+        # One commit per batch keeps transactions and lock times short
+        db.session.commit()
+
+    return {'updated': updated, 'duplicates': duplicates, 'last_id': last_id}
@@ -0,0 +1,311 @@
+# app/jobs/duplicate_patients.py
+
+import re
+import unicodedata
+from array import array
+from difflib import SequenceMatcher
+from app import db
+from app.models import Patient
+from app.utils.encryption import decrypt_many
+
+# Number of patients read per batch while building the blocks
+SCAN_BATCH_SIZE = 5000
+
+# Blocks with more patients than this are not compared pairwise: a key shared by that many
+# patients (e.g. a very common name born on the same day) says little about duplicates
+MAX_BLOCK_SIZE = 100
+
+# Candidate pairs scoring below this are left out of the report
+MIN_SCORE = 0.6
+
+# Weights of the signals in the score of a candidate pair (they add up to 1)
+NAME_WEIGHT = 0.4
+DATE_OF_BIRTH_WEIGHT = 0.2
+EMAIL_WEIGHT = 0.2
+CONTACT_NUMBER_WEIGHT = 0.2
+
+# Number of candidate patients loaded per query for scoring
+LOAD_BATCH_SIZE = 1000
+
+# Kinds of blocking keys (see blocking_keys)
+BLOCK_KINDS = ('dob_last_name', 'dob_first_name', 'name', 'email', 'contact_number')
+
+# Soundex digit of each consonant
+_SOUNDEX_CODES = {
+    letter: digit
+    for digit, letters in (('1', 'bfpv'), ('2', 'cgjkqsxz'), ('3', 'dt'), ('4', 'l'), ('5', 'mn'), ('6', 'r'))
+    for letter in letters
+}
+
+
+def normalize_name(name):
+    """
+    Return a name lower-cased, without accents and with only its letters ('José-Marie' -> 'josemarie').
+    """
+    decomposed = unicodedata.normalize('NFKD', name or '')
+    return re.sub(r'[^a-z]', '', ''.join(c for c in decomposed if not unicodedata.combining(c)).lower())
+
+
+def soundex(name):
+    """
+    Return the Soundex code of a name ('Robert' and 'Rupert' -> 'R163'), or '' for a name without letters.
+
+    Names that sound alike get the same code, so misspellings such as
+    'Smith'/'Smyth' or 'Mohamed'/'Mohammed' fall in the same block.
+    """
+    letters = normalize_name(name)
+    if not letters:
+        return ''
+
+    code = letters[0].upper()
+    previous = _SOUNDEX_CODES.get(letters[0])
+    for letter in letters[1:]:
+        digit = _SOUNDEX_CODES.get(letter)
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # 'h' and 'w' do not separate two letters with the same code, vowels do
+        if letter not in 'hw':
+            previous = digit
+
+    return code.ljust(4, '0')
+
+
+def blocking_keys(first_name, last_name, date_of_birth, email_index, contact_number_index):
+    """
+    Return the blocking keys of a patient: only patients sharing at least one key are compared.
+
+    - dob_last_name: same date of birth and same-sounding last name (typos in the names);
+    - dob_first_name: same date of birth and same-sounding first name (last name changed, e.g. after marriage);
+    - name: same normalized first and last names, in any order (typo in the date of birth, swapped names);
+    - email, contact_number: same email or contact number, through their blind indexes (no decryption).
+
+    :return: A dictionary {block kind: key}; kinds without a key (e.g. no email index) are left out
+    """
+    first = normalize_name(first_name)
+    last = normalize_name(last_name)
+
+    keys = {}
+    if date_of_birth is not None:
+        if last:
+            keys['dob_last_name'] = (date_of_birth, soundex(last))
+        if first:
+            keys['dob_first_name'] = (date_of_birth, soundex(first))
+    if first and last:
+        keys['name'] = tuple(sorted((first, last)))
+    if email_index:
+        keys['email'] = email_index
+    if contact_number_index:
+        keys['contact_number'] = contact_number_index
+    return keys
+
+
+def find_duplicate_patients(min_score=MIN_SCORE, max_block_size=MAX_BLOCK_SIZE):
+    """
+    Find the patients that are probably duplicates of each other, best candidates first.
+
+    Comparing every patient with every other one is O(n²) and would require
+    decrypting every email and contact number. Instead, the job works in
+    three passes:
+
+    1. Blocking: the plaintext name and date of birth columns and the blind
+       indexes are streamed in ID order (no ciphertext is read), and the hash
+       of each blocking key of each patient (see blocking_keys) is kept in a
+       compact array, one per kind of key. This pass is linear in the number
+       of patients and holds a few bytes per patient and kind of key.
+    2. Candidate pairs: each array is sorted, and only patients with equal
+       keys (a block) are paired. Blocks larger than max_block_size are
+       skipped and counted in the report. Sorting is O(n log n), which is
+       near-linear in practice.
+    3. Scoring: the patients in candidate pairs are loaded in batches, and
+       each pair gets a score between 0 and 1 from the similarity of the
+       names, the dates of birth, the emails and the contact numbers. Equal
+       blind indexes mean equal values; only when they differ are the emails
+       and contact numbers decrypted and compared for near matches such as
+       typos. Patients outside candidate pairs are never decrypted.
+
+    :param min_score: Pairs scoring below this are left out of the report
+    :param max_block_size: Blocks with more patients are not compared
+    :return: A dictionary with the keys 'patients' (number of patients
+        scanned), 'blocks' (number of blocks with at least two patients),
+        'oversized_blocks' (number of skipped blocks), 'candidate_pairs'
+        (number of compared pairs), 'decrypted_patients' (number of patients
+        whose contact details were decrypted) and 'duplicates' (the list of
+        candidates, best first, each a dictionary with the keys 'patient_ids',
+        'score' and 'reasons')
+    """
+    table = Patient.__table__
+
+    # Pass 1: blocking, on the plaintext columns and the blind indexes only
+    patient_ids = array('q')
+    key_hashes = {kind: array('q') for kind in BLOCK_KINDS}
+    result = db.session.execute(
+        db.select(
+            table.c.id, table.c.first_name, table.c.last_name, table.c.date_of_birth,
+            table.c.email_index, table.c.contact_number_index
+        ).order_by(table.c.id.asc()).execution_options(yield_per=SCAN_BATCH_SIZE)
+    )
+    for row in result:
+        patient_ids.append(row.id)
+        keys = blocking_keys(row.first_name, row.last_name, row.date_of_birth, row.email_index, row.contact_number_index)
+        for kind in BLOCK_KINDS:
+            key = keys.get(kind)
+            # 0 marks a missing key; a key hashing to 0 is moved to 1 (a hash collision only adds a pair to score)
+            key_hashes[kind].append(0 if key is None else (hash(key) or 1))
+
+    # Pass 2: candidate pairs within each block
+    pairs = set()
+    shared_blocks = 0
+    oversized_blocks = 0
+    for kind in BLOCK_KINDS:
+        hashes = key_hashes.pop(kind)
+        order = sorted(range(len(hashes)), key=hashes.__getitem__)
+        start = 0
+        while start < len(order):
+            end = start + 1
+            while end < len(order) and hashes[order[end]] == hashes[order[start]]:
+                end += 1
+            size = end - start
+            if size >= 2 and hashes[order[start]] != 0:
+                shared_blocks += 1
+                if size > max_block_size:
+                    oversized_blocks += 1
+                else:
+                    block = sorted(patient_ids[position] for position in order[start:end])
+                    for i, first_id in enumerate(block):
+                        for second_id in block[i + 1:]:
+                            pairs.add((first_id, second_id))
+            start = end
+
+    # Pass 3: scoring, loading only the patients of candidate pairs
+    patients = _load_candidates(sorted({patient_id for pair in pairs for patient_id in pair}))
+    needs_decryption = set()
+    for first_id, second_id in pairs:
+        first, second = patients[first_id], patients[second_id]
+        if first.email_index != second.email_index or first.contact_number_index != second.contact_number_index:
+            needs_decryption.update((first_id, second_id))
+    contact_details = _decrypt_contact_details(patients, sorted(needs_decryption))
+
+    duplicates = []
+    for first_id, second_id in pairs:
+        score, reasons = _score_pair(patients[first_id], patients[second_id], contact_details)
+        if score >= min_score:
+            duplicates.append({'patient_ids': [first_id, second_id], 'score': round(score, 3), 'reasons': reasons})
+
+    duplicates.sort(key=lambda duplicate: (-duplicate['score'], duplicate['patient_ids']))
+
+    return {
+        'patients': len(patient_ids),
+        'blocks': shared_blocks,
+        'oversized_blocks': oversized_blocks,
+        'candidate_pairs': len(pairs),
+        'decrypted_patients': len(contact_details),
+        'duplicates': duplicates,
+    }
+
+
+def _load_candidates(patient_ids):
+    """
+    Load the columns needed to score the given patients, in batches.
+
+    :return: A dictionary {patient id: row}
+    """
+    table = Patient.__table__
+    patients = {}
+    for start in range(0, len(patient_ids), LOAD_BATCH_SIZE):
+        rows = db.session.execute(
+            db.select(
+                table.c.id, table.c.first_name, table.c.last_name, table.c.date_of_birth,
+                table.c.email_index, table.c.contact_number_index, table.c.email, table.c.contact_number
+            ).where(table.c.id.in_(patient_ids[start:start + LOAD_BATCH_SIZE]))
+        ).all()
+        for row in rows:
+            patients[row.id] = row
+    return patients
+
+
+def _decrypt_contact_details(patients, patient_ids):
+    """
+    Decrypt the emails and contact numbers of the given patients in one batch.
+
+    :return: A dictionary {patient id: (email, contact number)}
+    """
+    plaintexts = decrypt_many(
+        value for patient_id in patient_ids for value in (patients[patient_id].email, patients[patient_id].contact_number)
+    )
+    return {
+        patient_id: (plaintexts[position * 2], plaintexts[position * 2 + 1])
+        for position, patient_id in enumerate(patient_ids)
+    }
+
+
+def _score_pair(first, second, contact_details):
+    """
+    Score how likely two patients are the same person.
+
+    :return: A tuple (score between 0 and 1, list of human readable reasons)
+    """
+    reasons = []
+
+    # Names: the best of the straight and swapped comparisons of the normalized names
+    first_name, first_last = normalize_name(first.first_name), normalize_name(first.last_name)
+    second_name, second_last = normalize_name(second.first_name), normalize_name(second.last_name)
+    name_score = max(
+        SequenceMatcher(None, first_name + ' ' + first_last, second_name + ' ' + second_last).ratio(),
+        SequenceMatcher(None, first_name + ' ' + first_last, second_last + ' ' + second_name).ratio()
+    )
+    if name_score == 1:
+        reasons.append('same name')
+    elif name_score >= 0.8:
+        reasons.append('similar name')
+
+    # Date of birth: equal, or one of day, month and year mistyped
+    if first.date_of_birth == second.date_of_birth:
+        dob_score = 1.0
+        reasons.append('same date of birth')
+    else:
+        differences = sum(
+            getattr(first.date_of_birth, part) != getattr(second.date_of_birth, part)
+            for part in ('year', 'month', 'day')
+        )
+        dob_score = 0.5 if differences == 1 else 0.0
+
+    # Email: equal blind indexes, or similar decrypted addresses
+    if first.email_index and first.email_index == second.email_index:
+        email_score = 1.0
+        reasons.append('same email')
+    else:
+        email_score = _text_similarity(contact_details, first.id, second.id, 0)
+        if email_score >= 0.9:
+            reasons.append('similar email')
+
+    # Contact number: equal blind indexes, or the same last seven digits (different prefixes)
+    if first.contact_number_index and first.contact_number_index == second.contact_number_index:
+        phone_score = 1.0
+        reasons.append('same contact number')
+    else:
+        first_digits = re.sub(r'\D', '', (contact_details.get(first.id) or ('', ''))[1] or '')
+        second_digits = re.sub(r'\D', '', (contact_details.get(second.id) or ('', ''))[1] or '')
+        phone_score = 0.8 if len(first_digits) >= 7 and first_digits[-7:] == second_digits[-7:] else 0.0
+        if phone_score:
+            reasons.append('similar contact number')
+
+    score = (
+        NAME_WEIGHT * name_score
+        + DATE_OF_BIRTH_WEIGHT * dob_score
+        + EMAIL_WEIGHT * email_score
+        + CONTACT_NUMBER_WEIGHT * phone_score
+    )
+    return score, reasons
+
+
+def _text_similarity(contact_details, first_id, second_id, position):
+    """
+    Return the similarity of one decrypted contact detail of two patients, between 0 and 1.
+    """
+    first = (contact_details.get(first_id) or (None, None))[position]
+    second = (contact_details.get(second_id) or (None, None))[position]
+    if not first or not second:
+        return 0.0
+    return SequenceMatcher(None, first.strip().lower(), second.strip().lower()).ratio()
@@ -0,0 +1,281 @@
+# app/jobs/patient_import.py
+
+import io
+import csv
+import json
+from datetime import date, datetime
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Patient
+from app.utils.encryption import encrypt_many, email_blind_index, phone_blind_index
+
+# Fields every imported patient must have
+REQUIRED_FIELDS = ('first_name', 'last_name', 'date_of_birth', 'contact_number', 'email')
+
+# Fields an imported patient may have
+OPTIONAL_FIELDS = ('medical_history',)
+
+# Longest accepted first and last names (the length of the columns)
+MAX_NAME_LENGTH = 50
+
+# Number of rows validated, encrypted, inserted and committed together
+IMPORT_CHUNK_SIZE = 500
+
+# Per-row errors listed in the import report; further errors are only counted
+MAX_REPORTED_ERRORS = 1000
+
+# Bound parameters of a multi-row INSERT outside PostgreSQL (the lowest default limit of SQLite)
+MAX_INSERT_PARAMETERS = 999
+
+# Columns written by the import, in the order of the COPY statement
+_INSERT_COLUMNS = (
+    'first_name', 'last_name', 'date_of_birth', 'contact_number', 'email', 'medical_history',
+    'email_index', 'contact_number_index', 'created_at'
+)
+
+
+def read_ndjson(stream):
+    """
+    Read patients from an NDJSON stream (one JSON object per line).
+
+    Blank lines are skipped. A line that is not a JSON object is reported as
+    an error for that line instead of aborting the import.
+
+    :param stream: A text stream (or any iterable of lines)
+    :return: A generator of (line number, record) pairs, where record is a
+        dictionary, or an error message string for an unreadable line
+    """
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_number, "Invalid JSON"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, "Expected a JSON object"
+            continue
+        yield line_number, record
+
+
+def read_csv(stream):
+    """
+    Read patients from a CSV stream with a header line.
+
+    The header must name at least the required fields; the columns may be in
+    any order and unknown columns are ignored.
+
+    :param stream: A text stream (or any iterable of lines)
+    :return: A generator of (line number, record) pairs, where record is a
+        dictionary (the header line is line 1)
+    :raises ValueError: If the header is missing or lacks a required field
+    """
+    reader = csv.DictReader(stream)
+    if reader.fieldnames is None:
+        raise ValueError("The CSV header line is missing")
+
+    missing = [field for field in REQUIRED_FIELDS if field not in reader.fieldnames]
+    if missing:
+        raise ValueError(f"The CSV header lacks the fields: {', '.join(missing)}")
+
+    for record in reader:
+        # The header is line 1 and line_num counts lines read so far (quoted newlines included)
+        yield reader.line_num, record
+
+
+def validate_patient(record):
+    """
+    Check and normalise one imported patient.
+
+    :param record: A dictionary with the patient fields
+    :return: A dictionary of the plaintext values to store
+    :raises ValueError: With a readable message if the record is invalid
+    """
+    values = {}
+    for field in REQUIRED_FIELDS:
+        value = record.get(field)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"{field} is required")
+        values[field] = value.strip()
+
+    for field in ('first_name', 'last_name'):
+        if len(values[field]) > MAX_NAME_LENGTH:
+            raise ValueError(f"{field} is longer than {MAX_NAME_LENGTH} characters")
+
+    try:
+        values['date_of_birth'] = date.fromisoformat(values['date_of_birth'])
+    except ValueError:
+        raise ValueError("date_of_birth must be an ISO date (e.g. '2021-01-01')")
+    if values['date_of_birth'] > date.today():
+        raise ValueError("date_of_birth is in the future")
+
+    if '@' not in values['email']:
+        raise ValueError("email is not a valid email address")
+
+    if not any(character.isdigit() for character in values['contact_number']):
+        raise ValueError("contact_number has no digits")
+
+    medical_history = record.get('medical_history') or ''
+    if not isinstance(medical_history, str):
+        raise ValueError("medical_history must be a string")
+    values['medical_history'] = medical_history
+
+    return values
+
+
+def import_patients(records, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Create patients in bulk from a stream of records.
+
+    Creating patients one request and one commit at a time is far too slow
+    to onboard a clinic. This job reads the records in chunks of chunk_size
+    and, for each chunk:
+
+    - validates every record; invalid records are reported with their line
+      number and skipped, the rest of the chunk is imported;
+    - skips the records whose email is already registered, or appears earlier
+      in the import, using a single probe of the email blind index;
+    - encrypts the contact numbers, emails and medical histories of the whole
+      chunk in one encrypt_many call (spread over the encryption worker pool)
+      and computes the blind indexes;
+    - writes the chunk with COPY on PostgreSQL, or multi-row INSERT statements
+      of up to MAX_INSERT_PARAMETERS parameters on other databases, and
+      commits it.
+
+    Only one chunk is held in memory at a time and every chunk is committed
+    on its own, so a failure late in the load keeps the chunks already
+    imported. If a chunk still hits the unique email index (a patient created
+    concurrently with the same email), it is retried one row at a time so that
+    only the conflicting rows are rejected.
+
+    :param records: An iterable of (line number, record) pairs, as returned by
+        read_ndjson or read_csv; a record given as a string is reported as an
+        error for that line
+    :param chunk_size: The number of records processed per chunk and per commit
+    :return: A dictionary with the keys 'imported' (number of patients
+        created), 'failed' (number of rejected records) and 'errors' (a list of
+        {'line': ..., 'error': ...} dictionaries, at most MAX_REPORTED_ERRORS)
+    """
+    report = {'imported': 0, 'failed': 0, 'errors': []}
+
+    chunk = []
+    for line_number, record in records:
+        chunk.append((line_number, record))
+        if len(chunk) >= chunk_size:
+            _import_chunk(chunk, report)
+            chunk = []
+
+    if chunk:
+        _import_chunk(chunk, report)
+
+    return report
+
+
+def _report_error(report, line_number, message):
+    """
+    Count a rejected record and list it in the report while there is room.
+    """
+    report['failed'] += 1
+    if len(report['errors']) < MAX_REPORTED_ERRORS:
+        report['errors'].append({'line': line_number, 'error': message})
+
+
+def _import_chunk(chunk, report):
+    """
+    Validate, encrypt, insert and commit one chunk of records.
+    """
+    # Validate the records and compute the email blind indexes
+    valid = []
+    for line_number, record in chunk:
+        if isinstance(record, str):
+            _report_error(report, line_number, record)
+            continue
+        try:
+            values = validate_patient(record)
+        except ValueError as e:
+            _report_error(report, line_number, str(e))
+            continue
+        values['email_index'] = email_blind_index(values['email'])
+        values['contact_number_index'] = phone_blind_index(values['contact_number'])
+        valid.append((line_number, values))
+
+    # Reject the emails already registered (one index probe for the chunk) or repeated in the chunk
+    registered = set(db.session.execute(
+        db.select(Patient.email_index).where(Patient.email_index.in_([values['email_index'] for _, values in valid]))
+    ).scalars())
+
+    rows = []
+    lines = []
+    for line_number, values in valid:
+        if values['email_index'] in registered:
+            _report_error(report, line_number, "A patient with this email already exists")
+            continue
+        registered.add(values['email_index'])
+        rows.append(values)
+        lines.append(line_number)
+
+    if not rows:
+        return
+
+    # Encrypt the sensitive fields of the whole chunk in one batch
+    encrypted = encrypt_many(
+        values[field] for values in rows for field in ('contact_number', 'email', 'medical_history')
+    )
+    now = datetime.utcnow()
+    for position, values in enumerate(rows):
+        values['contact_number'], values['email'], values['medical_history'] = encrypted[position * 3:position * 3 + 3]
+        values['created_at'] = now
+
+    try:
+        _insert_rows(rows)
+        db.session.commit()
+        report['imported'] += len(rows)
+    except IntegrityError:
+        # A concurrent write registered one of the emails: retry row by row to find it
+        db.session.rollback()
+        for line_number, values in zip(lines, rows):
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(Patient.__table__.insert(), [values])
+                report['imported'] += 1
+            except IntegrityError:
+                _report_error(report, line_number, "A patient with this email already exists")
+        db.session.commit()
+
+
+def _insert_rows(rows):
+    """
+    Insert already encrypted patient rows, with COPY on PostgreSQL and multi-row INSERTs elsewhere.
+
+    Elsewhere, each INSERT ... VALUES (...), (...) statement carries as many
+    rows as MAX_INSERT_PARAMETERS bound parameters allow.
+    """
+    if db.session.get_bind().dialect.name != 'postgresql':
+        # One statement per batch of rows: a list of parameter sets would be sent with
+        # executemany, which the SQLite driver runs as one INSERT per row
+        batch_size = max(1, MAX_INSERT_PARAMETERS // len(_INSERT_COLUMNS))
+        for start in range(0, len(rows), batch_size):
+            db.session.execute(Patient.__table__.insert().values(rows[start:start + batch_size]))
+        return
+
+    # COPY ... FROM STDIN in CSV format; bytea values are written in hex ('\x...')
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for values in rows:
+        writer.writerow([
+            '\\x' + values[column].hex() if isinstance(values[column], bytes) else values[column]
+            for column in _INSERT_COLUMNS
+        ])
+    buffer.seek(0)
+
+    statement = f"COPY {Patient.__tablename__} ({', '.join(_INSERT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+    connection = db.session.connection()
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(statement, buffer)
+    except connection.dialect.dbapi.IntegrityError as e:
+        # The raw cursor raises the driver's exception: surface it like any other insert would
+        raise IntegrityError(statement, None, e)
+    finally:
+        cursor.close()
@@ -0,0 +1,92 @@
+# app/jobs/reencrypt.py
+
+from sqlalchemy import update, bindparam
+from app import db
+from app.models import Patient
+from app.utils.encryption import needs_reencryption, decrypt_many, encrypt_many
+
+# Encrypted columns of the patients table
+ENCRYPTED_COLUMNS = ('contact_number', 'email', 'medical_history')
+
+
+def reencrypt_patients(batch_size=500, after_id=0):
+    """
+    Re-encrypt the sensitive columns of all patients with the active key.
+
+    After a new key is added to ENCRYPTION_KEYS and made active, new writes
+    use it immediately, but existing rows still carry the old key id (or are
+    legacy Fernet tokens). This job rewrites them so that the old key can be
+    retired, without downtime:
+
+    - Patients are walked in batches ordered by ID (keyset pagination on the
+      primary key), and only the raw ciphertext columns are selected.
+    - Values that already use the active key are skipped, so running the job
+      again only touches what is left. The after_id parameter allows resuming
+      after the last committed ID.
+    - The values of a batch that need it are decrypted and re-encrypted with
+      decrypt_many/encrypt_many, then written with one executemany UPDATE per
+      column, and the batch is committed. Only the rows of the current batch
+      are locked, and only for the duration of that batch.
+    - Each UPDATE only matches the row if the column still holds the
+      ciphertext that was read, so a concurrent edit made by the application in
+      the meantime is never overwritten. Such values are simply picked up on
+      the next run.
+
+    :param batch_size: The number of patients processed per batch and per commit
+    :param after_id: Only patients with an ID greater than this are processed
+    :return: A dictionary with the keys 'reencrypted' (number of values
+        re-encrypted), 'patients' (number of patients scanned) and 'last_id'
+        (the ID of the last processed patient)
+    """
+    table = Patient.__table__
+    columns = [table.c[name] for name in ENCRYPTED_COLUMNS]
+
+    reencrypted = 0
+    scanned = 0
+    last_id = after_id
+
+    while True:
+        # Next batch of raw ciphertexts, in primary key order
+        rows = db.session.execute(
+            db.select(table.c.id, *columns).where(table.c.id > last_id).order_by(table.c.id.asc()).limit(batch_size)
+        ).all()
+
+        if not rows:
+            break
+
+        # (row id, column, old ciphertext) for every value still using an old key
+        pending = [
+            (row[0], column, row[position + 1])
+            for row in rows
+            for position, column in enumerate(columns)
+            if needs_reencryption(row[position + 1])
+        ]
+
+        if pending:
+            new_ciphertexts = encrypt_many(decrypt_many(old for _, _, old in pending))
+
+            # One executemany UPDATE per column, guarded by the old ciphertext
+            for column in columns:
+                parameters = [
+                    {'row_id': row_id, 'old_value': old, 'new_value': new}
+                    for (row_id, pending_column, old), new in zip(pending, new_ciphertexts)
+                    if pending_column is column
+                ]
+                if not parameters:
+                    continue
+
+                statement = update(table).where(
+                    table.c.id == bindparam('row_id'),
+                    column == bindparam('old_value')
+                ).values({column.name: bindparam('new_value')})
+                db.session.execute(statement, parameters)
+
+            reencrypted += len(pending)
+
+        scanned += len(rows)
+        last_id = rows[-1][0]
+
+        # One commit per batch keeps transactions and lock times short
+        db.session.commit()
+
+    return {'reencrypted': reencrypted, 'patients': scanned, 'last_id': last_id}
@@ -3,7 +3,8 @@
 from app import db
 from datetime import datetime, timedelta
 from sqlalchemy import LargeBinary
-from app.utils.encryption import encrypt_data, decrypt_data
+from app.utils.encryption import email_blind_index, phone_blind_index
+from app.utils.encrypted_types import EncryptedBinary, EncryptedAttribute, preload_decrypted
 from werkzeug.security import generate_password_hash, check_password_hash
 
 class User(db.Model):
@@ -69,12 +70,27 @@ class Patient(db.Model):
     first_name = db.Column(db.String(50), nullable=False)
     last_name = db.Column(db.String(50), nullable=False)
     date_of_birth = db.Column(db.Date, nullable=False, index=True)
-    contact_number = db.Column(db.LargeBinary, nullable=False)  # Store encrypted data as LargeBinary
-    email = db.Column(db.LargeBinary, unique=True, nullable=False, index=True)  # Store encrypted data as LargeBinary
-    medical_history = db.Column(db.LargeBinary, nullable=True)  # Store encrypted data as LargeBinary
+    # The encrypted columns are mapped under private names and exposed as plaintext by the
+    # EncryptedAttribute descriptors below, which decrypt on first access only
+    _contact_number = db.Column('contact_number', EncryptedBinary, nullable=False)  # Store encrypted data as LargeBinary
+    _email = db.Column('email', EncryptedBinary, unique=True, nullable=False, index=True)  # Store encrypted data as LargeBinary
+    # Deferred: the (potentially large) medical history is only fetched when it is accessed
+    _medical_history = db.deferred(db.Column('medical_history', EncryptedBinary, nullable=True))  # Store encrypted data as LargeBinary
+    email_index = db.Column(db.String(64), unique=True, nullable=True, index=True)  # Keyed blind index of the email
+    contact_number_index = db.Column(db.String(64), nullable=True, index=True)  # Keyed blind index of the contact number
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
 
+    # Plaintext views of the encrypted columns. Assigning to them encrypts the value and,
+    # for the contact number and email, refreshes the blind index at the same time.
+    contact_number = EncryptedAttribute('_contact_number', 'contact_number_index', phone_blind_index)
+    email = EncryptedAttribute('_email', 'email_index', email_blind_index)
+    medical_history = EncryptedAttribute('_medical_history')
+
+    # Fields of a serialized patient, in output order, and the ones stored encrypted
+    FIELDS = ('id', 'first_name', 'last_name', 'date_of_birth', 'contact_number', 'email', 'medical_history')
+    ENCRYPTED_FIELDS = ('contact_number', 'email', 'medical_history')
+
     def __init__(self, first_name, last_name, date_of_birth, contact_number, email, medical_history):
         """
         Initialize a Patient object with the given data.
@@ -86,108 +102,171 @@ class Patient(db.Model):
         :param email: The email address of the patient
         :param medical_history: The medical history of the patient
 
-        This function first sets the first name, last name, date of birth,
+        This function sets the first name, last name, date of birth,
         contact number, email address, and medical history of the patient
-        to the given values. It then encrypts the contact number, email address,
-        and medical history using the provided encryption function, and
-        sets the encrypted values as the contact number, email, and medical
-        history of the patient.
+        to the given values. The contact number, email address and medical
+        history are encrypted by their EncryptedAttribute descriptors as they
+        are assigned, and the blind indexes of the contact number and email
+        address are computed at the same time.
         """
         self.first_name = first_name
         self.last_name = last_name
         self.date_of_birth = date_of_birth
 
-        # Encrypt contact number
-        self.contact_number = encrypt_data(contact_number)  # Ensure this is a string
+        # Encrypt and index contact number
+        self.contact_number = contact_number
 
-        # Encrypt email address
-        self.email = encrypt_data(email)  # Ensure this is a string
+        # Encrypt and index email address
+        self.email = email
 
         # Encrypt medical history
-        self.medical_history = encrypt_data(medical_history)  # Ensure this is a string
+        self.medical_history = medical_history
 
-    @property
-    def decrypted_contact_number(self):
+    @classmethod
+    def find_by_email(cls, email):
         """
-        Return the decrypted contact number of the patient.
+        Find the patient with the given email address.
 
-        This property is a getter that decrypts the contact number
-        that was previously encrypted and stored in the database.
+        The lookup is a single probe of the unique email_index column, so no
+        row has to be decrypted to find the match.
 
-        The contact number is stored as a LargeBinary in the database.
-        When we retrieve it, we need to decrypt it using the
-        decrypt_data function from the encryption module.
+        :param email: The plaintext email address to look for
+        :return: The matching Patient, or None
+        """
+        index = email_blind_index(email)
+        if index is None:
+            return None
+        return cls.query.filter_by(email_index=index).first()
 
-        The decrypt_data function takes in the encrypted contact number
-        as a bytes object and returns the decrypted contact number
-        as a string.
+    @classmethod
+    def find_by_contact_number(cls, contact_number):
+        """
+        Find the patients with the given contact number.
 
-        We return the decrypted contact number as a string.
+        The lookup is a single probe of the contact_number_index column. Several
+        patients (for example members of the same family) may share a number,
+        so a list is returned.
 
-        :return: The decrypted contact number of the patient as a string
+        :param contact_number: The plaintext contact number to look for
+        :return: A list of matching Patient objects, ordered by ID
         """
-        return decrypt_data(self.contact_number)  # Decrypt contact number
+        index = phone_blind_index(contact_number)
+        if index is None:
+            return []
+        return cls.query.filter_by(contact_number_index=index).order_by(cls.id.asc()).all()
 
     @property
-    def decrypted_email(self):
+    def decrypted_contact_number(self):
         """
-        This property is a getter that decrypts the email address
-        of the patient that was previously encrypted and stored in the database.
+        Return the decrypted contact number of the patient.
 
-        The email address is stored as a LargeBinary in the database,
-        which is a type that can store binary data, such as encrypted strings.
+        Kept for backward compatibility: the contact_number attribute itself
+        now returns the decrypted value, decrypting it on first access only.
 
-        When we retrieve the email address from the database,
-        it is in its encrypted form, which is a bytes object.
-        To decrypt it, we use the decrypt_data function from the encryption module.
+        :return: The decrypted contact number of the patient as a string
+        """
+        return self.contact_number
 
-        The decrypt_data function takes in the encrypted email address
-        as a bytes object and returns the decrypted email address
-        as a string.
+    @property
+    def decrypted_email(self):
+        """
+        Return the decrypted email address of the patient.
 
-        We return the decrypted email address as a string,
-        which can then be used in our application.
+        Kept for backward compatibility: the email attribute itself now
+        returns the decrypted value, decrypting it on first access only.
 
         :return: The decrypted email address of the patient as a string
         """
-        # Retrieve the encrypted email address from the database
-        encrypted_email = self.email
-
-        # Decrypt the email address using the decrypt_data function
-        decrypted_email = decrypt_data(encrypted_email)
-
-        # Return the decrypted email address as a string
-        return decrypted_email
+        return self.email
 
     @property
     def decrypted_medical_history(self):
         """
-        This property is a getter that decrypts the medical history of the patient
-        that was previously encrypted and stored in the database.
+        Return the decrypted medical history of the patient.
 
-        The medical history is stored as a LargeBinary in the database, which is a
-        type that can store binary data, such as encrypted strings.
+        Kept for backward compatibility: the medical_history attribute itself
+        now returns the decrypted value, loading the deferred column and
+        decrypting it on first access only.
 
-        When we retrieve the medical history from the database, it is in its
-        encrypted form, which is a bytes object. To decrypt it, we use the
-        decrypt_data function from the encryption module.
+        :return: The decrypted medical history of the patient as a string
+        """
+        return self.medical_history
 
-        The decrypt_data function takes in the encrypted medical history as a
-        bytes object and returns the decrypted medical history as a string.
+    @classmethod
+    def load_options(cls, fields, *extra_columns):
+        """
+        Return the loader options that fetch only the columns of the given fields.
 
-        We return the decrypted medical history as a string, which can then be
-        used in our application.
+        Pass them to the query that loads the patients to be serialized with
+        the same fields (Patient.query.options(*Patient.load_options(fields))),
+        so that the columns of the other fields are not even selected. The
+        medical history, which is deferred, is loaded with the patients when
+        it is requested. The primary key is always loaded.
 
-        :return: The decrypted medical history of the patient as a string
+        :param fields: The fields to serialize (see Patient.FIELDS)
+        :param extra_columns: Other columns to load as well (e.g. Patient.updated_at)
+        :return: A tuple of loader options
+        """
+        columns = [getattr(cls, field) for field in fields if field != 'id'] + list(extra_columns)
+        return (db.load_only(*columns),) if columns else (db.load_only(cls.id),)
+
+    @classmethod
+    def name_options(cls, relationship):
+        """
+        Return the loader option that loads the name of the related patient in the same query.
+
+        List views showing the patient name of each row (appointments,
+        treatment plans) pass it to the query that loads the rows, e.g.
+        Appointment.query.options(Patient.name_options(Appointment.patient)).
+        The patients are joined in with only their first and last names
+        selected, instead of being loaded with one query per row the first
+        time the template reads row.patient.
+
+        :param relationship: The relationship to the patient (e.g. Appointment.patient)
+        :return: A loader option
+        """
+        return db.joinedload(relationship, innerjoin=True).load_only(cls.first_name, cls.last_name)
+
+    @staticmethod
+    def serialize_many(patients, include_medical_history=True, fields=None):
         """
-        # Retrieve the encrypted medical history from the database
-        encrypted_medical_history = self.medical_history
+        Return a list of dictionaries with the decrypted data of several patients.
+
+        Instead of decrypting the contact number, email and medical history
+        of each patient one call at a time, the encrypted values of all the
+        given patients are decrypted in a single batch with preload_decrypted,
+        which spreads large batches over a worker pool and caches the results
+        on the instances.
+
+        List views pass include_medical_history=False: the medical history is
+        a deferred column, so leaving it out means it is neither fetched nor
+        decrypted. When it is included, the query that loaded the patients
+        should undefer it to avoid one extra query per patient.
+
+        API endpoints with sparse fieldsets (?fields=) pass the requested
+        fields instead: only those keys are returned and only the encrypted
+        fields among them are decrypted. The patients should have been loaded
+        with Patient.load_options(fields), so that the other columns were not
+        fetched either.
+
+        The dictionaries are returned in the same order as the given patients.
+        By default they have the keys 'id', 'first_name', 'last_name',
+        'date_of_birth', 'contact_number', 'email' and, if requested,
+        'medical_history'.
+
+        :param patients: A list of Patient objects
+        :param include_medical_history: Whether to include the medical history
+            (ignored when fields is given)
+        :param fields: The fields to return (see Patient.FIELDS), or None for the default fields
+        :return: A list of dictionaries with the decrypted patient data
+        """
+        if fields is None:
+            fields = [field for field in Patient.FIELDS if include_medical_history or field != 'medical_history']
 
-        # Decrypt the medical history using the decrypt_data function
-        decrypted_medical_history = decrypt_data(encrypted_medical_history)
+        # Decrypt the requested encrypted fields of all patients in one batch
+        preload_decrypted(patients, *[field for field in fields if field in Patient.ENCRYPTED_FIELDS])
 
-        # Return the decrypted medical history as a string
-        return decrypted_medical_history
+        return [{field: getattr(patient, field) for field in fields} for patient in patients]
 
     def __repr__(self):
         """
@@ -208,18 +287,58 @@ class Patient(db.Model):
 
 
 
+# Length of an appointment when none is given, and the longest accepted, in minutes
+# The maximum also bounds the index range probed by the conflict checks (see app.utils.scheduling)
+DEFAULT_APPOINTMENT_MINUTES = 30
+MAX_APPOINTMENT_MINUTES = 480
+
 class Appointment(db.Model):
     __tablename__ = 'appointments'
+    __table_args__ = (
+        # Calendar of one patient: WHERE patient_id = ? AND appointment_date in a window, in date order
+        db.Index('ix_appointments_patient_id_appointment_date', 'patient_id', 'appointment_date'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False, index=True)
     appointment_date = db.Column(db.DateTime, nullable=False, index=True)
+    # The appointment occupies [appointment_date, appointment_date + duration_minutes)
+    duration_minutes = db.Column(
+        db.Integer, nullable=False, default=DEFAULT_APPOINTMENT_MINUTES, server_default=str(DEFAULT_APPOINTMENT_MINUTES)
+    )
     notes = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
 
     patient = db.relationship('Patient', backref='appointments')
 
+    @property
+    def end_date(self):
+        """
+        Return the time the appointment ends (the start plus the duration).
+
+        :return: A datetime
+        """
+        return self.appointment_date + timedelta(minutes=self.duration_minutes or DEFAULT_APPOINTMENT_MINUTES)
+
+    def serialize(self):
+        """
+        Return a dictionary representation of the appointment for JSON responses.
+
+        The dictionary has the keys 'id', 'patient_id', 'appointment_date'
+        (as an ISO string, e.g. '2021-01-01T00:00:00'), 'duration_minutes'
+        and 'notes', like the appointments API.
+
+        :return: A dictionary representing the appointment
+        """
+        return {
+            'id': self.id,
+            'patient_id': self.patient_id,
+            'appointment_date': self.appointment_date.isoformat(),
+            'duration_minutes': self.duration_minutes,
+            'notes': self.notes
+        }
+
     def __repr__(self):
         """
         The repr method returns a string representation of the object.
@@ -242,6 +361,191 @@ class Appointment(db.Model):
         """
         return f"<Appointment {self.id} for Patient {self.patient_id}>"
 
+class AppointmentSeries(db.Model):
+    """
+    A recurring appointment, stored as a rule rather than one row per occurrence.
+
+    The occurrences start at starts_at and then every interval days, weeks or
+    months (frequency), count times. They are expanded on demand for the
+    window a query asks for (see app.utils.recurrence); an occurrence that is
+    cancelled or moved is recorded as an AppointmentSeriesException.
+
+    first_start and last_end bound all the occurrences, exceptions included,
+    so that the series of a window are found with a range condition.
+    """
+    __tablename__ = 'appointment_series'
+
+    # Accepted values of frequency
+    FREQUENCIES = ('daily', 'weekly', 'monthly')
+
+    id = db.Column(db.Integer, primary_key=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False, index=True)
+    starts_at = db.Column(db.DateTime, nullable=False)  # Start of the first occurrence of the rule
+    duration_minutes = db.Column(db.Integer, nullable=False, default=DEFAULT_APPOINTMENT_MINUTES)
+    frequency = db.Column(db.String(10), nullable=False)  # 'daily', 'weekly' or 'monthly'
+    interval = db.Column(db.Integer, nullable=False, default=1)  # e.g. 4 with 'weekly' for every four weeks
+    count = db.Column(db.Integer, nullable=False)  # Number of occurrences of the rule
+    notes = db.Column(db.Text, nullable=True)
+    first_start = db.Column(db.DateTime, nullable=False, index=True)  # Earliest occurrence start, exceptions included
+    last_end = db.Column(db.DateTime, nullable=False, index=True)  # Latest occurrence end, exceptions included
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
+
+    patient = db.relationship('Patient', backref='appointment_series')
+    exceptions = db.relationship(
+        'AppointmentSeriesException', backref='series', cascade='all, delete-orphan',
+        order_by='AppointmentSeriesException.occurrence_start'
+    )
+
+    def serialize(self):
+        """
+        Return a dictionary representation of the series for JSON responses.
+
+        The dictionary has the keys 'id', 'patient_id', 'starts_at' (an ISO
+        string), 'duration_minutes', 'frequency', 'interval', 'count', 'notes'
+        and 'exceptions' (see AppointmentSeriesException.serialize).
+
+        :return: A dictionary representing the series
+        """
+        return {
+            'id': self.id,
+            'patient_id': self.patient_id,
+            'starts_at': self.starts_at.isoformat(),
+            'duration_minutes': self.duration_minutes,
+            'frequency': self.frequency,
+            'interval': self.interval,
+            'count': self.count,
+            'notes': self.notes,
+            'exceptions': [exception.serialize() for exception in self.exceptions]
+        }
+
+    def __repr__(self):
+        return f"<AppointmentSeries {self.id} for Patient {self.patient_id}>"
+
+class AppointmentSeriesException(db.Model):
+    """
+    A change to one occurrence of an appointment series: cancelled, or moved and/or annotated.
+
+    The occurrence is identified by the start the rule gives it
+    (occurrence_start). The other columns override the occurrence when set.
+    """
+    __tablename__ = 'appointment_series_exceptions'
+    __table_args__ = (
+        db.UniqueConstraint('series_id', 'occurrence_start', name='uq_appointment_series_exceptions_occurrence'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    series_id = db.Column(db.Integer, db.ForeignKey('appointment_series.id'), nullable=False)
+    occurrence_start = db.Column(db.DateTime, nullable=False)
+    cancelled = db.Column(db.Boolean, nullable=False, default=False)
+    appointment_date = db.Column(db.DateTime, nullable=True)  # New start of a moved occurrence
+    duration_minutes = db.Column(db.Integer, nullable=True)  # New length of the occurrence
+    notes = db.Column(db.Text, nullable=True)  # Notes of this occurrence instead of the series notes
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
+
+    def serialize(self):
+        """
+        Return a dictionary representation of the exception for JSON responses.
+
+        :return: A dictionary with the keys 'occurrence_start', 'cancelled',
+            'appointment_date', 'duration_minutes' and 'notes'
+        """
+        return {
+            'occurrence_start': self.occurrence_start.isoformat(),
+            'cancelled': self.cancelled,
+            'appointment_date': self.appointment_date.isoformat() if self.appointment_date else None,
+            'duration_minutes': self.duration_minutes,
+            'notes': self.notes
+        }
+
+class ReminderWatermark(db.Model):
+    """
+    How far the reminder scheduler has got for one kind of reminder (e.g. '24h').
+
+    Every appointment sorting at or before (appointment_date, appointment_id)
+    has been handled for this kind: its deliveries are recorded, or it was
+    too close to send this reminder. The scheduler resumes from here, so a
+    restart never scans the same appointments again.
+    """
+    __tablename__ = 'reminder_watermarks'
+
+    kind = db.Column(db.String(20), primary_key=True)
+    appointment_date = db.Column(db.DateTime, nullable=False)
+    appointment_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ReminderDelivery(db.Model):
+    """
+    One reminder to send, or sent, for one appointment, kind of reminder and channel.
+
+    The reminder is about either an appointment (appointment_id) or an
+    occurrence of an appointment series, which is not stored as a row and is
+    identified by its series_id and occurrence_start instead.
+
+    The unique keys include the appointment_date the reminder is about, so
+    the same reminder is never recorded (or sent) twice, while an appointment
+    or occurrence moved to a later time gets a reminder for its new time. The
+    ID is passed to the sender as the idempotency key of the message.
+    """
+    __tablename__ = 'reminder_deliveries'
+    __table_args__ = (
+        db.UniqueConstraint(
+            'appointment_id', 'kind', 'appointment_date', 'channel', name='uq_reminder_deliveries_reminder'
+        ),
+        db.UniqueConstraint(
+            'series_id', 'occurrence_start', 'kind', 'appointment_date', 'channel',
+            name='uq_reminder_deliveries_occurrence_reminder'
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Cancelling (deleting) an appointment deletes its reminders, sent or not
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointments.id', ondelete='CASCADE'), nullable=True)
+    # The occurrence of a series the reminder is about, when it is not about an appointment
+    series_id = db.Column(db.Integer, db.ForeignKey('appointment_series.id', ondelete='CASCADE'), nullable=True)
+    occurrence_start = db.Column(db.DateTime, nullable=True)  # The start the rule gives the occurrence
+    kind = db.Column(db.String(20), nullable=False)  # e.g. '24h' or '2h'
+    appointment_date = db.Column(db.DateTime, nullable=False)  # The appointment time the reminder is about
+    channel = db.Column(db.String(10), nullable=False)  # 'email' or 'sms'
+    status = db.Column(db.String(10), nullable=False, default='pending', index=True)  # pending, sent, failed or skipped
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CalendarFeedToken(db.Model):
+    """
+    A token letting a calendar application read the calendar feeds on behalf of a user.
+
+    Calendar applications cannot log in, so the feed URL carries a token
+    signed with the secret key of the application (see
+    app.utils.feed_tokens). The row makes the token revocable: a token whose
+    row is revoked, or whose user was deleted or no longer has access to the
+    feeds, is refused.
+    """
+    __tablename__ = 'calendar_feed_tokens'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Deleting a user deletes their tokens
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    revoked_at = db.Column(db.DateTime, nullable=True)
+
+    def serialize(self):
+        """
+        Return a dictionary representation of the token for JSON responses (without the signed token itself).
+
+        :return: A dictionary with the keys 'id', 'user_id', 'created_at' and
+            'revoked_at' (ISO strings, revoked_at is None for an active token)
+        """
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'revoked_at': self.revoked_at.isoformat() if self.revoked_at else None
+        }
+
 class InventoryItem(db.Model):
     __tablename__ = 'inventory_items'
 
@@ -286,6 +590,48 @@ class InventoryItem(db.Model):
         """
         return f"<InventoryItem {self.name}>"
 
+class InventoryMovement(db.Model):
+    """
+    One stock movement of an inventory item: an entry of the append-only inventory ledger.
+
+    Every change to the quantity of an item (initial stock, consumption,
+    delivery, correction) is recorded with its signed delta and the quantity
+    it left, in the same transaction as the change itself (see
+    app.utils.stock). Entries are only ever inserted, so the movements of an
+    item, in ID order, explain its current quantity.
+    """
+    __tablename__ = 'inventory_movements'
+    __table_args__ = (
+        # The history of one item, in order
+        db.Index('ix_inventory_movements_item_id_id', 'item_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Deleting an item deletes its ledger with it
+    item_id = db.Column(db.Integer, db.ForeignKey('inventory_items.id', ondelete='CASCADE'), nullable=False)
+    delta = db.Column(db.Integer, nullable=False)  # Positive for stock in, negative for stock out
+    quantity_after = db.Column(db.Integer, nullable=False)  # The quantity of the item after this movement
+    reason = db.Column(db.String(200), nullable=True)  # e.g. 'Delivery', 'Used in surgery 2'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)  # Who made it
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def serialize(self):
+        """
+        Return a dictionary representation of the movement for JSON responses.
+
+        :return: A dictionary with the keys 'id', 'item_id', 'delta',
+            'quantity_after', 'reason', 'user_id' and 'created_at' (an ISO string)
+        """
+        return {
+            'id': self.id,
+            'item_id': self.item_id,
+            'delta': self.delta,
+            'quantity_after': self.quantity_after,
+            'reason': self.reason,
+            'user_id': self.user_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
 
 
 # models.py
@@ -304,6 +650,23 @@ class TreatmentPlan(db.Model):
     # Relationships
     patient = db.relationship('Patient', backref='treatment_plans')
 
+    def serialize(self):
+        """
+        Return a dictionary representation of the treatment plan for JSON responses.
+
+        The dictionary has the keys 'id', 'patient_id', 'diagnosis',
+        'treatment_details' and 'status', like the treatment plans API.
+
+        :return: A dictionary representing the treatment plan
+        """
+        return {
+            'id': self.id,
+            'patient_id': self.patient_id,
+            'diagnosis': self.diagnosis,
+            'treatment_details': self.treatment_details,
+            'status': self.status,
+        }
+
     def __repr__(self):
         """
         The repr method is a special method in Python that returns a string
@@ -1,13 +1,20 @@
 from flask import Blueprint, request, jsonify, render_template, redirect, url_for, session
+from sqlalchemy.exc import IntegrityError
 from app import db
-from app.utils.encryption import encrypt_data, decrypt_data
+from app.utils.encrypted_types import preload_decrypted
 from app.models import Patient, Appointment, InventoryItem, TreatmentPlan
 from datetime import datetime, timedelta
 from app.authentication_decorators import login_required, role_required
+from app.utils.pagination import parse_page_args, keyset_page
+from app.utils.name_search import search_patients_by_name
+from app.utils.scheduling import appointments_between
 
 # Create a Blueprint instance
 patients_bp = Blueprint('patients', __name__)
 
+# Maximum number of patients shown by a name search
+SEARCH_RESULTS_LIMIT = 20
+
 # Dashboard route
 @patients_bp.route('/')
 @login_required
@@ -25,11 +32,9 @@ def index():
     # Calculate two days from today's date
     two_days_from_now = today + timedelta(days=2)
     
-    # Query the Appointment table to retrieve all upcoming appointments within the next two days
+    # Retrieve all upcoming appointments, and occurrences of recurring series, within the next two days
     # The appointments are sorted by their dates in ascending order
-    upcoming_appointments = Appointment.query.filter(
-        Appointment.appointment_date.between(today, two_days_from_now)
-    ).order_by(Appointment.appointment_date.asc()).all()
+    upcoming_appointments = appointments_between(today, two_days_from_now)
     
     # Query the InventoryItem table to retrieve all items that are low in stock
     # Low in stock means the quantity is less than the threshold
@@ -68,20 +73,25 @@ def add_patient():
     email = data['email']                    # Email address of the patient
     medical_history = data.get('medical_history', '')  # Medical history, defaulting to an empty string if not provided
 
-    # Create a new Patient object, encrypting sensitive data before storage
+    # Create a new Patient object, the model encrypts sensitive data and indexes the contact number and email
     new_patient = Patient(
         first_name=data['first_name'],                   # Patient's first name
         last_name=data['last_name'],                     # Patient's last name
         date_of_birth=data['date_of_birth'],             # Patient's date of birth
-        contact_number=encrypt_data(contact_number),     # Encrypt and store contact number
-        email=encrypt_data(email),                       # Encrypt and store email address
-        medical_history=encrypt_data(medical_history)    # Encrypt and store medical history
+        contact_number=contact_number,                   # Contact number, encrypted by the model
+        email=email,                                     # Email address, encrypted by the model
+        medical_history=medical_history                  # Medical history, encrypted by the model
     )
 
     # Add the new Patient object to the database session
     db.session.add(new_patient)
-    # Commit the session to save the new patient to the database
-    db.session.commit()
+    try:
+        # Commit the session to save the new patient to the database
+        db.session.commit()
+    except IntegrityError:
+        # The unique email blind index rejected the row, so the email is already registered
+        db.session.rollback()
+        return {"error": "A patient with this email already exists"}, 409
     
     # After successfully adding the patient, redirect to the patient list page
     return redirect(url_for('patients.get_patients'))
@@ -94,20 +104,24 @@ def add_patient():
 @role_required('admin', 'user')
 def get_patients():
     """
-    This function handles the GET request to retrieve all patients from the database.
-    It then decrypts sensitive fields such as contact number, email, and medical history before rendering the list of patients template.
+    This function handles the GET request to retrieve the patients from the database, one page at a time.
+    The page is selected with the same ?limit=, ?after= and ?cursor= parameters as /api/patients (keyset pagination on the ID).
+    It then decrypts the contact number and email of the patients of the page in a single batch before rendering the list of patients template.
+    The medical history is a deferred column and is not shown in the list, so it is neither fetched nor decrypted.
     """
-    # Retrieve all patients from the database and order them by ID in ascending order
-    patients = Patient.query.order_by(Patient.id.asc()).all()
+    try:
+        after, limit = parse_page_args(request.args)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    # Retrieve one page of patients from the database, ordered by ID in ascending order
+    patients, next_cursor = keyset_page(Patient.query, Patient.id, after, limit)
     
-    # Decrypt sensitive fields for display
-    for patient in patients:
-        patient.contact_number = decrypt_data(patient.contact_number)
-        patient.email = decrypt_data(patient.email)
-        patient.medical_history = decrypt_data(patient.medical_history)
+    # Decrypt the contact number and email of the patients of the page in one batch for display
+    preload_decrypted(patients, 'contact_number', 'email')
 
-    # Render the list of patients template with the decrypted patient data
-    return render_template('list_patients.html', patients=patients)
+    # Render the list of patients template with the decrypted patient data and the link to the next page
+    return render_template('list_patients.html', patients=patients, next_cursor=next_cursor, limit=limit)
 
 
 # Update Patient Route (GET for form, POST to update)
@@ -141,10 +155,10 @@ def update_patient(id):
             'first_name': patient.first_name,  # Patient's first name
             'last_name': patient.last_name,  # Patient's last name
             'date_of_birth': patient.date_of_birth,  # Patient's date of birth
-            # Decrypt the contact number and medical history to store in the dictionary
-            'contact_number': decrypt_data(patient.contact_number),
-            'email': decrypt_data(patient.email),
-            'medical_history': decrypt_data(patient.medical_history)
+            # The contact number, email and medical history are decrypted on first access
+            'contact_number': patient.contact_number,
+            'email': patient.email,
+            'medical_history': patient.medical_history
         }
 
         # Render the update_patient.html template with the decrypted patient data
@@ -160,14 +174,20 @@ def update_patient(id):
         patient.last_name = data['last_name']  # Patient's last name
         patient.date_of_birth = data['date_of_birth']  # Patient's date of birth
 
-        # Encrypt the contact number, email, and medical history before storing them in the database
-        # Ensure that you're encrypting only plain strings
-        patient.contact_number = encrypt_data(data['contact_number'])  # This should be a plain string
-        patient.email = encrypt_data(data['email'])  # This should be a plain string
-        patient.medical_history = encrypt_data(data['medical_history'])  # This should be a plain string
-
-        # Commit the updated patient information to the database
-        db.session.commit()
+        # The contact number, email, and medical history are encrypted by the model as they are assigned
+        # Ensure that you're assigning only plain strings
+        # The blind indexes of the contact number and email are refreshed at the same time
+        patient.contact_number = data['contact_number']  # This should be a plain string
+        patient.email = data['email']  # This should be a plain string
+        patient.medical_history = data['medical_history']  # This should be a plain string
+
+        try:
+            # Commit the updated patient information to the database
+            db.session.commit()
+        except IntegrityError:
+            # The unique email blind index rejected the update, so the email belongs to another patient
+            db.session.rollback()
+            return {"error": "A patient with this email already exists"}, 409
 
         # Redirect the user to the patient list page after successful update
         return redirect(url_for('patients.get_patients'))
@@ -181,7 +201,8 @@ def get_patient(id):
     """
     Handles GET requests to retrieve patient data for the given ID.
 
-    Retrieves the patient record from the database and renders the view_patient.html template with the decrypted patient data.
+    Retrieves the patient record from the database and renders the view_patient.html template.
+    The encrypted fields are decrypted by the model when the template reads them.
 
     :param id: ID of the patient to retrieve.
     """
@@ -192,14 +213,8 @@ def get_patient(id):
     if not patient:
         return {"error": "Patient not found"}, 404
     
-    # Decrypt the contact number for display purposes
-    patient.contact_number = decrypt_data(patient.contact_number)
-    # Decrypt the email for display purposes
-    patient.email = decrypt_data(patient.email)
-    # Decrypt the medical history for display purposes
-    patient.medical_history = decrypt_data(patient.medical_history)
-    
-    # Render the 'view_patient.html' template, passing the decrypted patient data
+    # Render the 'view_patient.html' template, the contact number, email and medical history
+    # are decrypted on first access for display purposes
     return render_template('view_patient.html', patient=patient)
 
 
@@ -238,30 +253,29 @@ def get_patient_by_name():
     """
     Handles POST requests to search for a patient by name.
 
-    Retrieves the patient record from the database and decrypts the sensitive data.
+    Retrieves the best matching patient records from the database with the trigram-indexed fuzzy name search
+    (see app.utils.name_search) and decrypts the sensitive data.
     Returns a rendered template with the decrypted patient data and related appointments and treatment plans.
+
+    The appointments and treatment plans of all matching patients are loaded with one query each
+    (selectin eager loading), so the search always issues the same number of queries whatever the
+    number of matching patients.
     """
+    # Load the medical history with the patients, and the appointments and treatment plans of all
+    # matching patients in one extra query each, instead of two queries per patient
+    search_options = (
+        db.undefer(Patient.medical_history),
+        db.selectinload(Patient.appointments),
+        db.selectinload(Patient.treatment_plans)
+    )
+
     try:
         # Get the patient name to search for from the POST request
         patient_name = request.form['patient_name'].strip()
         
-        # Split the name by spaces to allow searching by first and last names
-        name_parts = patient_name.split()
-
-        # If the user provided both first and last names, search for both
-        if len(name_parts) == 2:
-            first_name, last_name = name_parts
-            patients = Patient.query.filter(
-                (Patient.first_name.ilike(f'%{first_name}%')) &
-                (Patient.last_name.ilike(f'%{last_name}%'))
-            ).all()
-
-        # If only one part was provided, search both first and last names
-        else:
-            patients = Patient.query.filter(
-                (Patient.first_name.ilike(f'%{patient_name}%')) |
-                (Patient.last_name.ilike(f'%{patient_name}%'))
-            ).all()
+        # Search the first and last names with the indexed fuzzy name search, best matches first
+        # Partial names ("smi"), full names ("john smith") and typos ("john andersen") all match
+        patients = search_patients_by_name(patient_name, limit=SEARCH_RESULTS_LIMIT, options=search_options)
 
         # If no patients were found, render an error message
         if not patients:
@@ -269,22 +283,11 @@ def get_patient_by_name():
         
         # If a match was found, decrypt patient data for each patient and related appointments and treatment plans
         patients_data = []
-        for patient in patients:
-            patient_data = {
-                'id': patient.id,
-                'first_name': patient.first_name,
-                'last_name': patient.last_name,
-                'date_of_birth': patient.date_of_birth,
-                'contact_number': decrypt_data(patient.contact_number),
-                'email': decrypt_data(patient.email),
-                'medical_history': decrypt_data(patient.medical_history)
-            }
-            appointments = Appointment.query.filter_by(patient_id=patient.id).all()
-            treatment_plans = TreatmentPlan.query.filter_by(patient_id=patient.id).all()
+        for patient, patient_data in zip(patients, Patient.serialize_many(patients)):
             patients_data.append({
                 'patient': patient_data,
-                'appointments': appointments,
-                'treatment_plans': treatment_plans
+                'appointments': patient.appointments,
+                'treatment_plans': patient.treatment_plans
             })
 
         # Render the 'view_patient_with_appointments.html' template with patient data
@@ -20,7 +20,9 @@ def view_treatment_plans():
 
     The route returns a rendered template of 'treatment_plans.html' with a list of all treatment plans.
 
-    The treatment plans are retrieved from the database using the TreatmentPlan.query.all() method.
+    The treatment plans are retrieved from the database with one query, which also loads the first
+    and last names of their patients (see Patient.name_options), so rendering the list does not
+    run one query per treatment plan.
 
     The treatment plans are passed to the template as a variable called 'treatment_plans'.
 
@@ -34,8 +36,8 @@ def view_treatment_plans():
 
     """
 
-    # Retrieve all treatment plans from the database
-    treatment_plans = TreatmentPlan.query.all()
+    # Retrieve all treatment plans from the database, with the patient names the template shows
+    treatment_plans = TreatmentPlan.query.options(Patient.name_options(TreatmentPlan.patient)).all()
 
     # Render the 'treatment_plans.html' template with the list of treatment plans
     return render_template('treatment_plans.html', treatment_plans=treatment_plans)
@@ -193,7 +195,7 @@ def view_treatment_plans_by_patient(patient_id):
     """
 
     # Retrieve all treatment plans for the given patient ID from the database
-    treatment_plans = TreatmentPlan.query.filter_by(patient_id=patient_id).all()
+    treatment_plans = TreatmentPlan.query.options(Patient.name_options(TreatmentPlan.patient)).filter_by(patient_id=patient_id).all()
 
     # Check if the treatment plans exist
     if not treatment_plans:
@@ -3,6 +3,7 @@ from app.models import User, Patient, InventoryItem, Appointment
 from app import db
 from datetime import datetime, timedelta
 from functools import wraps
+from app.utils.scheduling import appointments_between
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -324,12 +325,10 @@ def index():
     # Calculate two days from today's date
     two_days_from_now = today + timedelta(days=2)
     
-    # Query the Appointment table to get all upcoming appointments within the 
-    # next two days
+    # Get all upcoming appointments, and occurrences of recurring series,
+    # within the next two days
     # The appointments are sorted by their dates in ascending order
-    upcoming_appointments = Appointment.query.filter(
-        Appointment.appointment_date.between(today, two_days_from_now)
-    ).order_by(Appointment.appointment_date.asc()).all()
+    upcoming_appointments = appointments_between(today, two_days_from_now)
     
     # Query the InventoryItem table to get all items that are low in stock
     # Low in stock means the quantity is less than the threshold
@@ -0,0 +1,181 @@
+# app/utils/appointment_stats.py
+
+import calendar
+from datetime import date, datetime, time as time_of_day, timedelta
+from sqlalchemy import func, cast, Date, Integer, extract
+from app import db
+from app.models import Appointment
+from app.utils.day_cache import DayCache
+from app.utils.recurrence import occurrences_between
+
+try:
+    import numpy
+except ImportError:  # Optional (not in requirements.txt): it only speeds up the SQLite path, GROUP BY is used without it
+    numpy = None
+
+# Longest period of a heatmap, in days
+MAX_STATS_DAYS = 731
+
+# The counts of finished days are cached for this many seconds, and for at most this many days.
+# The cache is process-local: under gunicorn each worker has its own. Changes made through this
+# process drop the days they touch at once (see invalidate_appointment_stats); the expiry bounds
+# how long a change made by another process (another gunicorn worker, a script) can go
+# unnoticed. Today and the days ahead are never cached: they are recomputed every time.
+STATS_CACHE_SECONDS = 3600
+STATS_CACHE_MAX_DAYS = 5000
+
+# Cache of the hourly counts of finished days: {date: [24 counts]}
+_stats_cache = DayCache(STATS_CACHE_SECONDS, STATS_CACHE_MAX_DAYS)
+
+
+def appointment_heatmap(first_day, last_day):
+    """
+    Return the number of appointments starting in each hour of each day of a period.
+
+    Finished days (before today) are served from a cache when they are in it.
+    The days missing from the cache, and today and the days ahead, are
+    counted by the database with one query per run of consecutive days (see
+    _count_appointments); the occurrences of appointment series are added to
+    the counts of their hour. A day invalidated while it is being counted is
+    returned but not cached.
+
+    :param first_day: The first day of the period (a date)
+    :param last_day: The last day of the period, included (a date)
+    :return: A dictionary {date: [24 counts, one per hour from 00:00]} with every day of the period
+    """
+    days = [first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+    today = date.today()
+
+    counts, generation = _stats_cache.get_many([day for day in days if day < today])
+
+    missing = [day for day in days if day not in counts]
+    loaded = {}
+    for run_start, run_end in _consecutive_runs(missing):
+        loaded.update(_count_appointments(run_start, run_end))
+
+    finished = {day: loaded[day] for day in missing if day < today}
+    if finished:
+        _stats_cache.store(finished, generation)
+
+    counts.update(loaded)
+    return {day: counts[day] for day in days}
+
+
+def invalidate_appointment_stats(*days):
+    """
+    Drop the cached counts of the given days.
+
+    Called by app.utils.scheduling.invalidate_free_slots, so every change that
+    drops the busy times of a day (ORM changes at commit time, bulk
+    statements) drops its counts as well.
+
+    :param days: The dates (or datetimes) whose appointments changed
+    """
+    _stats_cache.invalidate(*days)
+
+
+def clear_appointment_stats():
+    """
+    Drop all the cached counts, e.g. after a change to an appointment series, which covers many days.
+    """
+    _stats_cache.clear()
+
+
+def _consecutive_runs(days):
+    """
+    Split sorted days into runs of consecutive days.
+
+    :return: A list of (first day, last day) tuples
+    """
+    runs = []
+    for day in days:
+        if runs and runs[-1][1] + timedelta(days=1) == day:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return [tuple(run) for run in runs]
+
+
+def _count_appointments(first_day, last_day):
+    """
+    Count the appointments and series occurrences starting in each hour of consecutive days.
+
+    The appointments are counted without loading them as objects:
+
+    - on SQLite, when NumPy is installed, only the start of each appointment
+      is read, as an integer number of hours since the start of the period,
+      and the hours are counted by numpy.bincount instead of grouped by
+      SQLite (on par with the GROUP BY, see benchmarks/bench_heatmap.py);
+    - otherwise the database groups the appointments by day and hour and
+      returns one row per hour that has appointments.
+
+    Either way, the appointments are read with one range scan of the
+    appointment_date index.
+
+    :return: A dictionary {date: [24 counts]} with every day from first_day to last_day
+    """
+    start = datetime.combine(first_day, time_of_day.min)
+    end = datetime.combine(last_day + timedelta(days=1), time_of_day.min)
+    number_of_days = (last_day - first_day).days + 1
+
+    if numpy is not None and db.session.get_bind().dialect.name == 'sqlite':
+        hourly = _count_with_numpy(start, end, number_of_days)
+    else:
+        hourly = _count_with_group_by(start, end, number_of_days)
+
+    # The series of the period are few and expanded for the period only
+    for occurrence in occurrences_between(start, end):
+        if start <= occurrence.appointment_date < end:
+            hourly[(occurrence.appointment_date - start) // timedelta(hours=1)] += 1
+
+    return {
+        first_day + timedelta(days=offset): hourly[offset * 24:(offset + 1) * 24]
+        for offset in range(number_of_days)
+    }
+
+
+def _count_with_numpy(start, end, number_of_days):
+    """
+    Count the appointments of [start, end) per hour with numpy.bincount (SQLite).
+
+    SQLite returns each start as the number of hours since the start of the
+    period, computed from the exact number of seconds (strftime('%s')), so
+    the counting is a single bincount over a flat array of hours.
+
+    :return: A flat list of number_of_days * 24 counts
+    """
+    origin = calendar.timegm(start.timetuple())
+    hours = db.session.execute(
+        db.select((cast(func.strftime('%s', Appointment.appointment_date), Integer) - origin) // 3600)
+        .where(Appointment.appointment_date >= start, Appointment.appointment_date < end)
+    ).scalars()
+    hours = numpy.fromiter(hours, dtype=numpy.int64)
+    return numpy.bincount(hours, minlength=number_of_days * 24).tolist()
+
+
+def _count_with_group_by(start, end, number_of_days):
+    """
+    Count the appointments of [start, end) per hour with a GROUP BY in the database.
+
+    :return: A flat list of number_of_days * 24 counts
+    """
+    if db.session.get_bind().dialect.name == 'sqlite':
+        day = func.date(Appointment.appointment_date)
+        hour = cast(func.strftime('%H', Appointment.appointment_date), Integer)
+    else:
+        day = cast(Appointment.appointment_date, Date)
+        hour = extract('hour', Appointment.appointment_date)
+
+    rows = db.session.execute(
+        db.select(day, hour, func.count())
+        .where(Appointment.appointment_date >= start, Appointment.appointment_date < end)
+        .group_by(day, hour)
+    )
+
+    hourly = [0] * (number_of_days * 24)
+    first_day = start.date()
+    for row_day, row_hour, count in rows:
+        if isinstance(row_day, str):
+            row_day = date.fromisoformat(row_day)
+        hourly[(row_day - first_day).days * 24 + int(row_hour)] += count
+    return hourly
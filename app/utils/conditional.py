@@ -0,0 +1,138 @@
+# app/utils/conditional.py
+
+import hashlib
+from datetime import timezone
+from flask import request, Response
+from sqlalchemy import func
+from app import db
+
+
+def _etag(*parts):
+    """
+    Hash the parts identifying one version of one representation into an ETag value.
+    """
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def _last_modified(instance):
+    """
+    Return the time of the last change of a row: updated_at, or created_at if it was never updated.
+    """
+    return instance.updated_at or instance.created_at
+
+
+def resource_validators(instance, *variant):
+    """
+    Return the strong ETag and the Last-Modified time of a single resource.
+
+    The ETag is derived from the table, the primary key and the last change
+    time (updated_at, or created_at for rows never updated), plus the variant:
+    anything else the representation depends on, such as the requested
+    fields of a sparse fieldset. It is therefore computed without reading,
+    decrypting or serializing the resource itself.
+
+    :param instance: A model instance with updated_at and created_at columns
+    :param variant: Values that select the representation (e.g. the list of fields)
+    :return: A tuple (etag, last_modified), or (None, None) if the row has no
+        timestamps and cannot be validated
+    """
+    last_modified = _last_modified(instance)
+    if last_modified is None:
+        return None, None
+    etag = _etag(instance.__tablename__, instance.id, last_modified.isoformat(), variant)
+    return etag, last_modified
+
+
+def collection_validators(model, *criteria, variant=()):
+    """
+    Return the strong ETag of a collection of rows, and no Last-Modified time.
+
+    A single aggregate query returns the number of rows, the highest ID and
+    the latest change time of the rows matching the criteria. An insert
+    changes the count and the highest ID, an update changes the latest change
+    time, and a deletion changes the count, so any change to the collection
+    changes the ETag.
+
+    The latest change time is not a valid Last-Modified time of a collection:
+    deleting a row, or moving a row out of the criteria, leaves it unchanged
+    (or even makes it older), so a client revalidating with If-Modified-Since
+    would keep its stale copy. Collections are therefore validated by their
+    ETag only: no Last-Modified header is sent and If-Modified-Since is not
+    honoured (is_not_modified ignores it when last_modified is None).
+
+    :param model: The model class of the collection (with updated_at and created_at columns)
+    :param criteria: Filter conditions of the collection (e.g. TreatmentPlan.patient_id == 3)
+    :param variant: Values that select the representation (e.g. the page and the fields)
+    :return: A tuple (etag, None), shaped like the result of resource_validators
+    """
+    count, max_id, latest_change = db.session.query(
+        func.count(model.id),
+        func.max(model.id),
+        func.max(func.coalesce(model.updated_at, model.created_at))
+    ).filter(*criteria).one()
+
+    etag = _etag(model.__tablename__, count, max_id, latest_change.isoformat() if latest_change else None, variant)
+    return etag, None
+
+
+def is_not_modified(etag, last_modified):
+    """
+    Check the If-None-Match and If-Modified-Since headers of the current request.
+
+    If-None-Match takes precedence: when it is present, If-Modified-Since is
+    ignored. If-Modified-Since is only honoured for single resources, which
+    have a change time; collections pass None (see collection_validators).
+    Last-Modified has a one second resolution, so the change time is
+    truncated to the second before it is compared.
+
+    :param etag: The current ETag of the resource, or None
+    :param last_modified: The current change time of the resource (naive UTC), or None for a collection
+    :return: True if the client's copy is current and a 304 can be sent
+    """
+    if etag is None:
+        return False
+
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+
+    if request.if_modified_since and last_modified is not None:
+        return _http_date(last_modified) <= request.if_modified_since
+
+    return False
+
+
+def not_modified_response(etag, last_modified):
+    """
+    Return an empty 304 Not Modified response carrying the validators.
+    """
+    return add_validators(Response(status=304), etag, last_modified)
+
+
+def add_validators(response, etag, last_modified):
+    """
+    Set the ETag, Last-Modified and Cache-Control headers of a response.
+
+    Cache-Control: private, no-cache lets the browser keep the (personal)
+    data but makes it revalidate on every use, which is what the conditional
+    requests are for.
+
+    :param response: The response to update
+    :param etag: The ETag, or None to leave the response without validators
+    :param last_modified: The change time (naive UTC), or None
+    :return: The response
+    """
+    if etag is None:
+        return response
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _http_date(last_modified)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _http_date(value):
+    """
+    Convert a naive UTC datetime to an aware one truncated to the second, like an HTTP date.
+    """
+    return value.replace(microsecond=0, tzinfo=timezone.utc)
@@ -0,0 +1,100 @@
+# app/utils/day_cache.py
+
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+
+class DayCache:
+    """
+    A process-local cache of one value per day, with an expiry, a size bound and invalidation.
+
+    Under gunicorn each worker process has its own cache: a change made
+    through one worker invalidates the days in that worker only, and the
+    other workers notice it when their entries expire.
+
+    A value is loaded outside the lock, so a change can be committed, and its
+    days invalidated, while a request is still loading the old value. To keep
+    such a request from storing that stale value, every invalidation gives
+    the days it drops a new generation (a number from a counter of the
+    cache): a request takes the current generation before loading, and
+    store() leaves out the days invalidated since (or all of them after a
+    clear()).
+    """
+
+    def __init__(self, seconds, max_days):
+        """
+        :param seconds: How long a value is kept, in seconds
+        :param max_days: The most days kept; the least recently stored are dropped first
+        """
+        self.seconds = seconds
+        self.max_days = max_days
+        self._entries = OrderedDict()  # {date: (expiry time, value)}
+        self._generation = 0
+        # The generation of the last invalidation of each recently invalidated day, oldest first
+        self._invalidated = OrderedDict()
+        # Generation of the last clear(), or of the oldest invalidation forgotten (see invalidate)
+        self._cleared = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, days):
+        """
+        Return the values of the days that are cached and not expired, and the generation to pass to store().
+
+        :return: A tuple ({date: value}, generation)
+        """
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for day in days:
+                entry = self._entries.get(day)
+                if entry is not None and entry[0] > now:
+                    found[day] = entry[1]
+            return found, self._generation
+
+    def store(self, values, generation):
+        """
+        Cache values loaded after get_many() returned generation, except the days invalidated since.
+
+        :param values: A dictionary {date: value}
+        :param generation: The generation returned by get_many() before the values were loaded
+        """
+        expiry = time.monotonic() + self.seconds
+        with self._lock:
+            if self._cleared > generation:
+                return
+            for day, value in values.items():
+                if self._invalidated.get(day, 0) > generation:
+                    continue
+                self._entries[day] = (expiry, value)
+                self._entries.move_to_end(day)
+            while len(self._entries) > self.max_days:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *days):
+        """
+        Drop the given days (dates or datetimes) and keep the loads in progress from storing them.
+        """
+        with self._lock:
+            self._generation += 1
+            for day in days:
+                day = day.date() if isinstance(day, datetime) else day
+                self._entries.pop(day, None)
+                self._invalidated[day] = self._generation
+                self._invalidated.move_to_end(day)
+            # Forgetting the oldest invalidations is safe: they count as a clear() for the loads
+            # that started before them, which then store nothing
+            while len(self._invalidated) > self.max_days:
+                _, forgotten = self._invalidated.popitem(last=False)
+                self._cleared = max(self._cleared, forgotten)
+
+    def clear(self):
+        """
+        Drop every day and keep the loads in progress from storing anything.
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._invalidated.clear()
+            self._cleared = self._generation
@@ -0,0 +1,154 @@
+# app/utils/encrypted_types.py
+
+from sqlalchemy.types import TypeDecorator, LargeBinary
+from app.utils.encryption import encrypt_data, decrypt_data, decrypt_many
+
+
+class EncryptedBinary(TypeDecorator):
+    """
+    Column type for values that are stored encrypted.
+
+    The column is stored as LargeBinary. When a plaintext value is written
+    through a SQL statement (for example a bulk INSERT or UPDATE), it is
+    encrypted with encrypt_data before being sent to the database. Values that
+    are already bytes are assumed to be encrypted and are stored unchanged.
+
+    Values read from the database are returned as the raw ciphertext: the
+    decryption is deferred to the first access of the matching
+    EncryptedAttribute on the model instance.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        """
+        Encrypt plaintext values before they are sent to the database.
+        """
+        return encrypt_data(value)
+
+    def process_result_value(self, value, dialect):
+        """
+        Return the ciphertext unchanged; decryption happens on attribute access.
+        """
+        return value
+
+
+class EncryptedAttribute:
+    """
+    Descriptor exposing an EncryptedBinary column as plaintext.
+
+    The column itself is mapped under a private attribute name (for example
+    '_email' for the 'email' column), and this descriptor is set on the model
+    under the public name. On an instance:
+
+    - Reading the attribute decrypts the ciphertext on first access and caches
+      the plaintext for the lifetime of the instance. The cache remembers which
+      ciphertext it was computed from, so it is discarded automatically if the
+      row is refreshed or the column is changed behind its back.
+    - Assigning a plaintext value encrypts it immediately and caches the
+      plaintext, so reading it back costs nothing. Assigning bytes stores them
+      as an already encrypted value.
+    - If a blind index function and attribute are given, the index is
+      recomputed on every assignment, so it can never go stale.
+
+    On the class, the descriptor returns the mapped column attribute, so it can
+    still be used in queries and loader options (e.g. load_only, undefer).
+    """
+
+    def __init__(self, column_attribute, index_attribute=None, index_function=None):
+        """
+        :param column_attribute: The name of the mapped attribute holding the ciphertext
+        :param index_attribute: The name of the attribute holding the blind index, if any
+        :param index_function: The function computing the blind index from the plaintext
+        """
+        self.column_attribute = column_attribute
+        self.index_attribute = index_attribute
+        self.index_function = index_function
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def _cache(self, instance):
+        """
+        Return the per-instance plaintext cache, creating it if needed.
+        """
+        return instance.__dict__.setdefault('_plaintext_cache', {})
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return getattr(owner, self.column_attribute)
+
+        ciphertext = getattr(instance, self.column_attribute)
+        cached = self._cache(instance).get(self.name)
+
+        # Reuse the cached plaintext only if it was computed from the current ciphertext
+        if cached is not None and cached[0] is ciphertext:
+            return cached[1]
+
+        plaintext = decrypt_data(ciphertext)
+        self._cache(instance)[self.name] = (ciphertext, plaintext)
+        return plaintext
+
+    def __set__(self, instance, value):
+        if isinstance(value, bytes):
+            # Already encrypted: store it as is and decrypt lazily if it is ever read
+            ciphertext = value
+            self._cache(instance).pop(self.name, None)
+            plaintext = decrypt_data(value) if self.index_function else None
+        else:
+            plaintext = value
+            ciphertext = encrypt_data(value)
+            self._cache(instance)[self.name] = (ciphertext, plaintext)
+
+        setattr(instance, self.column_attribute, ciphertext)
+
+        if self.index_attribute:
+            setattr(instance, self.index_attribute, self.index_function(plaintext))
+
+    def prime(self, instance, ciphertext, plaintext):
+        """
+        Store an already decrypted value in the cache of an instance.
+        """
+        self._cache(instance)[self.name] = (ciphertext, plaintext)
+
+
+def _encrypted_attribute(cls, name):
+    """
+    Return the EncryptedAttribute descriptor called name on cls or one of its bases.
+    """
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            return klass.__dict__[name]
+    raise AttributeError(f"{cls.__name__} has no encrypted attribute {name!r}")
+
+
+def preload_decrypted(instances, *names):
+    """
+    Decrypt the given encrypted attributes of several instances in one batch.
+
+    The ciphertexts of all the requested attributes of all the instances are
+    decrypted with a single decrypt_many call and stored in the per-instance
+    caches, so that reading the attributes afterwards does not decrypt
+    anything. Attributes that are already cached are not decrypted again.
+
+    :param instances: A list of model instances of the same class
+    :param names: The public names of the encrypted attributes to decrypt
+    """
+    if not instances:
+        return
+
+    descriptors = [_encrypted_attribute(type(instances[0]), name) for name in names]
+
+    pending = []
+    for instance in instances:
+        for descriptor in descriptors:
+            ciphertext = getattr(instance, descriptor.column_attribute)
+            cached = descriptor._cache(instance).get(descriptor.name)
+            if cached is None or cached[0] is not ciphertext:
+                pending.append((instance, descriptor, ciphertext))
+
+    plaintexts = decrypt_many(ciphertext for _, _, ciphertext in pending)
+
+    for (instance, descriptor, ciphertext), plaintext in zip(pending, plaintexts):
+        descriptor.prime(instance, ciphertext, plaintext)
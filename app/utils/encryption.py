@@ -1,22 +1,121 @@
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 import os
-from base64 import b64encode, b64decode
+import re
+import hmac
+import zlib
+import struct
+import hashlib
+import multiprocessing
+from base64 import b64encode, b64decode, urlsafe_b64decode
+from concurrent.futures import ProcessPoolExecutor
 
 # Key is stored in an Environmental variable
 key = os.environ.get('ENCRYPTION_KEY')
 if not key:
     raise ValueError("ENCRYPTION_KEY environment variable is not set.")
 
+# Legacy cipher: rows written before the versioned envelope existed are bare
+# Fernet tokens encrypted with ENCRYPTION_KEY
 cipher_suite = Fernet(key)
 
+# Versioned envelope
+#
+# New ciphertexts start with a small binary header:
+#
+#     version (1 byte) | algorithm (1 byte) | flags (1 byte) | key id (2 bytes)
+#
+# followed by the algorithm payload. For AES-GCM the payload is a 12 byte
+# nonce followed by the ciphertext and tag, and the header is authenticated as
+# associated data. Bare Fernet tokens always start with 'g' (the base64 of the
+# 0x80 Fernet version byte), so they can never be mistaken for an envelope.
+ENVELOPE_VERSION = 1
+ALGORITHM_AES_GCM = 1
+ALGORITHM_FERNET = 2
+ENVELOPE_HEADER = struct.Struct('>BBBH')
+AES_GCM_NONCE_SIZE = 12
+
+# Envelope flags
+FLAG_ZLIB = 0x01  # The plaintext was compressed with zlib before encryption
+
+# Plaintexts of at least this many bytes (typically long medical histories)
+# are compressed before being encrypted. The compressed form is only kept if
+# it is actually smaller. Set to 0 to disable compression.
+COMPRESS_THRESHOLD = int(os.environ.get('ENCRYPTION_COMPRESS_THRESHOLD', 1024))
+
+def _load_keyring():
+    """
+    Build the keyring mapping key ids to (algorithm, cipher) pairs.
+
+    Keys are read from the ENCRYPTION_KEYS environment variable, a comma
+    separated list of '<key id>:<algorithm>:<key>' entries where algorithm is
+    'aesgcm' (key: url-safe base64 of 32 random bytes) or 'fernet' (key: a
+    Fernet key). For example:
+
+        ENCRYPTION_KEYS='2:aesgcm:<new key>,1:aesgcm:<old key>'
+
+    Key id 1 is always an AES-GCM key derived from ENCRYPTION_KEY with HKDF
+    (unless ENCRYPTION_KEYS redefines it), so existing deployments get the fast
+    path for new writes without any configuration change, and rows written
+    with it stay readable after new keys are added.
+    """
+    derived_key = HKDF(
+        algorithm=hashes.SHA256(), length=32, salt=None, info=b'oralease-aes-gcm'
+    ).derive(key.encode('utf-8'))
+    keyring = {1: (ALGORITHM_AES_GCM, AESGCM(derived_key))}
+
+    configured = os.environ.get('ENCRYPTION_KEYS')
+    if configured:
+        for entry in configured.split(','):
+            key_id, algorithm, key_material = entry.strip().split(':', 2)
+            if algorithm == 'aesgcm':
+                keyring[int(key_id)] = (ALGORITHM_AES_GCM, AESGCM(urlsafe_b64decode(key_material)))
+            elif algorithm == 'fernet':
+                keyring[int(key_id)] = (ALGORITHM_FERNET, Fernet(key_material))
+            else:
+                raise ValueError(f"Unknown encryption algorithm in ENCRYPTION_KEYS: {algorithm}")
+
+    return keyring
+
+keyring = _load_keyring()
+
+# All new ciphertexts are written with the active key. Older keys stay in the
+# keyring so that existing rows remain readable until they are re-encrypted.
+active_key_id = int(os.environ.get('ENCRYPTION_ACTIVE_KEY_ID') or max(keyring))
+if active_key_id not in keyring:
+    raise ValueError(f"ENCRYPTION_ACTIVE_KEY_ID {active_key_id} is not in the keyring.")
+
+# Key used for the keyed blind indexes. It should be set separately from the
+# encryption key; if it is not, a key is derived from ENCRYPTION_KEY so that the
+# indexes never use the encryption key itself.
+blind_index_key = os.environ.get('BLIND_INDEX_KEY')
+if blind_index_key:
+    blind_index_key = blind_index_key.encode('utf-8')
+else:
+    blind_index_key = hmac.new(key.encode('utf-8'), b'oralease-blind-index', hashlib.sha256).digest()
+
+# Batches larger than this are split into chunks of this size and spread
+# across the worker pool; smaller batches are handled in the calling process.
+BATCH_CHUNK_SIZE = int(os.environ.get('ENCRYPTION_BATCH_SIZE', 1000))
+
+# Number of worker processes used for large batches. A value of 1 disables
+# the pool entirely.
+BATCH_WORKERS = int(os.environ.get('ENCRYPTION_WORKERS', os.cpu_count() or 1))
+
+# The pool is created lazily on the first large batch and reused afterwards
+_executor = None
+
 def encrypt_data(data):
     """
     Encrypt data, handling different input types safely
 
-    This function is a wrapper around Fernet's encrypt method, with extra
+    This function encrypts data with the active key of the keyring and wraps
+    the result in a versioned envelope (see ENVELOPE_HEADER), with extra
     handling for different input types. The purpose of this function is to
-    make sure that the input data is converted into a type that Fernet can
-    encrypt, and then to encrypt that data.
+    make sure that the input data is converted into a type that can be
+    encrypted, and then to encrypt that data.
 
     The function is designed to be safe to call with None, string, bytes,
     or any other type of input. If the input is None, the function will
@@ -39,8 +138,8 @@ def encrypt_data(data):
     if not isinstance(data, str):
         data = str(data)
     
-    # Encrypt the string data
-    encrypted_data = cipher_suite.encrypt(data.encode('utf-8'))
+    # Encrypt the string data with the active key
+    encrypted_data = _seal(data.encode('utf-8'))
     
     return encrypted_data
 
@@ -48,10 +147,11 @@ def decrypt_data(encrypted_data):
     """
     Decrypt data, handling different input types safely
 
-    This function is a wrapper around Fernet's decrypt method, with extra
+    This function decrypts a versioned envelope with the key named in its
+    header, or a legacy bare Fernet token with ENCRYPTION_KEY, with extra
     handling for different input types. The purpose of this function is to
-    make sure that the input data is converted into a type that Fernet can
-    decrypt, and then to decrypt that data.
+    make sure that the input data is converted into a type that can be
+    decrypted, and then to decrypt that data.
 
     The function is designed to be safe to call with None, string, bytes,
     or any other type of input. If the input is None, the function will
@@ -73,8 +173,8 @@ def decrypt_data(encrypted_data):
         encrypted_data = encrypted_data.encode('utf-8')
     
     try:
-        # Decrypt the bytes data
-        decrypted = cipher_suite.decrypt(encrypted_data)
+        # Decrypt the bytes data with the key named in its header (or the legacy Fernet key)
+        decrypted = _open(encrypted_data)
         
         # Decode the bytes data as a string
         decrypted = decrypted.decode('utf-8')
@@ -84,3 +184,201 @@ def decrypt_data(encrypted_data):
     except Exception as e:
         # Log the error here if you have logging set up
         raise ValueError(f"Decryption failed: {str(e)}")
+
+
+def _seal(plaintext):
+    """
+    Encrypt plaintext bytes with the active key and wrap them in an envelope.
+
+    Plaintexts of COMPRESS_THRESHOLD bytes or more are compressed with zlib
+    first, and FLAG_ZLIB is set in the header. The header is authenticated, so
+    the flag cannot be tampered with. Only free text is large enough to be
+    compressed; short fields such as emails and phone numbers never are.
+    """
+    flags = 0
+    if COMPRESS_THRESHOLD and len(plaintext) >= COMPRESS_THRESHOLD:
+        compressed = zlib.compress(plaintext)
+        if len(compressed) < len(plaintext):
+            plaintext = compressed
+            flags |= FLAG_ZLIB
+
+    algorithm, cipher = keyring[active_key_id]
+    header = ENVELOPE_HEADER.pack(ENVELOPE_VERSION, algorithm, flags, active_key_id)
+
+    if algorithm == ALGORITHM_AES_GCM:
+        nonce = os.urandom(AES_GCM_NONCE_SIZE)
+        return header + nonce + cipher.encrypt(nonce, plaintext, header)
+
+    return header + cipher.encrypt(plaintext)
+
+def _parse_header(token):
+    """
+    Return the (version, algorithm, flags, key id) header of an envelope, or None for a legacy token.
+    """
+    if len(token) > ENVELOPE_HEADER.size and token[0] == ENVELOPE_VERSION:
+        return ENVELOPE_HEADER.unpack_from(token)
+    return None
+
+def _open(token):
+    """
+    Decrypt an envelope or a legacy Fernet token and return the plaintext bytes.
+    """
+    header = _parse_header(token)
+    if header is None:
+        return cipher_suite.decrypt(token)
+
+    version, algorithm, flags, key_id = header
+    if key_id not in keyring:
+        raise ValueError(f"Unknown encryption key id {key_id}")
+
+    key_algorithm, cipher = keyring[key_id]
+    if key_algorithm != algorithm:
+        raise ValueError(f"Key id {key_id} does not use algorithm {algorithm}")
+
+    payload = token[ENVELOPE_HEADER.size:]
+
+    if algorithm == ALGORITHM_AES_GCM:
+        nonce = payload[:AES_GCM_NONCE_SIZE]
+        plaintext = cipher.decrypt(nonce, payload[AES_GCM_NONCE_SIZE:], token[:ENVELOPE_HEADER.size])
+    else:
+        plaintext = cipher.decrypt(payload)
+
+    if flags & FLAG_ZLIB:
+        plaintext = zlib.decompress(plaintext)
+
+    return plaintext
+
+def needs_reencryption(encrypted_data):
+    """
+    Tell whether a ciphertext was written with anything other than the active key.
+
+    Legacy Fernet tokens and envelopes using an older key id both need to be
+    re-encrypted before the old key can be retired. None never does.
+
+    :param encrypted_data: A ciphertext as stored in the database, or None
+    :return: True if the value should be re-encrypted with the active key
+    """
+    if encrypted_data is None:
+        return False
+
+    header = _parse_header(bytes(encrypted_data))
+    return header is None or header[3] != active_key_id
+
+def _get_executor():
+    """
+    Return the shared process pool used for large batches, creating it on first use.
+
+    Cipher calls hold the GIL, so a thread pool would not run them in parallel;
+    worker processes are used instead. The 'fork' start method is preferred
+    where available so that the workers inherit the already initialised
+    cipher suite instead of re-importing the application.
+    """
+    global _executor
+    if _executor is None:
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+        _executor = ProcessPoolExecutor(max_workers=BATCH_WORKERS, mp_context=context)
+    return _executor
+
+def _encrypt_chunk(chunk):
+    """Encrypt one chunk of a batch. Runs inside a pool worker."""
+    return [encrypt_data(value) for value in chunk]
+
+def _decrypt_chunk(chunk):
+    """Decrypt one chunk of a batch. Runs inside a pool worker."""
+    return [decrypt_data(value) for value in chunk]
+
+def _run_batch(values, chunk_function):
+    """
+    Apply chunk_function to values, splitting large batches across the worker pool.
+
+    The values are cut into chunks of BATCH_CHUNK_SIZE items. If there is only
+    one chunk, or the pool is disabled, the chunk is processed in the calling
+    process. Otherwise the chunks are mapped over the pool; executor.map
+    returns results in submission order, so the output lines up with the input.
+    """
+    values = list(values)
+
+    if BATCH_WORKERS <= 1 or len(values) <= BATCH_CHUNK_SIZE:
+        return chunk_function(values)
+
+    chunks = [values[i:i + BATCH_CHUNK_SIZE] for i in range(0, len(values), BATCH_CHUNK_SIZE)]
+
+    results = []
+    for chunk_result in _get_executor().map(chunk_function, chunks):
+        results.extend(chunk_result)
+    return results
+
+def encrypt_many(values):
+    """
+    Encrypt a batch of values, preserving their order.
+
+    Each value is handled exactly like encrypt_data would handle it (None stays
+    None, bytes are returned unchanged, anything else is encrypted as a string).
+    Large batches are split across a pool of worker processes.
+
+    :param values: An iterable of values to encrypt
+    :return: A list of encrypted values, in the same order as the input
+    """
+    return _run_batch(values, _encrypt_chunk)
+
+def decrypt_many(encrypted_values):
+    """
+    Decrypt a batch of values, preserving their order.
+
+    Each value is handled exactly like decrypt_data would handle it (None stays
+    None, strings are encoded before decryption). Large batches are split across
+    a pool of worker processes. A ValueError is raised if any value fails to decrypt.
+
+    :param encrypted_values: An iterable of encrypted values
+    :return: A list of decrypted strings, in the same order as the input
+    """
+    return _run_batch(encrypted_values, _decrypt_chunk)
+
+def blind_index(value):
+    """
+    Compute a keyed blind index for a value.
+
+    The blind index is the hex-encoded HMAC-SHA256 of the value under
+    blind_index_key. Unlike the Fernet ciphertext it is deterministic, so it can
+    be stored in an indexed column and used for equality lookups and unique
+    constraints without revealing the value or decrypting anything.
+
+    :param value: The (already normalised) value to index, or None
+    :return: A 64 character hex string, or None if the value is None or empty
+    """
+    if value is None:
+        return None
+
+    if not isinstance(value, str):
+        value = str(value)
+
+    if not value:
+        return None
+
+    return hmac.new(blind_index_key, value.encode('utf-8'), hashlib.sha256).hexdigest()
+
+def email_blind_index(email):
+    """
+    Compute the blind index of an email address.
+
+    The address is stripped and lower-cased first so that ' John@Example.com'
+    and 'john@example.com' share the same index.
+    """
+    if email is None:
+        return None
+    return blind_index(str(email).strip().lower())
+
+def phone_blind_index(contact_number):
+    """
+    Compute the blind index of a phone number.
+
+    Every character except the digits is removed first so that
+    '+1 (555) 010-2030' and '15550102030' share the same index, which is what
+    a caller ID lookup needs.
+    """
+    if contact_number is None:
+        return None
+    return blind_index(re.sub(r'\D', '', str(contact_number)))
@@ -0,0 +1,77 @@
+# app/utils/feed_tokens.py
+
+from datetime import datetime
+from itsdangerous import URLSafeSerializer, BadSignature
+from app import app, db
+from app.models import CalendarFeedToken, User
+
+# Roles allowed to read the calendar feeds, with a session or with a token
+FEED_ROLES = ('admin', 'user')
+
+# Salt of the token signatures, so a feed token cannot be replayed as another signed value (e.g. a session)
+FEED_TOKEN_SALT = 'calendar-feed-token'
+
+
+def _serializer():
+    """
+    Return the serializer signing the feed tokens with the secret key of the application.
+    """
+    return URLSafeSerializer(app.secret_key, salt=FEED_TOKEN_SALT)
+
+
+def create_feed_token(user_id):
+    """
+    Create a feed token for a user and return it with its signed value.
+
+    The token is added to the session and flushed; the caller commits.
+
+    :param user_id: The ID of the user the token reads the feeds as
+    :return: A tuple (token, signed value to put in the feed URLs)
+    """
+    token = CalendarFeedToken(user_id=user_id)
+    db.session.add(token)
+    db.session.flush()
+    return token, signed_feed_token(token)
+
+
+def signed_feed_token(token):
+    """
+    Return the signed value of a feed token, as put in the 'token' query parameter of the feed URLs.
+    """
+    return _serializer().dumps(token.id)
+
+
+def verify_feed_token(value):
+    """
+    Return the user a signed feed token reads the feeds as, or None if the token is not valid.
+
+    A token is valid if its signature is, it was not revoked, and its user
+    still exists and has one of the FEED_ROLES. The user is read again on
+    every request, so a user whose role changed loses access at once.
+
+    :param value: The signed value from the 'token' query parameter
+    :return: The User, or None
+    """
+    try:
+        token_id = _serializer().loads(value)
+    except BadSignature:
+        return None
+    if isinstance(token_id, bool) or not isinstance(token_id, int):
+        return None
+
+    user = db.session.execute(
+        db.select(User)
+        .join(CalendarFeedToken, CalendarFeedToken.user_id == User.id)
+        .where(CalendarFeedToken.id == token_id, CalendarFeedToken.revoked_at.is_(None))
+    ).scalar()
+    if user is None or user.role not in FEED_ROLES:
+        return None
+    return user
+
+
+def revoke_feed_token(token):
+    """
+    Revoke a feed token: the feed URLs carrying it are refused from now on. The caller commits.
+    """
+    if token.revoked_at is None:
+        token.revoked_at = datetime.utcnow()
@@ -0,0 +1,33 @@
+# app/utils/fieldsets.py
+
+
+def parse_fields(args, allowed, default):
+    """
+    Read the sparse fieldset of a request (?fields=id,first_name,last_name).
+
+    Clients that only need a few fields of a resource can name them in the
+    fields parameter, so that the other columns are neither fetched nor (for
+    encrypted columns) decrypted. The 'id' field is always included, and the
+    fields are returned in the order of allowed whatever the order they were
+    requested in.
+
+    :param args: The request arguments (request.args)
+    :param allowed: The fields the resource can return, in output order
+    :param default: The fields returned when ?fields is not given
+    :return: The list of fields to return
+    :raises ValueError: If a field is unknown or no field is named
+    """
+    value = args.get('fields')
+    if value is None:
+        return list(default)
+
+    requested = {field.strip() for field in value.split(',') if field.strip()}
+    if not requested:
+        raise ValueError("fields must name at least one field")
+
+    unknown = sorted(requested - set(allowed))
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    requested.add('id')
+    return [field for field in allowed if field in requested]
@@ -0,0 +1,119 @@
+# app/utils/icalendar.py
+
+from datetime import timedelta
+
+# Identifies the application in the PRODID line of the feeds
+PRODUCT_ID = '-//Dental Clinic Management System//Appointments//EN'
+
+
+def calendar_header(name):
+    """
+    Return the lines opening a VCALENDAR, as one string.
+
+    :param name: The name calendar applications show for the feed (X-WR-CALNAME)
+    """
+    return _lines(
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        f'PRODID:{PRODUCT_ID}',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{escape_text(name)}',
+    )
+
+
+def calendar_footer():
+    """
+    Return the line closing a VCALENDAR.
+    """
+    return _lines('END:VCALENDAR')
+
+
+def format_event(uid, start, duration_minutes, summary, description=None, stamp=None):
+    """
+    Return one VEVENT, as one string of folded CRLF-terminated lines.
+
+    The appointment times are stored without a time zone and shown as they
+    are in the application, so they are written as floating local times
+    (no 'Z' suffix): a calendar application shows them at the same wall-clock
+    time. DTSTAMP, which must be in UTC, is the time of the last change of
+    the appointment, so it only changes when the appointment does.
+
+    :param uid: A globally unique, stable identifier of the event
+    :param start: The start of the event (a naive datetime)
+    :param duration_minutes: The length of the event in minutes
+    :param summary: The title of the event
+    :param description: The notes of the event, or None
+    :param stamp: The last change of the event (naive UTC), or None for the start
+    """
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:{uid}',
+        f'DTSTAMP:{_format_utc(stamp or start)}',
+        f'DTSTART:{_format_local(start)}',
+        f'DTEND:{_format_local(start + timedelta(minutes=duration_minutes))}',
+        f'SUMMARY:{escape_text(summary)}',
+    ]
+    if description:
+        lines.append(f'DESCRIPTION:{escape_text(description)}')
+    lines.append('END:VEVENT')
+    return _lines(*lines)
+
+
+def escape_text(value):
+    """
+    Escape a TEXT value (RFC 5545, 3.3.11): backslashes, semicolons, commas and newlines.
+    """
+    return (
+        value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n').replace('\r', '\\n')
+    )
+
+
+def fold_line(line):
+    """
+    Fold a content line into lines of at most 75 octets (RFC 5545, 3.1).
+
+    Continuation lines start with a space. The line is cut between
+    characters, never inside a multi-byte UTF-8 sequence.
+    """
+    if len(line.encode('utf-8')) <= 75:
+        return line
+
+    parts = []
+    current = ''
+    size = 0
+    # The first line holds 75 octets, the continuation lines 74 after their leading space
+    limit = 75
+    for character in line:
+        length = len(character.encode('utf-8'))
+        if size + length > limit:
+            parts.append(current)
+            current = ''
+            size = 0
+            limit = 74
+        current += character
+        size += length
+    parts.append(current)
+    return '\r\n '.join(parts)
+
+
+def _lines(*lines):
+    """
+    Fold and join content lines, each terminated by CRLF.
+    """
+    return ''.join(fold_line(line) + '\r\n' for line in lines)
+
+
+def _format_local(value):
+    """
+    Format a naive datetime as a floating DATE-TIME.
+    """
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def _format_utc(value):
+    """
+    Format a naive UTC datetime as a UTC DATE-TIME.
+    """
+    return value.strftime('%Y%m%dT%H%M%SZ')
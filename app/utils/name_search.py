@@ -0,0 +1,460 @@
+# app/utils/name_search.py
+
+import re
+from sqlalchemy import text, func, select
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+from app.models import Patient
+
+# Table of the distinct lower-cased first and last names of the patients
+NAMES_TABLE = 'patient_names'
+
+# Name of the trigram index on the names table on PostgreSQL
+PG_TRIGRAM_INDEX = 'ix_patient_names_trgm'
+
+# Name of the trigger function (PostgreSQL) and prefix of the triggers filling the names table
+NAMES_TRIGGER = 'patient_names_sync'
+
+# Advisory lock serializing setup_name_search between gunicorn workers starting together on PostgreSQL
+PG_SETUP_LOCK_KEY = 7_300_417
+
+# Name of the FTS5 table mirroring the names table on SQLite
+SQLITE_FTS_TABLE = 'patient_names_fts'
+
+# Indexes of the patients table on the lower-cased names, looking up the patients bearing a name
+PATIENT_NAME_INDEXES = {
+    'ix_patients_first_name_lower': 'first_name',
+    'ix_patients_last_name_lower': 'last_name',
+}
+
+# Structures of the former full name search, dropped by setup_name_search
+LEGACY_PG_TRIGRAM_INDEX = 'ix_patients_full_name_trgm'
+LEGACY_SQLITE_FTS_TABLE = 'patients_name_fts'
+
+# Minimum trigram similarity of a misspelt word to a name. Above the pg_trgm
+# default (0.3), which lets ten times as many names through the index for a
+# typo in a long name, all of them rechecked.
+NAME_SIMILARITY_THRESHOLD = 0.4
+
+# Searches with fewer letters or digits than this return no patients
+MIN_QUERY_LENGTH = 2
+
+# Words shorter than this only match the names they begin: their typos share too few trigrams with the right name
+FUZZY_MIN_WORD_LENGTH = 4
+
+# Names kept for every word of a search
+NAMES_PER_WORD = 20
+
+# Names whose patients are looked up by each query filling the page of results
+NAMES_PER_QUERY = 5
+
+# Names fetched from the SQLite FTS5 table for a misspelt word, before ranking them by similarity
+FTS_CANDIDATES = 200
+
+# Patients matching several words of a search that are ranked (the others are left out)
+FULL_MATCH_CANDIDATES = 1000
+
+# Search backend chosen by setup_name_search: 'pg_trgm', 'fts5' or 'like'
+_backend = 'like'
+
+
+def _padded_name_sql(row):
+    """
+    Return the SQL expression of the name stored in the SQLite FTS5 table for a row of the names table.
+
+    Like pg_trgm, every word is padded with two spaces in front and one
+    behind, so that the beginning and end of each word produce trigrams of
+    their own (e.g. '  s', ' sm' and 'th ' for 'smith'). Names with typos then
+    still share trigrams with the right name.
+
+    :param row: The row alias ('new' in the trigger)
+    """
+    return f"'  ' || replace({row}.name, ' ', '  ') || ' '"
+
+
+def _fill_names_sql(insert):
+    """
+    Return the statement filling the names table from the patients table.
+
+    :param insert: The start of the statement ('INSERT INTO ...' or 'INSERT OR IGNORE INTO ...')
+    """
+    return (
+        f"{insert} {NAMES_TABLE} (name) "
+        f"SELECT lower(first_name) FROM patients UNION SELECT lower(last_name) FROM patients"
+    )
+
+
+def _create_patient_name_indexes():
+    """
+    Create the (lower(name), id) indexes of the patients table, if they do not exist yet.
+    """
+    for index, column in PATIENT_NAME_INDEXES.items():
+        db.session.execute(text(f"CREATE INDEX IF NOT EXISTS {index} ON patients (lower({column}), id)"))
+
+
+def _setup_pg():
+    """
+    Create the names table, its trigram index and the triggers filling it on PostgreSQL.
+
+    :return: True if the names table was (re)filled from the patients table
+    """
+    db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': PG_SETUP_LOCK_KEY})
+    db.session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    db.session.execute(text(f"DROP INDEX IF EXISTS {LEGACY_PG_TRIGRAM_INDEX}"))
+
+    existing = set(db.session.execute(text(
+        "SELECT tgname FROM pg_trigger WHERE tgrelid = 'patients'::regclass AND tgname LIKE :prefix"
+    ), {'prefix': f'{NAMES_TRIGGER}%'}).scalars())
+
+    # The C collation lets the primary key serve the prefix ranges of the searches
+    db.session.execute(text(f'CREATE TABLE IF NOT EXISTS {NAMES_TABLE} (name text COLLATE "C" PRIMARY KEY)'))
+    db.session.execute(text(
+        f"CREATE INDEX IF NOT EXISTS {PG_TRIGRAM_INDEX} ON {NAMES_TABLE} USING gin (name gin_trgm_ops)"
+    ))
+    _create_patient_name_indexes()
+
+    # Statement-level triggers: a bulk import adds its names with one statement
+    db.session.execute(text(
+        f"CREATE OR REPLACE FUNCTION {NAMES_TRIGGER}() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+        f"INSERT INTO {NAMES_TABLE} (name) "
+        f"SELECT lower(first_name) FROM new_rows UNION SELECT lower(last_name) FROM new_rows "
+        f"ON CONFLICT DO NOTHING; RETURN NULL; END $$"
+    ))
+    for event in ('insert', 'update'):
+        trigger = f'{NAMES_TRIGGER}_{event}'
+        if trigger not in existing:
+            db.session.execute(text(
+                f"CREATE TRIGGER {trigger} AFTER {event.upper()} ON patients "
+                f"REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION {NAMES_TRIGGER}()"
+            ))
+
+    if {f'{NAMES_TRIGGER}_insert', f'{NAMES_TRIGGER}_update'} <= existing:
+        return False
+
+    # Newly created (or triggers lost with a dropped patients table): add the names of the existing rows
+    db.session.execute(text(f"TRUNCATE {NAMES_TABLE}"))
+    db.session.execute(text(_fill_names_sql('INSERT INTO')))
+    return True
+
+
+def _setup_sqlite():
+    """
+    Create the names table, its FTS5 table and the triggers filling them on SQLite.
+
+    :return: True if the names table was (re)filled from the patients table
+    """
+    # Drop the FTS5 table of the former full name search, with its triggers
+    for suffix in ('_ai', '_ad', '_au'):
+        db.session.execute(text(f"DROP TRIGGER IF EXISTS {LEGACY_SQLITE_FTS_TABLE}{suffix}"))
+    db.session.execute(text(f"DROP TABLE IF EXISTS {LEGACY_SQLITE_FTS_TABLE}"))
+
+    existing = set(db.session.execute(text(
+        "SELECT name FROM sqlite_master WHERE name LIKE :fts OR name LIKE :trigger"
+    ), {'fts': f'{SQLITE_FTS_TABLE}%', 'trigger': f'{NAMES_TRIGGER}%'}).scalars())
+
+    db.session.execute(text(f"CREATE TABLE IF NOT EXISTS {NAMES_TABLE} (name TEXT PRIMARY KEY)"))
+    db.session.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5(name, tokenize='trigram')"
+    ))
+    _create_patient_name_indexes()
+
+    # Keep the names table in sync with the patients table, and the FTS5 table with the names table
+    new_names = f"INSERT OR IGNORE INTO {NAMES_TABLE} (name) VALUES (lower(new.first_name)), (lower(new.last_name))"
+    db.session.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {NAMES_TRIGGER}_insert AFTER INSERT ON patients BEGIN {new_names}; END"
+    ))
+    db.session.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {NAMES_TRIGGER}_update AFTER UPDATE OF first_name, last_name ON patients "
+        f"BEGIN {new_names}; END"
+    ))
+    db.session.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_ai AFTER INSERT ON {NAMES_TABLE} BEGIN "
+        f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, name) VALUES (new.rowid, {_padded_name_sql('new')}); END"
+    ))
+
+    expected = {SQLITE_FTS_TABLE, f'{SQLITE_FTS_TABLE}_ai', f'{NAMES_TRIGGER}_insert', f'{NAMES_TRIGGER}_update'}
+    if expected <= existing:
+        return False
+
+    # Newly created (or triggers lost with a dropped patients table): index the names of the existing rows
+    db.session.execute(text(f"DELETE FROM {SQLITE_FTS_TABLE}"))
+    db.session.execute(text(f"DELETE FROM {NAMES_TABLE}"))
+    db.session.execute(text(_fill_names_sql('INSERT OR IGNORE INTO')))
+    return True
+
+
+def setup_name_search():
+    """
+    Create the structures used by the fuzzy name search, if they do not exist yet.
+
+    The search looks up the words of the searched name in a table of the
+    distinct lower-cased first and last names of the patients (a few tens of
+    thousands of rows for hundreds of thousands of patients), then the
+    patients bearing the matching names through (lower(name), id) indexes of
+    the patients table. Triggers add the names of new and renamed patients
+    to the names table; the names of deleted patients stay there, and simply
+    find no patient.
+
+    On PostgreSQL, the names table has a GIN trigram index (pg_trgm) for the
+    misspelt words. On SQLite (local runs), an FTS5 table with the trigram
+    tokenizer mirrors the padded names. The names table is filled from the
+    patients table when it (or its triggers) had to be created, and the
+    structures of the former full name search are dropped. On any other
+    database, or if these features are not available, the search falls
+    back to ILIKE.
+
+    The function is idempotent and is called at startup after db.create_all().
+    """
+    global _backend
+    dialect = db.engine.dialect.name
+
+    try:
+        if dialect == 'postgresql':
+            filled = _setup_pg()
+            db.session.commit()
+            _backend = 'pg_trgm'
+        elif dialect == 'sqlite':
+            filled = _setup_sqlite()
+            db.session.commit()
+            _backend = 'fts5'
+        else:
+            return
+    except SQLAlchemyError:
+        # The extension or the FTS5 trigram tokenizer is not available: use ILIKE
+        db.session.rollback()
+        _backend = 'like'
+        return
+
+    if filled and dialect == 'postgresql':
+        # Statistics for the planner, and the GIN pending list flushed, as autovacuum would leave them
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text(f"VACUUM ANALYZE {NAMES_TABLE}"))
+
+
+def _words(name):
+    """
+    Return the distinct lower-cased words of a name, in order.
+    """
+    words = []
+    for word in re.findall(r'\w+', name.lower()):
+        if word not in words:
+            words.append(word)
+    return words
+
+
+def _trigrams(name):
+    """
+    Return the distinct lower-cased trigrams of the words of a name, padded like pg_trgm.
+    """
+    trigrams = []
+    for word in _words(name):
+        padded = f'  {word} '
+        for i in range(len(padded) - 2):
+            trigram = padded[i:i + 3]
+            if trigram not in trigrams:
+                trigrams.append(trigram)
+    return trigrams
+
+
+def _similarity(word, name):
+    """
+    Return the trigram similarity of a searched word to a name, between 0 and 1.
+
+    Like the pg_trgm similarity, it is the share of the trigrams of both
+    that they have in common; the word is compared with the closest word of
+    the name, so that 'berg' scores the same against 'berg' and 'van der
+    berg'.
+    """
+    trigrams = set(_trigrams(word))
+    scores = [0.0]
+    for other in _words(name):
+        other_trigrams = set(_trigrams(other))
+        scores.append(len(trigrams & other_trigrams) / len(trigrams | other_trigrams))
+    return max(scores)
+
+
+def _prefix_names(word):
+    """
+    Return up to NAMES_PER_WORD names beginning with word, the shortest (closest) first.
+
+    The prefix is looked up as a range of the primary key of the names table.
+    """
+    return db.session.execute(text(
+        f"SELECT name FROM {NAMES_TABLE} WHERE name >= :low AND name < :high ORDER BY length(name), name LIMIT :limit"
+    ), {'low': word, 'high': word[:-1] + chr(ord(word[-1]) + 1), 'limit': NAMES_PER_WORD}).scalars().all()
+
+
+def _similar_names(word):
+    """
+    Return names similar to a (misspelt) word, through the trigram index of the names table.
+    """
+    if _backend == 'pg_trgm':
+        db.session.execute(
+            text("SELECT set_config('pg_trgm.similarity_threshold', :threshold, true)"),
+            {'threshold': str(NAME_SIMILARITY_THRESHOLD)}
+        )
+        return db.session.execute(text(
+            f"SELECT name FROM {NAMES_TABLE} WHERE name % :word ORDER BY similarity(name, :word) DESC, name "
+            f"LIMIT :limit"
+        ), {'word': word, 'limit': NAMES_PER_WORD}).scalars().all()
+
+    # Any shared trigram makes a candidate; bm25 picks the names sharing the most (and rarest)
+    # trigrams. The first trigram of each word ('  s') is shared by too many names to narrow the search
+    trigrams = _trigrams(word)
+    selective = [trigram for trigram in trigrams if not trigram.startswith('  ')] or trigrams
+    match = ' OR '.join(f'"{trigram}"' for trigram in selective)
+    return db.session.execute(text(
+        f"SELECT {NAMES_TABLE}.name FROM {SQLITE_FTS_TABLE} JOIN {NAMES_TABLE} "
+        f"ON {NAMES_TABLE}.rowid = {SQLITE_FTS_TABLE}.rowid "
+        f"WHERE {SQLITE_FTS_TABLE} MATCH :match ORDER BY rank LIMIT :limit"
+    ), {'match': match, 'limit': FTS_CANDIDATES}).scalars().all()
+
+
+def _matching_names(word):
+    """
+    Return the names matching a searched word, with their similarity to it.
+
+    A word matches the names it begins ('smi' for 'smith'), or, if there
+    are none and the word is long enough, the names similar enough to it
+    (typos). Both lookups read a few pages of the names table.
+
+    :return: A dictionary of the matching names to their similarity to the word
+    """
+    names = _prefix_names(word)
+    if names:
+        return {name: _similarity(word, name) for name in names}
+    if len(word) < FUZZY_MIN_WORD_LENGTH:
+        return {}
+
+    scored = [(_similarity(word, name), name) for name in _similar_names(word)]
+    scored = [(score, name) for score, name in scored if score >= NAME_SIMILARITY_THRESHOLD]
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return {name: score for score, name in scored[:NAMES_PER_WORD]}
+
+
+def _ilike_ids(name, limit):
+    """
+    Return the IDs of the patients whose first or last name contains every word of name.
+    """
+    query = db.session.query(Patient.id)
+    for word in name.split():
+        query = query.filter(Patient.first_name.ilike(f'%{word}%') | Patient.last_name.ilike(f'%{word}%'))
+    return [row.id for row in query.order_by(Patient.last_name, Patient.first_name, Patient.id).limit(limit)]
+
+
+def _name_pages(names, limit):
+    """
+    Return the first patients (by ID) bearing each name, as first or last name.
+
+    Each name and column is one probe of a (lower(name), id) index, read up
+    to limit entries. The query is a plain UNION ALL: built with the ORM,
+    its few dozen subqueries cost more to compile than to run.
+
+    :return: (id, first_name, last_name) rows, with lower-cased names
+    """
+    pages = []
+    params = {'limit': limit}
+    for i, name in enumerate(names):
+        params[f'name_{i}'] = name
+        for column in PATIENT_NAME_INDEXES.values():
+            pages.append(
+                f"SELECT * FROM (SELECT id, lower(first_name) AS first_name, lower(last_name) AS last_name "
+                f"FROM patients WHERE lower({column}) = :name_{i} ORDER BY id LIMIT :limit) AS page_{i}_{column}"
+            )
+    return db.session.execute(text(' UNION ALL '.join(pages)), params).all()
+
+
+def _ranked_ids(name, limit):
+    """
+    Return the IDs of the patients matching name, best match first.
+
+    The patients are ranked by the number of words of name their first or
+    last name matches, then by the average similarity of these words to
+    their closest name, then by ID.
+    """
+    if _backend == 'like':
+        return _ilike_ids(name, limit)
+
+    matches = [_matching_names(word) for word in _words(name)]
+    best = {}
+    for words in matches:
+        for candidate, score in words.items():
+            best[candidate] = max(best.get(candidate, 0.0), score)
+    if not best:
+        return []
+
+    rows = []
+    if len(matches) > 1:
+        # The patients matching a word with each of their names (e.g. 'john smith'): a bitmap
+        # AND of the two name indexes, without reading the other Johns and Smiths
+        first_name = func.lower(Patient.first_name)
+        last_name = func.lower(Patient.last_name)
+        rows = db.session.execute(
+            select(Patient.id, first_name.label('first_name'), last_name.label('last_name'))
+            .where(first_name.in_(best), last_name.in_(best))
+            .order_by(Patient.id).limit(FULL_MATCH_CANDIDATES)
+        ).all()
+
+    # Fill the page with the patients matching a single name, ranked by the similarity of that
+    # name: the names are probed best first, until the page is full and the next names score lower
+    names = sorted(best, key=lambda candidate: (-best[candidate], candidate))
+    start = 0
+    while start < len(names) and len({row.id for row in rows}) < limit:
+        end = start + NAMES_PER_QUERY
+        while end < len(names) and best[names[end]] == best[names[end - 1]]:
+            end += 1
+        rows += _name_pages(names[start:end], limit)
+        start = end
+
+    def rank(row):
+        scores = [max(words.get(row.first_name, 0.0), words.get(row.last_name, 0.0))
+                  for words in matches
+                  if row.first_name in words or row.last_name in words]
+        return -len(scores), -sum(scores) / len(matches), row.id
+
+    ids = []
+    for row in sorted(rows, key=rank):
+        if row.id not in ids:
+            ids.append(row.id)
+    return ids[:limit]
+
+
+def search_patients_by_name(name, limit=20, options=()):
+    """
+    Search patients by name, tolerating partial names and typos, best matches first.
+
+    Each word of the name is looked up in the table of the distinct patient
+    names (see setup_name_search): by prefix ('smi' for 'smith'), or, for a
+    word of four letters or more that begins no name, with the trigram index
+    (pg_trgm on PostgreSQL, FTS5 on SQLite). The patients bearing the
+    matching names are then found through the name indexes of the patients
+    table, and only the IDs of the best matches are kept; the patients
+    themselves are loaded in one query. Other databases fall back to ILIKE.
+
+    A search reads a few index pages per word and at most a few hundred
+    index entries of patients, whatever the size of the table: at 500,000
+    patients with realistic names (benchmarks/bench_name_search.py), it
+    takes about 3 ms on PostgreSQL for a full or partial name and 6 ms
+    when a word is misspelt (the trigram lookup), about half of it in
+    Python; on SQLite, 2 ms and 27 ms. Searches with fewer than
+    MIN_QUERY_LENGTH letters or digits return no patients.
+
+    :param name: The (partial, possibly misspelt) name to search for
+    :param limit: The maximum number of patients to return
+    :param options: Loader options applied to the query loading the patients
+        (e.g. db.selectinload(Patient.appointments))
+    :return: A list of Patient objects, best match first
+    """
+    name = (name or '').strip()
+    if len(''.join(_words(name))) < MIN_QUERY_LENGTH:
+        return []
+
+    ids = _ranked_ids(name, limit)
+    if not ids:
+        return []
+
+    patients = Patient.query.options(*options).filter(Patient.id.in_(ids)).all()
+
+    # Restore the ranking order
+    position = {patient_id: index for index, patient_id in enumerate(ids)}
+    return sorted(patients, key=lambda patient: position[patient.id])
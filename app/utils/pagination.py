@@ -0,0 +1,123 @@
+# app/utils/pagination.py
+
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+
+# Page size used when the client does not ask for one
+DEFAULT_PAGE_SIZE = 50
+
+# Largest page size a client can ask for
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values):
+    """
+    Encode the sort key of the last row of a page as an opaque cursor.
+
+    The cursor is the url-safe base64 of the JSON list of values, without
+    padding. Clients should treat it as an opaque string and pass it back
+    unchanged to get the next page.
+
+    :param values: A list of JSON serialisable values (e.g. [42] or ['2024-05-01T09:00:00', 42])
+    :return: The cursor as a string
+    """
+    return urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor created by encode_cursor.
+
+    :param cursor: The cursor string
+    :return: The list of values
+    :raises ValueError: If the cursor is malformed
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+
+    return values
+
+
+def parse_limit(args, default_limit=DEFAULT_PAGE_SIZE, max_limit=MAX_PAGE_SIZE):
+    """
+    Read the page size of a paginated request (?limit=<n>), capped at max_limit.
+
+    :param args: The request arguments (request.args)
+    :param default_limit: The page size used when ?limit is not given
+    :param max_limit: The largest accepted page size
+    :return: The page size
+    :raises ValueError: If the limit is not a positive integer
+    """
+    try:
+        limit = int(args.get('limit', default_limit))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, max_limit)
+
+
+def parse_page_args(args, default_limit=DEFAULT_PAGE_SIZE, max_limit=MAX_PAGE_SIZE):
+    """
+    Read the page size and starting ID of a keyset-paginated request.
+
+    The starting point is given either as ?after=<id> (the ID of the last row
+    already seen) or as ?cursor=<next_cursor> (as returned by the previous
+    page). The page size is given as ?limit=<n> and is capped at max_limit.
+
+    :param args: The request arguments (request.args)
+    :param default_limit: The page size used when ?limit is not given
+    :param max_limit: The largest accepted page size
+    :return: A tuple (after, limit); after is None for the first page
+    :raises ValueError: If a parameter is malformed
+    """
+    limit = parse_limit(args, default_limit, max_limit)
+
+    after = None
+    if args.get('cursor'):
+        values = decode_cursor(args['cursor'])
+        if len(values) != 1 or not isinstance(values[0], int):
+            raise ValueError("Invalid cursor")
+        after = values[0]
+    elif args.get('after'):
+        try:
+            after = int(args['after'])
+        except ValueError:
+            raise ValueError("after must be an integer")
+
+    return after, limit
+
+
+def keyset_page(query, id_column, after, limit):
+    """
+    Return one page of a query, ordered by an increasing unique ID column.
+
+    Instead of OFFSET, which makes the database walk and discard every row
+    before the page, the page starts with a 'id > after' condition, so every
+    page is a single range scan of the primary key index no matter how deep
+    it is. One extra row is fetched to know whether there is a next page.
+
+    :param query: The query to paginate (without ORDER BY or LIMIT)
+    :param id_column: The unique column to paginate on (e.g. Patient.id)
+    :param after: The ID of the last row of the previous page, or None
+    :param limit: The page size
+    :return: A tuple (rows, next_cursor); next_cursor is None on the last page
+    """
+    if after is not None:
+        query = query.filter(id_column > after)
+
+    rows = query.order_by(id_column.asc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], id_column.key)])
+
+    return rows, next_cursor
@@ -0,0 +1,287 @@
+# app/utils/recurrence.py
+
+import calendar
+from datetime import datetime, timedelta, timezone
+from app import db
+from app.models import AppointmentSeries, Patient, DEFAULT_APPOINTMENT_MINUTES
+
+# Most occurrences a series can have (a daily series for a year)
+MAX_SERIES_OCCURRENCES = 366
+
+
+def to_naive_utc(value):
+    """
+    Return a datetime as the database stores it: naive, in UTC.
+
+    ISO arguments may carry an offset ('2030-01-01T10:00:00Z',
+    '...+02:00'); such an aware datetime is converted to UTC and its offset
+    dropped, so it compares with the stored datetimes. A naive datetime is
+    taken to be UTC already and returned as is.
+    """
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class Occurrence:
+    """
+    One occurrence of an appointment series, expanded from the rule for a query.
+
+    Occurrences are not stored: they have the attributes of an appointment
+    (patient_id, patient, appointment_date, duration_minutes, notes, end_date)
+    plus the series_id and the occurrence_start the rule gives them, which
+    identify them (e.g. to cancel or move them). Their id is None, so that
+    lists mixing appointments and occurrences can tell them apart.
+    """
+    __slots__ = ('series', 'series_id', 'patient_id', 'occurrence_start', 'appointment_date', 'duration_minutes', 'notes')
+
+    # Occurrences have no row of their own
+    id = None
+
+    def __init__(self, series, occurrence_start, appointment_date=None, duration_minutes=None, notes=None):
+        self.series = series
+        self.series_id = series.id
+        self.patient_id = series.patient_id
+        self.occurrence_start = occurrence_start
+        self.appointment_date = appointment_date or occurrence_start
+        self.duration_minutes = duration_minutes or series.duration_minutes
+        self.notes = series.notes if notes is None else notes
+
+    @property
+    def patient(self):
+        """
+        Return the patient of the series (loaded with occurrences_between(..., with_patient_names=True)).
+        """
+        return self.series.patient
+
+    @property
+    def end_date(self):
+        """
+        Return the time the occurrence ends (the start plus the duration).
+        """
+        return self.appointment_date + timedelta(minutes=self.duration_minutes)
+
+    def serialize(self):
+        """
+        Return a dictionary representation of the occurrence for JSON responses.
+
+        :return: A dictionary with the keys 'series_id', 'patient_id',
+            'occurrence_start', 'appointment_date' (ISO strings),
+            'duration_minutes' and 'notes'
+        """
+        return {
+            'series_id': self.series_id,
+            'patient_id': self.patient_id,
+            'occurrence_start': self.occurrence_start.isoformat(),
+            'appointment_date': self.appointment_date.isoformat(),
+            'duration_minutes': self.duration_minutes,
+            'notes': self.notes
+        }
+
+
+def parse_series(data):
+    """
+    Read and check the rule of a new appointment series.
+
+    :param data: A dictionary with the keys 'starts_at' (an ISO datetime),
+        'frequency' ('daily', 'weekly' or 'monthly'), 'interval' (optional, 1
+        by default), and either 'count' (the number of occurrences) or 'until'
+        (an ISO datetime: the last occurrence starts at or before it)
+    :return: A dictionary with the keys 'starts_at', 'frequency', 'interval' and 'count'
+    :raises ValueError: With a readable message if the rule is invalid
+    """
+    try:
+        starts_at = to_naive_utc(datetime.fromisoformat(data['starts_at']))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("starts_at must be an ISO datetime (e.g. '2024-05-06T09:30:00')")
+
+    frequency = data.get('frequency')
+    if frequency not in AppointmentSeries.FREQUENCIES:
+        raise ValueError(f"frequency must be one of: {', '.join(AppointmentSeries.FREQUENCIES)}")
+
+    interval = data.get('interval', 1)
+    if isinstance(interval, bool) or not isinstance(interval, int) or interval < 1:
+        raise ValueError("interval must be a positive integer")
+
+    rule = {'starts_at': starts_at, 'frequency': frequency, 'interval': interval}
+
+    if data.get('count') is not None:
+        count = data['count']
+        if isinstance(count, bool) or not isinstance(count, int) or count < 1:
+            raise ValueError("count must be a positive integer")
+    elif data.get('until'):
+        try:
+            until = to_naive_utc(datetime.fromisoformat(data['until']))
+        except (TypeError, ValueError):
+            raise ValueError("until must be an ISO datetime (e.g. '2025-05-06T23:59:59')")
+        if until < starts_at:
+            raise ValueError("until must not be before starts_at")
+        # Count the occurrences starting at or before until, one past the limit at most
+        probe = AppointmentSeries(**rule, count=MAX_SERIES_OCCURRENCES + 1)
+        count = _index_from(probe, until, strict=True)
+    else:
+        raise ValueError("count or until is required")
+
+    if count > MAX_SERIES_OCCURRENCES:
+        raise ValueError(f"A series has at most {MAX_SERIES_OCCURRENCES} occurrences")
+
+    rule['count'] = count
+    return rule
+
+
+def occurrence_start(series, index):
+    """
+    Return the start the rule of a series gives to its occurrence number index (from 0).
+
+    Monthly occurrences keep the day of the month of starts_at, or the last
+    day of shorter months (an occurrence on the 31st falls on the 30th in
+    April). They are always computed from starts_at, so the day is not lost
+    after a short month.
+    """
+    if series.frequency == 'monthly':
+        month_index = series.starts_at.month - 1 + index * series.interval
+        year, month = series.starts_at.year + month_index // 12, month_index % 12 + 1
+        day = min(series.starts_at.day, calendar.monthrange(year, month)[1])
+        return series.starts_at.replace(year=year, month=month, day=day)
+
+    return series.starts_at + index * _step(series)
+
+
+def is_rule_occurrence(series, moment):
+    """
+    Check whether the rule of a series has an occurrence starting at moment.
+    """
+    index = _index_from(series, moment)
+    return index < series.count and occurrence_start(series, index) == moment
+
+
+def expand_series(series, start=None, end=None):
+    """
+    Return the occurrences of a series overlapping the window [start, end), in start order.
+
+    The expansion is lazy: the index of the first occurrence of the window is
+    computed directly from the rule (a division for daily and weekly series),
+    and only the occurrences of the window are built, so a window of one week
+    costs the same for a series of 13 or of 300 occurrences. Cancelled
+    occurrences are left out, and moved occurrences are placed at their new
+    time, inside or outside the window of their original start.
+
+    The exceptions are read from series.exceptions: load them with
+    selectinload when expanding many series (see occurrences_between).
+
+    :param series: An AppointmentSeries
+    :param start: The start of the window, or None for the first occurrence
+    :param end: The end of the window, or None for the last occurrence
+    :return: A list of Occurrence objects
+    """
+    exceptions = {exception.occurrence_start: exception for exception in series.exceptions}
+
+    occurrences = []
+    if start is None:
+        index = 0
+    else:
+        # The first occurrence that ends after the start of the window
+        index = _index_from(series, start - timedelta(minutes=series.duration_minutes), strict=True)
+    while index < series.count:
+        original = occurrence_start(series, index)
+        if end is not None and original >= end:
+            break
+        if original not in exceptions:
+            occurrences.append(Occurrence(series, original))
+        index += 1
+
+    # Changed occurrences may have been moved anywhere: test each one against the window
+    for exception in exceptions.values():
+        if exception.cancelled:
+            continue
+        occurrence = Occurrence(
+            series, exception.occurrence_start, exception.appointment_date, exception.duration_minutes, exception.notes
+        )
+        if (start is None or occurrence.end_date > start) and (end is None or occurrence.appointment_date < end):
+            occurrences.append(occurrence)
+
+    occurrences.sort(key=lambda occurrence: occurrence.appointment_date)
+    return occurrences
+
+
+def occurrences_between(start, end, patient_id=None, exclude_series_id=None, with_patient_names=False):
+    """
+    Return the occurrences of all the series overlapping the window [start, end), in start order.
+
+    The series are found with a range condition on their bounds (first_start
+    and last_end) and loaded with their exceptions in two queries, whatever
+    the number of series; each is then expanded for the window only.
+
+    :param start: The start of the window
+    :param end: The end of the window
+    :param patient_id: Only expand the series of this patient, or None
+    :param exclude_series_id: The ID of a series to leave out, or None
+    :param with_patient_names: Join in the patient names with the series (Patient.name_options),
+        for the views showing occurrence.patient
+    :return: A list of Occurrence objects
+    """
+    query = AppointmentSeries.query.options(db.selectinload(AppointmentSeries.exceptions)).filter(
+        AppointmentSeries.first_start < end, AppointmentSeries.last_end > start
+    )
+    if with_patient_names:
+        query = query.options(Patient.name_options(AppointmentSeries.patient))
+    if patient_id is not None:
+        query = query.filter(AppointmentSeries.patient_id == patient_id)
+    if exclude_series_id is not None:
+        query = query.filter(AppointmentSeries.id != exclude_series_id)
+
+    occurrences = [occurrence for series in query.all() for occurrence in expand_series(series, start, end)]
+    occurrences.sort(key=lambda occurrence: (occurrence.appointment_date, occurrence.series_id))
+    return occurrences
+
+
+def update_series_bounds(series):
+    """
+    Set first_start and last_end from the rule and the exceptions of a series.
+
+    Must be called whenever the rule or the exceptions change. The bounds may
+    be wider than the occurrences (e.g. after the first one is cancelled),
+    which only makes the series a candidate for a few more windows.
+    """
+    first_start = series.starts_at
+    last_end = occurrence_start(series, series.count - 1) + timedelta(minutes=series.duration_minutes)
+    for exception in series.exceptions:
+        if exception.cancelled or exception.appointment_date is None:
+            continue
+        duration = exception.duration_minutes or series.duration_minutes or DEFAULT_APPOINTMENT_MINUTES
+        first_start = min(first_start, exception.appointment_date)
+        last_end = max(last_end, exception.appointment_date + timedelta(minutes=duration))
+    series.first_start = first_start
+    series.last_end = last_end
+
+
+def _step(series):
+    """
+    Return the time between two occurrences of a daily or weekly series.
+    """
+    return timedelta(days=series.interval * (7 if series.frequency == 'weekly' else 1))
+
+
+def _index_from(series, moment, strict=False):
+    """
+    Return the index of the first occurrence of the rule starting at or after moment (after it if strict).
+
+    The index is estimated from the rule (a division of the elapsed time, or
+    of the elapsed months) and then adjusted by a step or two, so the cost
+    does not depend on the number of occurrences before moment. The result
+    can be count or more when no occurrence qualifies.
+    """
+    if series.starts_at > moment or (not strict and series.starts_at == moment):
+        return 0
+
+    if series.frequency == 'monthly':
+        months = (moment.year - series.starts_at.year) * 12 + moment.month - series.starts_at.month
+        index = max(0, months // series.interval - 1)
+    else:
+        index = max(0, (moment - series.starts_at) // _step(series) - 1)
+
+    while True:
+        start = occurrence_start(series, index)
+        if start > moment or (not strict and start == moment):
+            return index
+        index += 1
@@ -0,0 +1,243 @@
+# app/utils/reminder_senders.py
+
+import os
+import json
+import smtplib
+import urllib.request
+from email.message import EmailMessage
+from app import app
+
+
+class ReminderSender:
+    """
+    Base class of the reminder senders.
+
+    A message is a dictionary with the keys 'channel' ('email' or 'sms'),
+    'recipient' (an email address or a phone number), 'subject', 'body' and
+    'idempotency_key' (a string identifying the delivery: a provider that
+    supports it can drop a message it already accepted, e.g. when the
+    scheduler is restarted after sending but before recording it).
+
+    Subclasses implement send, and may override send_batch to reuse a
+    connection for the messages of a batch.
+    """
+
+    def send(self, message):
+        """
+        Send one message.
+
+        :raises Exception: If the message could not be sent
+        """
+        raise NotImplementedError
+
+    def send_batch(self, messages):
+        """
+        Send a batch of messages, one at a time.
+
+        :param messages: A list of messages
+        :return: A list with, for each message, None if it was sent or the error message
+        """
+        results = []
+        for message in messages:
+            try:
+                self.send(message)
+                results.append(None)
+            except Exception as e:
+                results.append(str(e) or type(e).__name__)
+        return results
+
+
+class StubSender(ReminderSender):
+    """
+    A sender that keeps the messages in memory and logs them instead of sending them.
+
+    It is used when no SMTP server or HTTP gateway is configured (local runs
+    and tests), and can also be given to send_due_reminders directly. A
+    message sent twice with the same idempotency key is only kept once, like
+    a provider honouring idempotency keys would.
+    """
+
+    def __init__(self):
+        self.sent = []
+        self._keys = set()
+
+    def send(self, message):
+        if message['idempotency_key'] in self._keys:
+            return
+        self._keys.add(message['idempotency_key'])
+        self.sent.append(message)
+        app.logger.info("Reminder (%s) to %s: %s", message['channel'], message['recipient'], message['body'])
+
+
+class SmtpSender(ReminderSender):
+    """
+    Send email reminders through an SMTP server, one connection per batch.
+    """
+
+    def __init__(self, host, port=587, username=None, password=None, from_address=None, use_tls=True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.from_address = from_address or username
+        self.use_tls = use_tls
+
+    def _message(self, message):
+        """
+        Build the email of a message.
+        """
+        email = EmailMessage()
+        email['From'] = self.from_address
+        email['To'] = message['recipient']
+        email['Subject'] = message['subject']
+        # Lets the receiving side recognise a message delivered twice
+        email['Message-ID'] = f"<reminder-{message['idempotency_key']}@{self.host}>"
+        email.set_content(message['body'])
+        return email
+
+    def _connect(self):
+        """
+        Open an SMTP connection, with STARTTLS and login if configured.
+        """
+        connection = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.use_tls:
+            connection.starttls()
+        if self.username:
+            connection.login(self.username, self.password)
+        return connection
+
+    def send(self, message):
+        with self._connect() as connection:
+            connection.send_message(self._message(message))
+
+    def send_batch(self, messages):
+        """
+        Send a batch of messages over one connection, never raising.
+
+        The outcome of every message is returned, including when the
+        connection is lost in the middle of the batch (a reset connection, a
+        socket timeout): the messages already accepted by the server are
+        reported as sent, so they are recorded and never sent again, and the
+        ones left are reported as errors, to be retried at the next run.
+        """
+        try:
+            connection = self._connect()
+        except (OSError, smtplib.SMTPException) as e:
+            return [str(e) or type(e).__name__] * len(messages)
+
+        results = []
+        try:
+            for message in messages:
+                try:
+                    connection.send_message(self._message(message))
+                    results.append(None)
+                except smtplib.SMTPServerDisconnected as e:
+                    results.append(str(e) or type(e).__name__)
+                    break
+                except smtplib.SMTPException as e:
+                    # The server refused this message (e.g. a bad recipient): go on with the next ones
+                    results.append(str(e) or type(e).__name__)
+                except OSError as e:
+                    # A socket error (smtplib.SMTPException is an OSError, so it is caught above):
+                    # the connection is in an unknown state, do not send anything else on it
+                    results.append(str(e) or type(e).__name__)
+                    break
+        finally:
+            try:
+                connection.quit()
+            except (OSError, smtplib.SMTPException):
+                connection.close()
+
+        lost = "The connection to the SMTP server was lost before sending"
+        return results + [lost] * (len(messages) - len(results))
+
+
+class HttpSender(ReminderSender):
+    """
+    Send reminders to an HTTP gateway (e.g. an SMS provider) as JSON POST requests.
+
+    Each message is posted as JSON with the keys 'channel', 'to', 'subject'
+    and 'body', with the idempotency key in an Idempotency-Key header and
+    the token, if any, as a bearer token. Any non-2xx response is an error.
+    """
+
+    def __init__(self, url, token=None, timeout=10):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+
+    def send(self, message):
+        payload = {
+            'channel': message['channel'],
+            'to': message['recipient'],
+            'subject': message['subject'],
+            'body': message['body'],
+        }
+        request = urllib.request.Request(
+            self.url, data=json.dumps(payload).encode('utf-8'), method='POST',
+            headers={'Content-Type': 'application/json', 'Idempotency-Key': message['idempotency_key']}
+        )
+        if self.token:
+            request.add_header('Authorization', f'Bearer {self.token}')
+        # urlopen raises HTTPError for non-2xx responses
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+class ChannelSender(ReminderSender):
+    """
+    Route each message to the sender of its channel, sending each channel's messages as one batch.
+    """
+
+    def __init__(self, senders):
+        """
+        :param senders: A dictionary {channel: ReminderSender}
+        """
+        self.senders = senders
+
+    def send(self, message):
+        self.senders[message['channel']].send(message)
+
+    def send_batch(self, messages):
+        results = [None] * len(messages)
+        for channel in {message['channel'] for message in messages}:
+            positions = [i for i, message in enumerate(messages) if message['channel'] == channel]
+            sender = self.senders.get(channel)
+            if sender is None:
+                for i in positions:
+                    results[i] = f"No sender configured for the {channel} channel"
+                continue
+            for i, result in zip(positions, sender.send_batch([messages[i] for i in positions])):
+                results[i] = result
+        return results
+
+
+def get_sender():
+    """
+    Return the reminder sender configured by the environment.
+
+    - REMINDER_SMTP_HOST (with REMINDER_SMTP_PORT, REMINDER_SMTP_USERNAME,
+      REMINDER_SMTP_PASSWORD and REMINDER_SMTP_FROM) sends the email reminders
+      through SMTP;
+    - REMINDER_HTTP_URL (with REMINDER_HTTP_TOKEN) sends the SMS reminders,
+      and the email reminders when no SMTP server is configured, to an HTTP
+      gateway;
+    - without either, the reminders go to a StubSender, which only logs them.
+
+    :return: A ReminderSender
+    """
+    senders = {}
+    if os.environ.get('REMINDER_HTTP_URL'):
+        http = HttpSender(os.environ['REMINDER_HTTP_URL'], os.environ.get('REMINDER_HTTP_TOKEN'))
+        senders['sms'] = senders['email'] = http
+    if os.environ.get('REMINDER_SMTP_HOST'):
+        senders['email'] = SmtpSender(
+            os.environ['REMINDER_SMTP_HOST'],
+            int(os.environ.get('REMINDER_SMTP_PORT', 587)),
+            os.environ.get('REMINDER_SMTP_USERNAME'),
+            os.environ.get('REMINDER_SMTP_PASSWORD'),
+            os.environ.get('REMINDER_SMTP_FROM')
+        )
+    if not senders:
+        return StubSender()
+    return ChannelSender(senders)
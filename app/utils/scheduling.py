@@ -0,0 +1,732 @@
+# app/utils/scheduling.py
+
+import bisect
+from datetime import datetime, time as time_of_day, timedelta
+from sqlalchemy import text, event, update, delete, bindparam, or_
+from sqlalchemy.exc import SQLAlchemyError
+from app import app, db
+from app.models import (
+    Patient, Appointment, AppointmentSeries, AppointmentSeriesException, DEFAULT_APPOINTMENT_MINUTES, MAX_APPOINTMENT_MINUTES
+)
+from app.utils.recurrence import Occurrence, occurrences_between, to_naive_utc
+from app.utils.appointment_stats import invalidate_appointment_stats, clear_appointment_stats
+from app.utils.day_cache import DayCache
+from app.utils.schema import add_missing_column
+
+# Name of the exclusion constraint rejecting overlapping appointments on PostgreSQL
+PG_NO_OVERLAP_CONSTRAINT = 'appointments_no_overlap'
+
+# Key of the PostgreSQL advisory lock serializing the bookings (see lock_schedule)
+PG_SCHEDULE_LOCK_KEY = 7_300_416
+
+# Most time windows probed by one query of find_conflicts_many
+CONFLICT_WINDOWS_PER_QUERY = 200
+
+# Number of appointments read per batch by the conflict audit
+AUDIT_BATCH_SIZE = 1000
+
+# Most appointments a bulk reschedule or cancellation can change at once
+MAX_BULK_APPOINTMENTS = 500
+
+# Opening hours used by the slot finder when none are given
+OPENING_TIME = time_of_day(9, 0)
+CLOSING_TIME = time_of_day(17, 0)
+
+# Longest period the slot finder searches in one request, in days
+MAX_SLOT_SEARCH_DAYS = 31
+
+# Busy times of a day are cached for this many seconds, and for at most this many days. The cache
+# is process-local: under gunicorn each worker has its own. Changes made through this process
+# invalidate the day at once; the expiry bounds how long a change made by another process
+# (another gunicorn worker, a script) can go unnoticed.
+SLOT_CACHE_SECONDS = 300
+SLOT_CACHE_MAX_DAYS = 1000
+
+# Cache of the busy times of each day: {date: [(start, end), ...] in start order}
+_busy_cache = DayCache(SLOT_CACHE_SECONDS, SLOT_CACHE_MAX_DAYS)
+
+
+def setup_appointment_durations():
+    """
+    Add the duration_minutes column to an appointments table created before it.
+
+    db.create_all() does not alter existing tables. Without this step, every
+    query of an appointment on such a database fails on the missing column,
+    and so does the exclusion constraint of setup_conflict_constraint, which
+    is built on the duration. The column is added as INTEGER DEFAULT 30 NOT
+    NULL, so the existing appointments get the default length of the
+    application (DEFAULT_APPOINTMENT_MINUTES).
+
+    The function is idempotent and is called at startup after db.create_all(),
+    before setup_conflict_constraint().
+    """
+    add_missing_column(Appointment.__table__.c.duration_minutes)
+    db.session.commit()
+
+
+def setup_conflict_constraint():
+    """
+    Add the exclusion constraint rejecting overlapping appointments on PostgreSQL, if it does not exist yet.
+
+    The practice has a single schedule: two appointments conflict when their
+    [appointment_date, appointment_date + duration_minutes) ranges overlap,
+    whatever the patients. On PostgreSQL this is enforced by an EXCLUDE USING
+    gist constraint on the range of each appointment, backed by a GiST index,
+    so the database itself rejects a double booking in O(log n), even between
+    concurrent requests. The constraint is deferrable, so that a bulk
+    reschedule can move a block of appointments through each other's old
+    times and have the overlaps checked at commit (see reschedule_appointments).
+
+    If existing appointments already overlap, the constraint cannot be added:
+    the error is logged, the application keeps relying on the checks of
+    find_conflicts, and the overlaps can be listed with find_all_conflicts
+    (GET /api/appointments/conflicts) and fixed before the next start.
+
+    On other databases (SQLite for local runs) there is no such constraint and
+    find_conflicts does the check with a range probe of the appointment_date
+    index.
+
+    The function is idempotent and is called at startup after db.create_all().
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return
+
+    if _has_conflict_constraint():
+        return
+
+    try:
+        db.session.execute(text(
+            f"ALTER TABLE appointments ADD CONSTRAINT {PG_NO_OVERLAP_CONSTRAINT} EXCLUDE USING gist "
+            f"(tsrange(appointment_date, appointment_date + duration_minutes * interval '1 minute') WITH &&) "
+            f"DEFERRABLE INITIALLY IMMEDIATE"
+        ))
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.warning(
+            "Could not add the %s constraint (overlapping appointments?): %s", PG_NO_OVERLAP_CONSTRAINT, e
+        )
+
+
+def is_conflict_error(error):
+    """
+    Check whether a database error is a violation of the no-overlap exclusion constraint.
+
+    :param error: An IntegrityError raised by a commit
+    :return: True if the error comes from the appointments_no_overlap constraint
+    """
+    return PG_NO_OVERLAP_CONSTRAINT in str(getattr(error, 'orig', error))
+
+
+def parse_duration(value):
+    """
+    Read the duration of an appointment, in minutes.
+
+    :param value: The submitted value (an integer or a numeric string), or None for the default
+    :return: The duration in minutes
+    :raises ValueError: If the duration is not a whole number between 1 and MAX_APPOINTMENT_MINUTES
+    """
+    if value is None or value == '':
+        return DEFAULT_APPOINTMENT_MINUTES
+
+    try:
+        # bool is an int: reject it rather than booking a 1 minute appointment for 'true'
+        if isinstance(value, bool):
+            raise ValueError
+        minutes = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("duration_minutes must be a whole number of minutes")
+
+    if not 1 <= minutes <= MAX_APPOINTMENT_MINUTES:
+        raise ValueError(f"duration_minutes must be between 1 and {MAX_APPOINTMENT_MINUTES}")
+    return minutes
+
+
+def lock_schedule():
+    """
+    Serialize the bookings on PostgreSQL until the end of the current transaction.
+
+    The no-overlap constraint only covers the appointments table: the
+    occurrences of the recurring series are expanded from their rules, so
+    the database cannot reject an appointment overlapping an occurrence, or
+    a series overlapping an appointment. Two such bookings checked at the
+    same time could both pass their checks and both be committed.
+
+    find_conflicts and find_conflicts_many therefore take a transaction-level
+    advisory lock (pg_advisory_xact_lock) before reading the schedule. A
+    second booking waits there until the first one is committed or rolled
+    back, and then sees it. The practice has a single schedule, so one lock
+    key serializes the bookings of every day; reading the schedule does not
+    take it.
+
+    On SQLite (local runs) this does nothing.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': PG_SCHEDULE_LOCK_KEY})
+
+
+def appointments_between(start, end):
+    """
+    Return the appointments and series occurrences starting between start and end (both included), in date order.
+
+    The dashboards list the upcoming appointments of the practice: the
+    occurrences of the recurring series are expanded for the window (see
+    app.utils.recurrence.occurrences_between) and listed with the one-off
+    appointments. The patient names are joined in with the rows and with the
+    series, so that the template reading entry.patient runs no more queries.
+
+    :param start: The start of the window (a datetime)
+    :param end: The end of the window (a datetime)
+    :return: A list of Appointment and Occurrence objects (an occurrence has no id and a series_id)
+    """
+    appointments = Appointment.query.options(Patient.name_options(Appointment.patient)).filter(
+        Appointment.appointment_date.between(start, end)
+    ).all()
+    occurrences = [
+        occurrence for occurrence in occurrences_between(start, end + timedelta(microseconds=1), with_patient_names=True)
+        if start <= occurrence.appointment_date <= end
+    ]
+    return sorted(appointments + occurrences, key=lambda entry: entry.appointment_date)
+
+
+def find_conflicts(start, duration_minutes, exclude_id=None, exclude_occurrence=None):
+    """
+    Return the appointments and series occurrences overlapping the range [start, start + duration_minutes).
+
+    No appointment is longer than MAX_APPOINTMENT_MINUTES, so an appointment
+    overlapping the range must start after start - MAX_APPOINTMENT_MINUTES
+    and before the end of the range. That is a single range probe of the
+    appointment_date index (O(log n) plus the few appointments of that window)
+    instead of a scan of the table; the exact overlap test is then made on
+    those few rows. The occurrences of the recurring series are expanded for
+    the range only (see app.utils.recurrence.occurrences_between).
+
+    The check is made for a booking: the schedule is locked until the end of
+    the transaction first (see lock_schedule).
+
+    :param start: The start of the range (a datetime)
+    :param duration_minutes: The length of the range, in minutes
+    :param exclude_id: The ID of an appointment to ignore (the one being updated)
+    :param exclude_occurrence: A (series ID, occurrence start) pair to ignore (the occurrence being moved)
+    :return: The list of overlapping appointments (Appointment) and occurrences (Occurrence), in start order
+    """
+    end = start + timedelta(minutes=duration_minutes)
+    lock_schedule()
+
+    query = Appointment.query.filter(
+        Appointment.appointment_date > start - timedelta(minutes=MAX_APPOINTMENT_MINUTES),
+        Appointment.appointment_date < end
+    )
+    if exclude_id is not None:
+        query = query.filter(Appointment.id != exclude_id)
+
+    candidates = query.order_by(Appointment.appointment_date.asc(), Appointment.id.asc()).all()
+    conflicts = [appointment for appointment in candidates if appointment.end_date > start]
+
+    for occurrence in occurrences_between(start, end):
+        if (occurrence.series_id, occurrence.occurrence_start) != exclude_occurrence:
+            conflicts.append(occurrence)
+
+    conflicts.sort(key=lambda conflict: conflict.appointment_date)
+    return conflicts
+
+
+def find_conflicts_many(items, exclude_ids=(), exclude_series_id=None):
+    """
+    Return the appointments and occurrences overlapping each of many new or moved items.
+
+    Checking each item with find_conflicts would cost a few queries per item
+    (e.g. per occurrence of a new series, or per rescheduled appointment).
+    Instead, only the appointments that can overlap an item are loaded: those
+    starting in its window (item start - MAX_APPOINTMENT_MINUTES, item end).
+    The windows of all the items are probed by one query (a range probe of
+    the appointment_date index per window, CONFLICT_WINDOWS_PER_QUERY windows
+    at a time), so a 4-weekly series over a year reads the appointments of
+    its 13 windows, not those of the whole year. The occurrences of the other
+    series are expanded over the span of the items (one query on the series
+    bounds), and each item is checked with a binary search over their starts.
+
+    Like find_conflicts, the schedule is locked first (see lock_schedule).
+
+    The items are not checked against each other: the occurrences of a
+    series, or appointments shifted by the same time, keep their relative
+    positions.
+
+    :param items: Objects with appointment_date and end_date attributes (occurrences, or
+        transient appointments at their new time), in start order
+    :param exclude_ids: The IDs of the appointments being moved, which are not conflicts at their old time
+    :param exclude_series_id: The series of the items, whose own occurrences are not conflicts
+    :return: A list of (item, [conflicting appointments and occurrences]) pairs,
+        for the items that have conflicts only
+    """
+    if not items:
+        return []
+
+    lock_schedule()
+    exclude_ids = set(exclude_ids)
+    span_start = items[0].appointment_date
+    span_end = max(item.end_date for item in items)
+
+    # The windows in which an appointment overlapping an item starts, the overlapping ones merged
+    windows = []
+    for item in items:
+        window_start = item.appointment_date - timedelta(minutes=MAX_APPOINTMENT_MINUTES)
+        if windows and window_start <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], item.end_date)
+        else:
+            windows.append([window_start, item.end_date])
+
+    busy = []
+    for offset in range(0, len(windows), CONFLICT_WINDOWS_PER_QUERY):
+        probes = [
+            (Appointment.appointment_date > window_start) & (Appointment.appointment_date < window_end)
+            for window_start, window_end in windows[offset:offset + CONFLICT_WINDOWS_PER_QUERY]
+        ]
+        busy += [
+            appointment for appointment in Appointment.query.filter(or_(*probes))
+            if appointment.id not in exclude_ids
+        ]
+    busy += occurrences_between(span_start, span_end, exclude_series_id=exclude_series_id)
+    busy.sort(key=lambda item: item.appointment_date)
+    starts = [item.appointment_date for item in busy]
+
+    result = []
+    for item in items:
+        # Only the entries starting within MAX_APPOINTMENT_MINUTES before the item and before its end can overlap it
+        low = bisect.bisect_right(starts, item.appointment_date - timedelta(minutes=MAX_APPOINTMENT_MINUTES))
+        high = bisect.bisect_left(starts, item.end_date)
+        conflicts = [entry for entry in busy[low:high] if entry.end_date > item.appointment_date]
+        if conflicts:
+            result.append((item, conflicts))
+    return result
+
+
+def select_bulk_appointments(ids=None, start=None, end=None, patient_id=None):
+    """
+    Select the appointments of a bulk reschedule or cancellation, by ID or by predicate.
+
+    Only the ID, start and duration of the appointments are read. On
+    PostgreSQL the rows are locked (SELECT ... FOR UPDATE) until the end of
+    the transaction, so that the statement changing them applies to what was
+    checked. The schedule lock is taken before the rows (see lock_schedule),
+    in the same order as a single booking takes them, so that the two cannot
+    deadlock.
+
+    :param ids: The IDs of the appointments, or None to select them by predicate
+    :param start: Select the appointments starting at or after this datetime (predicate)
+    :param end: Select the appointments starting before this datetime (predicate)
+    :param patient_id: Select the appointments of this patient only (predicate), or None
+    :return: The list of rows (id, appointment_date, duration_minutes), in start order
+    :raises ValueError: If more than MAX_BULK_APPOINTMENTS appointments are selected
+    """
+    lock_schedule()
+    table = Appointment.__table__
+    query = db.select(table.c.id, table.c.appointment_date, table.c.duration_minutes)
+    if ids is not None:
+        query = query.where(table.c.id.in_(ids))
+    else:
+        query = query.where(table.c.appointment_date >= start, table.c.appointment_date < end)
+        if patient_id is not None:
+            query = query.where(table.c.patient_id == patient_id)
+
+    rows = db.session.execute(
+        query.order_by(table.c.appointment_date.asc(), table.c.id.asc())
+        .limit(MAX_BULK_APPOINTMENTS + 1)
+        .with_for_update()
+    ).all()
+    if len(rows) > MAX_BULK_APPOINTMENTS:
+        raise ValueError(f"At most {MAX_BULK_APPOINTMENTS} appointments can be changed at once")
+    return rows
+
+
+def reschedule_appointments(rows, shift):
+    """
+    Move the selected appointments by the same time, in one set-based UPDATE, or not at all.
+
+    The appointments at their new times are first checked against the other
+    appointments and the series occurrences with find_conflicts_many (two
+    range queries whatever the number of appointments). If any of them would
+    overlap, nothing is changed. Otherwise they are moved in one statement
+    and committed:
+
+    - on PostgreSQL, UPDATE ... SET appointment_date = appointment_date + shift
+      WHERE id IN (...), with the no-overlap constraint deferred to the commit;
+    - elsewhere, one UPDATE by primary key sent as a single executemany batch
+      with the new times computed above.
+
+    updated_at is set explicitly, so that the ETags of the appointments change.
+
+    :param rows: The appointments returned by select_bulk_appointments
+    :param shift: The time to move the appointments by (a timedelta, negative to move them earlier)
+    :return: A list of (moved appointment, conflicts) pairs; empty when the appointments were moved
+    """
+    if not rows:
+        return []
+
+    # The appointments at their new times (transient, never added to the session)
+    moved = [
+        Appointment(id=row.id, appointment_date=row.appointment_date + shift, duration_minutes=row.duration_minutes)
+        for row in rows
+    ]
+    conflicts = find_conflicts_many(moved, exclude_ids=[row.id for row in rows])
+    if conflicts:
+        db.session.rollback()
+        return conflicts
+
+    table = Appointment.__table__
+    now = datetime.utcnow()
+    if db.session.get_bind().dialect.name == 'postgresql':
+        if _has_conflict_constraint():
+            # Shifting a block of adjacent appointments overlaps them with each other's old times until the end
+            db.session.execute(text(f"SET CONSTRAINTS {PG_NO_OVERLAP_CONSTRAINT} DEFERRED"))
+        db.session.execute(
+            update(table)
+            .where(table.c.id.in_([row.id for row in rows]))
+            .values(appointment_date=table.c.appointment_date + shift, updated_at=now)
+        )
+    else:
+        db.session.execute(
+            update(table).where(table.c.id == bindparam('b_id')).values(appointment_date=bindparam('b_date'), updated_at=now),
+            [{'b_id': appointment.id, 'b_date': appointment.appointment_date} for appointment in moved]
+        )
+    db.session.commit()
+
+    # Core statements bypass the session events: drop the cached busy times of the old and new days
+    invalidate_free_slots(*_bulk_days(rows, shift))
+    return []
+
+
+def cancel_appointments(rows):
+    """
+    Delete the selected appointments in one set-based DELETE and commit.
+
+    :param rows: The appointments returned by select_bulk_appointments
+    """
+    if not rows:
+        return
+
+    table = Appointment.__table__
+    db.session.execute(delete(table).where(table.c.id.in_([row.id for row in rows])))
+    db.session.commit()
+
+    # Core statements bypass the session events: drop the cached busy times of the days
+    invalidate_free_slots(*_bulk_days(rows))
+
+
+def _bulk_days(rows, shift=None):
+    """
+    Return the days covered by the selected appointments, before and after a shift.
+    """
+    days = set()
+    for row in rows:
+        days.update(_appointment_days(row.appointment_date, row.duration_minutes))
+        if shift is not None:
+            days.update(_appointment_days(row.appointment_date + shift, row.duration_minutes))
+    return days
+
+
+def _has_conflict_constraint():
+    """
+    Check whether the no-overlap exclusion constraint exists (PostgreSQL).
+    """
+    return bool(db.session.execute(
+        text("SELECT 1 FROM pg_constraint WHERE conname = :name"), {'name': PG_NO_OVERLAP_CONSTRAINT}
+    ).scalar())
+
+
+def conflict_summary(conflicts):
+    """
+    Describe conflicting appointments and occurrences for an error response.
+
+    :param conflicts: Appointment and Occurrence objects
+    :return: A list of dictionaries with the keys 'id' (appointments) or
+        'series_id' and 'occurrence_start' (occurrences), 'appointment_date'
+        and 'duration_minutes'
+    """
+    summary = []
+    for conflict in conflicts:
+        if isinstance(conflict, Occurrence):
+            entry = {'series_id': conflict.series_id, 'occurrence_start': conflict.occurrence_start.isoformat()}
+        else:
+            entry = {'id': conflict.id}
+        entry['appointment_date'] = conflict.appointment_date.isoformat()
+        entry['duration_minutes'] = conflict.duration_minutes
+        summary.append(entry)
+    return summary
+
+
+def find_all_conflicts(start=None, end=None):
+    """
+    List the pairs of overlapping appointments, for auditing the existing data.
+
+    Only the appointments table is audited: the occurrences of recurring
+    series are checked against everything when they are created or moved.
+
+    The appointments are streamed in start order (the appointment_date index)
+    and swept once: the appointments still running at the start of each one
+    are kept in a small list, and every appointment of that list overlaps the
+    new one. The work is linear in the number of appointments plus the number
+    of conflicts, and only the running appointments are held in memory.
+
+    :param start: Only audit the appointments ending after this datetime, or None
+    :param end: Only audit the appointments starting before this datetime, or None
+    :return: A list of dictionaries with the keys 'appointment_ids' (the two
+        IDs, earliest start first), 'overlap_start' and 'overlap_end' (ISO strings)
+    """
+    table = Appointment.__table__
+    query = db.select(table.c.id, table.c.appointment_date, table.c.duration_minutes)
+    if start is not None:
+        # Appointments starting up to MAX_APPOINTMENT_MINUTES earlier can still be running at start
+        query = query.where(table.c.appointment_date > start - timedelta(minutes=MAX_APPOINTMENT_MINUTES))
+    if end is not None:
+        query = query.where(table.c.appointment_date < end)
+    query = query.order_by(table.c.appointment_date.asc(), table.c.id.asc())
+
+    conflicts = []
+    running = []
+    for row in db.session.execute(query.execution_options(yield_per=AUDIT_BATCH_SIZE)):
+        row_end = row.appointment_date + timedelta(minutes=row.duration_minutes)
+        running = [(other_id, other_end) for other_id, other_end in running if other_end > row.appointment_date]
+        for other_id, other_end in running:
+            overlap_end = min(other_end, row_end)
+            if start is not None and overlap_end <= start:
+                continue
+            conflicts.append({
+                'appointment_ids': [other_id, row.id],
+                'overlap_start': row.appointment_date.isoformat(),
+                'overlap_end': overlap_end.isoformat(),
+            })
+        running.append((row.id, row_end))
+
+    return conflicts
+
+
+def parse_datetime(value, name):
+    """
+    Read an ISO datetime argument ('2021-01-01T09:30:00').
+
+    A value with an offset ('2021-01-01T09:30:00Z', '...+02:00') is converted
+    to naive UTC, the way datetimes are stored (see
+    app.utils.recurrence.to_naive_utc).
+
+    :param value: The submitted value, or None
+    :param name: The name of the argument, for the error message
+    :return: A naive UTC datetime, or None if no value was given
+    :raises ValueError: If the value is not an ISO datetime
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return to_naive_utc(value)
+    try:
+        return to_naive_utc(datetime.fromisoformat(value))
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an ISO datetime (e.g. '2021-01-01T09:30:00')")
+
+
+def parse_time_of_day(value, name, default):
+    """
+    Read a time of day argument ('09:00').
+
+    :param value: The submitted value, or None
+    :param name: The name of the argument, for the error message
+    :param default: The time returned when no value was given
+    :return: A time
+    :raises ValueError: If the value is not an ISO time
+    """
+    if value is None or value == '':
+        return default
+    try:
+        return time_of_day.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a time of day (e.g. '09:00')")
+
+
+def find_free_slots(first_day, last_day, opens=OPENING_TIME, closes=CLOSING_TIME, slot_minutes=DEFAULT_APPOINTMENT_MINUTES):
+    """
+    Return the free slots of each day of a period.
+
+    The busy times of every day of the period are taken from the cache, and
+    the days missing from it are loaded with a single query over the
+    appointment_date index (see _load_busy_times). Each day is then swept
+    once: starting at the opening time, slots of slot_minutes are laid out
+    until the next appointment, the sweep jumps to the end of that
+    appointment, and so on until the closing time. There is no query per
+    slot or per day, and the cost of a cached day does not depend on the
+    number of appointments in the table.
+
+    :param first_day: The first day of the period (a date)
+    :param last_day: The last day of the period, included (a date)
+    :param opens: The opening time of each day
+    :param closes: The closing time of each day
+    :param slot_minutes: The length of the slots, in minutes
+    :return: A list with one dictionary per day, with the keys 'date' (an ISO
+        date) and 'slots' (a list of {'start': ..., 'end': ...} ISO datetimes)
+    """
+    days = [first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+    busy_times = _cached_busy_times(days)
+    slot = timedelta(minutes=slot_minutes)
+
+    result = []
+    for day in days:
+        closes_at = datetime.combine(day, closes)
+        cursor = datetime.combine(day, opens)
+        slots = []
+        for busy_start, busy_end in busy_times[day]:
+            if busy_end <= cursor:
+                continue
+            if busy_start >= closes_at:
+                break
+            # Lay out the slots that fit before this appointment
+            while cursor + slot <= min(busy_start, closes_at):
+                slots.append({'start': cursor.isoformat(), 'end': (cursor + slot).isoformat()})
+                cursor += slot
+            cursor = max(cursor, busy_end)
+        # Lay out the slots between the last appointment and the closing time
+        while cursor + slot <= closes_at:
+            slots.append({'start': cursor.isoformat(), 'end': (cursor + slot).isoformat()})
+            cursor += slot
+        result.append({'date': day.isoformat(), 'slots': slots})
+
+    return result
+
+
+def invalidate_free_slots(*days):
+    """
+    Drop the cached busy times, and the cached heatmap counts, of the given days.
+
+    Changes made through the ORM are picked up automatically (see
+    _track_appointment_changes); code changing appointments with Core or
+    bulk statements must call this with the days it touched.
+
+    :param days: The dates (or datetimes) whose busy times changed
+    """
+    _busy_cache.invalidate(*days)
+    invalidate_appointment_stats(*days)
+
+
+def _cached_busy_times(days):
+    """
+    Return the busy times of the given days, loading the days missing from the cache in one query.
+
+    A day invalidated while it is being loaded is returned but not cached:
+    the load may have read it before the change was committed.
+
+    :return: A dictionary {date: [(start, end), ...] in start order}
+    """
+    busy_times, generation = _busy_cache.get_many(days)
+
+    missing = [day for day in days if day not in busy_times]
+    if missing:
+        loaded = _load_busy_times(missing)
+        _busy_cache.store(loaded, generation)
+        busy_times.update(loaded)
+
+    return busy_times
+
+
+def _load_busy_times(days):
+    """
+    Load the busy times of the given days from the appointments table and the recurring series.
+
+    The appointments are read with one query. An appointment started late the
+    day before can still be running after midnight, so the range starts
+    MAX_APPOINTMENT_MINUTES before the first day. The occurrences of the
+    series are expanded for the same range. Every appointment and occurrence
+    is clipped to each day it covers.
+
+    :param days: The dates to load, in increasing order
+    :return: A dictionary {date: [(start, end), ...] in start order}
+    """
+    table = Appointment.__table__
+    wanted = set(days)
+    busy_times = {day: [] for day in days}
+
+    range_start = datetime.combine(days[0], time_of_day.min) - timedelta(minutes=MAX_APPOINTMENT_MINUTES)
+    range_end = datetime.combine(days[-1] + timedelta(days=1), time_of_day.min)
+    rows = db.session.execute(
+        db.select(table.c.appointment_date, table.c.duration_minutes)
+        .where(table.c.appointment_date > range_start, table.c.appointment_date < range_end)
+        .order_by(table.c.appointment_date.asc())
+    )
+
+    intervals = [(row.appointment_date, row.duration_minutes) for row in rows]
+    intervals += [
+        (occurrence.appointment_date, occurrence.duration_minutes)
+        for occurrence in occurrences_between(range_start, range_end)
+    ]
+
+    for start, duration_minutes in intervals:
+        end = start + timedelta(minutes=duration_minutes)
+        day = start.date()
+        while datetime.combine(day, time_of_day.min) < end:
+            if day in wanted:
+                day_start = datetime.combine(day, time_of_day.min)
+                busy_times[day].append((max(start, day_start), min(end, day_start + timedelta(days=1))))
+            day += timedelta(days=1)
+
+    # Clipping can move a previous day's appointment to the front of a day: keep every day in start order
+    for intervals in busy_times.values():
+        intervals.sort()
+    return busy_times
+
+
+def _appointment_days(start, duration_minutes):
+    """
+    Return the days covered by an appointment.
+    """
+    end = start + timedelta(minutes=duration_minutes or DEFAULT_APPOINTMENT_MINUTES)
+    days = [start.date()]
+    while datetime.combine(days[-1] + timedelta(days=1), time_of_day.min) < end:
+        days.append(days[-1] + timedelta(days=1))
+    return days
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_appointment_changes(session, flush_context):
+    """
+    Remember the days of the appointments created, changed or deleted by a flush.
+
+    Both the old and the new times of a moved appointment are recorded. The
+    days are only invalidated once the transaction commits, so that another
+    request cannot cache the old busy times again in between.
+    """
+    days = session.info.setdefault('changed_appointment_days', set())
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        # A series covers many days: any change to a series or its exceptions drops the whole cache
+        if isinstance(instance, (AppointmentSeries, AppointmentSeriesException)):
+            session.info['changed_appointment_series'] = True
+            continue
+        if not isinstance(instance, Appointment):
+            continue
+        if isinstance(instance.appointment_date, datetime):
+            days.update(_appointment_days(instance.appointment_date, instance.duration_minutes))
+        # The time before the change, for updates
+        state = db.inspect(instance)
+        old_dates = state.attrs.appointment_date.history.deleted
+        old_durations = state.attrs.duration_minutes.history.deleted
+        for old_date in old_dates:
+            if isinstance(old_date, datetime):
+                days.update(_appointment_days(old_date, old_durations[0] if old_durations else instance.duration_minutes))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_changed_days(session):
+    """
+    Drop the cached busy times and heatmap counts of the days changed by the committed transaction.
+    """
+    if session.info.pop('changed_appointment_series', False):
+        _busy_cache.clear()
+        clear_appointment_stats()
+    days = session.info.pop('changed_appointment_days', None)
+    if days:
+        invalidate_free_slots(*days)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_changed_days(session):
+    """
+    Forget the days changed by a rolled back transaction: nothing was written.
+    """
+    session.info.pop('changed_appointment_days', None)
+    session.info.pop('changed_appointment_series', None)
@@ -0,0 +1,57 @@
+# app/utils/schema.py
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+from app import db
+
+
+def add_missing_column(column):
+    """
+    Add a model column to its existing table, if the table does not have it yet.
+
+    db.create_all() creates the missing tables but never alters the existing
+    ones, so a column added to a model of an existing table must be added by
+    the setup function of its feature at startup (e.g.
+    app.jobs.blind_index_backfill.setup_blind_indexes). The column is added
+    with the definition db.create_all() would give it (type, server default,
+    NOT NULL); a NOT NULL column therefore needs a server default.
+
+    On PostgreSQL the statement is ALTER TABLE ... ADD COLUMN IF NOT EXISTS,
+    so that gunicorn workers starting together do not fail on each other's
+    change. Adding a column with a constant default only changes the catalog
+    there (PostgreSQL 11 and later): it does not rewrite the table.
+
+    The change is not committed: the caller commits it with its other changes.
+
+    :param column: The Column of the model (e.g. Patient.__table__.c.email_index)
+    :return: True if the column was added, False if it was already there
+    """
+    # Inspect through the session: a separate connection would wait for the ALTER TABLE of the
+    # previous column, which holds its lock until the caller commits
+    existing = {info['name'] for info in inspect(db.session.connection()).get_columns(column.table.name)}
+    if column.name in existing:
+        return False
+
+    dialect = db.engine.dialect
+    definition = str(CreateColumn(column).compile(dialect=dialect))
+    if_not_exists = 'IF NOT EXISTS ' if dialect.name == 'postgresql' else ''
+    db.session.execute(text(f"ALTER TABLE {column.table.name} ADD COLUMN {if_not_exists}{definition}"))
+    return True
+
+
+def create_missing_indexes(column):
+    """
+    Create the indexes of the model that cover a column, if they do not exist yet.
+
+    Like columns, the indexes of a model are only created by db.create_all()
+    together with their table. Each index is created with its own statement
+    (CREATE INDEX, or CREATE UNIQUE INDEX for a unique one) and committed at
+    once.
+
+    :param column: The Column of the model whose indexes are created
+    :raises SQLAlchemyError: If an index cannot be created, e.g. a unique
+        index on a column that already has duplicate values
+    """
+    for index in column.table.indexes:
+        if column.name in index.columns.keys():
+            index.create(db.engine, checkfirst=True)
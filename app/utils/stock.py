@@ -0,0 +1,151 @@
+# app/utils/stock.py
+
+from datetime import datetime
+from sqlalchemy import update, insert
+from app import db
+from app.models import InventoryItem, InventoryMovement
+
+# Most adjustments accepted in one batch
+MAX_STOCK_ADJUSTMENTS = 100
+
+# Longest reason of a movement, in characters (the size of the column)
+MAX_REASON_LENGTH = 200
+
+
+def parse_adjustments(entries, item_id=None):
+    """
+    Read and check a list of stock adjustments.
+
+    :param entries: A list of dictionaries with the keys 'delta' (a non-zero
+        integer, negative for stock taken out), 'reason' (optional) and
+        'item_id' (unless item_id is given)
+    :param item_id: The item all the adjustments apply to, or None to read it from each entry
+    :return: A list of dictionaries with the keys 'item_id', 'delta' and 'reason'
+    :raises ValueError: With a readable message (naming the entry) if an adjustment is invalid
+    """
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("adjustments must be a non-empty list")
+    if len(entries) > MAX_STOCK_ADJUSTMENTS:
+        raise ValueError(f"At most {MAX_STOCK_ADJUSTMENTS} adjustments are accepted at once")
+
+    adjustments = []
+    for position, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            raise ValueError(f"Adjustment {position}: must be an object")
+
+        target = item_id if item_id is not None else entry.get('item_id')
+        if isinstance(target, bool) or not isinstance(target, int):
+            raise ValueError(f"Adjustment {position}: item_id must be an integer")
+
+        delta = entry.get('delta')
+        if isinstance(delta, bool) or not isinstance(delta, int) or delta == 0:
+            raise ValueError(f"Adjustment {position}: delta must be a non-zero integer")
+
+        reason = entry.get('reason')
+        if reason is not None and (not isinstance(reason, str) or len(reason) > MAX_REASON_LENGTH):
+            raise ValueError(f"Adjustment {position}: reason must be a string of at most {MAX_REASON_LENGTH} characters")
+
+        adjustments.append({'item_id': target, 'delta': delta, 'reason': reason or None})
+    return adjustments
+
+
+def adjust_stock(adjustments, user_id=None):
+    """
+    Apply stock adjustments atomically and record them in the inventory ledger.
+
+    Instead of reading the quantity, changing it in Python and writing it
+    back (which loses one of two concurrent changes), each item is changed
+    with a single UPDATE ... SET quantity = quantity + :delta, which the
+    database applies to the current value under the row lock, and which
+    returns the new quantity. The adjustments of a batch are summed per item
+    and the items are updated in ID order, so two concurrent batches lock
+    their rows in the same order and cannot deadlock. A quantity never goes
+    below zero: the UPDATE only matches the row if enough stock is left.
+
+    Each adjustment is then recorded as one movement of the ledger, with the
+    quantity it left. The movements are inserted with one multi-row INSERT
+    returning their IDs in order on PostgreSQL; SQLite cannot guarantee the
+    order of the IDs of a multi-row INSERT, so SQLAlchemy inserts them one
+    at a time there.
+
+    The adjustments are all or nothing, but this function does not commit:
+    the caller commits when there are no errors (possibly with other
+    changes, e.g. the other fields of an item), and rolls back otherwise.
+
+    :param adjustments: A list of dictionaries with the keys 'item_id', 'delta' and 'reason' (see parse_adjustments)
+    :param user_id: The ID of the user making the adjustments, or None
+    :return: A tuple (results, errors). results has one dictionary per
+        adjustment, in order, with the keys 'item_id', 'delta',
+        'quantity_after' and 'movement_id'; errors has one dictionary per
+        item that could not be adjusted, with the keys 'item_id' and 'error'
+        ('not_found' or 'insufficient_stock', with the 'quantity' left). When
+        there are errors, results is empty and the caller must roll back.
+    """
+    table = InventoryItem.__table__
+    now = datetime.utcnow()
+
+    totals = {}
+    for adjustment in adjustments:
+        totals[adjustment['item_id']] = totals.get(adjustment['item_id'], 0) + adjustment['delta']
+
+    final_quantities = {}
+    errors = []
+    for item_id in sorted(totals):
+        total = totals[item_id]
+        row = db.session.execute(
+            update(table)
+            .where(table.c.id == item_id, table.c.quantity + total >= 0)
+            .values(quantity=table.c.quantity + total, updated_at=now)
+            .returning(table.c.quantity)
+        ).first()
+        if row is not None:
+            final_quantities[item_id] = row.quantity
+            continue
+
+        # No row matched: the item does not exist, or there is not enough stock left
+        quantity = db.session.execute(db.select(table.c.quantity).where(table.c.id == item_id)).scalar()
+        if quantity is None:
+            errors.append({'item_id': item_id, 'error': 'not_found'})
+        else:
+            errors.append({'item_id': item_id, 'error': 'insufficient_stock', 'quantity': quantity})
+
+    if errors:
+        return [], errors
+
+    # Replay the adjustments of each item from its quantity before the batch
+    quantities = {item_id: final_quantities[item_id] - totals[item_id] for item_id in totals}
+    rows = []
+    for adjustment in adjustments:
+        quantities[adjustment['item_id']] += adjustment['delta']
+        rows.append({
+            'item_id': adjustment['item_id'],
+            'delta': adjustment['delta'],
+            'quantity_after': quantities[adjustment['item_id']],
+            'reason': adjustment['reason'],
+            'user_id': user_id,
+            'created_at': now,
+        })
+
+    movement_ids = db.session.execute(
+        insert(InventoryMovement.__table__).returning(InventoryMovement.__table__.c.id, sort_by_parameter_order=True),
+        rows
+    ).scalars().all()
+
+    results = [
+        {'item_id': row['item_id'], 'delta': row['delta'], 'quantity_after': row['quantity_after'], 'movement_id': movement_id}
+        for row, movement_id in zip(rows, movement_ids)
+    ]
+    return results, []
+
+
+def record_initial_stock(item, user_id=None):
+    """
+    Record the quantity of a new inventory item as its first ledger movement.
+
+    The item must have been flushed (so that it has an ID). Nothing is
+    recorded for an item created without stock.
+    """
+    if item.quantity:
+        db.session.add(InventoryMovement(
+            item_id=item.id, delta=item.quantity, quantity_after=item.quantity, reason='Initial stock', user_id=user_id
+        ))
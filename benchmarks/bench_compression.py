@@ -0,0 +1,98 @@
+# benchmarks/bench_compression.py
+"""
+Measure the storage and latency savings of compress-then-encrypt.
+
+A synthetic corpus of free-text medical histories (from a few lines to long
+pasted notes) is encrypted three ways:
+
+- legacy: a bare Fernet token, as stored before the versioned envelope;
+- envelope: the AES-GCM envelope without compression;
+- compressed: the AES-GCM envelope with zlib compression above the threshold.
+
+For each, the total stored size and the time to decrypt the whole corpus are
+printed.
+
+Usage: python benchmarks/bench_compression.py [number_of_histories]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.fernet import Fernet
+
+os.environ.setdefault('ENCRYPTION_KEY', Fernet.generate_key().decode())
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from app.utils import encryption
+from app.utils.encryption import encrypt_data, decrypt_data
+
+# Building blocks of the synthetic clinical notes
+SENTENCES = [
+    'Patient reports sensitivity to cold on the lower left first molar.',
+    'Bleeding on probing noted in the upper anterior region.',
+    'History of hypertension, currently treated with amlodipine 5 mg daily.',
+    'Allergic to penicillin; use clindamycin for antibiotic prophylaxis.',
+    'Periapical radiograph shows a radiolucency at the apex of tooth 36.',
+    'Scaling and root planing performed in quadrants 3 and 4 under local anaesthesia.',
+    'Patient advised to use an interdental brush and fluoride toothpaste twice daily.',
+    'Composite restoration placed on tooth 24, occlusion checked and adjusted.',
+    'Smoker, about ten cigarettes per day; smoking cessation discussed.',
+    'Follow-up in six weeks to reassess periodontal pocket depths.',
+]
+
+
+def _history(rng):
+    """
+    Return one synthetic medical history, between a few lines and about 20 KB.
+    """
+    entries = []
+    for _ in range(rng.choice([3, 10, 40, 150, 400])):
+        # Dated entries with varying tooth numbers and measurements, so the
+        # corpus is not unrealistically repetitive
+        entry = rng.choice(SENTENCES).replace('36', str(rng.randint(11, 48))).replace('six', str(rng.randint(2, 12)))
+        entries.append(f"{rng.randint(2015, 2025)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}: {entry} "
+                       f"Pocket depth {rng.randint(1, 9)} mm, BP {rng.randint(100, 160)}/{rng.randint(60, 100)}.")
+    return '\n'.join(entries)
+
+
+def _measure(ciphertexts, decrypt):
+    """
+    Return the total size of the ciphertexts and the time to decrypt them all.
+    """
+    start = time.perf_counter()
+    for value in ciphertexts:
+        decrypt(value)
+    return sum(len(value) for value in ciphertexts), time.perf_counter() - start
+
+
+def main():
+    number_of_histories = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rng = random.Random(42)
+    corpus = [_history(rng) for _ in range(number_of_histories)]
+    plaintext_bytes = sum(len(history.encode('utf-8')) for history in corpus)
+
+    legacy = [encryption.cipher_suite.encrypt(history.encode('utf-8')) for history in corpus]
+
+    threshold = encryption.COMPRESS_THRESHOLD
+    try:
+        encryption.COMPRESS_THRESHOLD = 0
+        envelope = [encrypt_data(history) for history in corpus]
+    finally:
+        encryption.COMPRESS_THRESHOLD = threshold
+    compressed = [encrypt_data(history) for history in corpus]
+
+    print(f"Histories:         {number_of_histories}")
+    print(f"Plaintext:         {plaintext_bytes / 1024:10.1f} KB")
+    print(f"Threshold:         {threshold} bytes")
+    print()
+    print(f"{'':18s} {'stored KB':>10s} {'vs plain':>9s} {'decrypt ms':>11s}")
+    for name, ciphertexts in (('legacy Fernet', legacy), ('envelope', envelope), ('compressed', compressed)):
+        stored, seconds = _measure(ciphertexts, decrypt_data)
+        print(f"{name:18s} {stored / 1024:10.1f} {stored / plaintext_bytes:8.2f}x {seconds * 1e3:11.1f}")
+
+
+if __name__ == '__main__':
+    main()
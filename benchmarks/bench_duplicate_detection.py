@@ -0,0 +1,147 @@
+# benchmarks/bench_duplicate_detection.py
+"""
+Measure how the duplicate-patient detection job scales with the number of patients.
+
+For each size, the script fills an in-memory SQLite database with synthetic
+patients (names built from random syllables, dates of birth over 70 years,
+encrypted emails and contact numbers with their blind indexes), plants
+duplicates with typical reception mistakes (misspelt name, swapped names,
+mistyped date of birth, new email), runs find_duplicate_patients and
+reports:
+
+- the run time and the time per patient, which should stay roughly constant
+  as the table grows (near-linear scaling);
+- the number of candidate pairs and of decrypted patients, against the
+  n(n-1)/2 pairs of a naive comparison;
+- the share of planted duplicates found (recall).
+
+Usage: python benchmarks/bench_duplicate_detection.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.fernet import Fernet
+
+os.environ.setdefault('ENCRYPTION_KEY', Fernet.generate_key().decode())
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from app import app, db
+from app.models import Patient
+from app.utils.encryption import encrypt_many, email_blind_index, phone_blind_index
+from app.jobs.duplicate_patients import find_duplicate_patients
+
+SYLLABLES = ['ba', 'ka', 'li', 'mo', 'ra', 'sa', 'ti', 'no', 'el', 'an', 'ou', 'da', 'fi', 'ge', 'ha', 'ja', 'ne', 'pe', 'vi', 'zo']
+
+# Share of the patients that get a planted duplicate
+DUPLICATE_RATE = 0.01
+
+# Rows inserted per statement while filling the table
+INSERT_BATCH = 10000
+
+
+def _name(rng):
+    """
+    Return a random name of two to four syllables.
+    """
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+
+def _typo(rng, name):
+    """
+    Swap two adjacent letters of a name.
+    """
+    if len(name) < 3:
+        return name + 'e'
+    i = rng.randrange(1, len(name) - 1)
+    return (name[:i] + name[i + 1] + name[i] + name[i + 2:]).capitalize()
+
+
+def _fill(size, rng):
+    """
+    Recreate the patients table with size patients, a DUPLICATE_RATE share of which are duplicates.
+
+    :return: The set of planted (original id, duplicate id) pairs
+    """
+    db.drop_all()
+    db.create_all()
+
+    originals = int(size / (1 + DUPLICATE_RATE))
+    people = []
+    for i in range(originals):
+        people.append({
+            'first_name': _name(rng),
+            'last_name': _name(rng),
+            'date_of_birth': date(1940, 1, 1) + timedelta(days=rng.randrange(70 * 365)),
+            'email': f'person{i}@example.com',
+            'contact_number': f'+212 6{rng.randrange(10 ** 8):08d}',
+        })
+
+    planted = set()
+    for original in rng.sample(range(originals), size - originals):
+        person = dict(people[original])
+        mistake = rng.choice(['first_name', 'last_name', 'swap', 'date_of_birth', 'email'])
+        if mistake in ('first_name', 'last_name'):
+            person[mistake] = _typo(rng, person[mistake])
+        elif mistake == 'swap':
+            person['first_name'], person['last_name'] = person['last_name'], person['first_name']
+        elif mistake == 'date_of_birth':
+            day = person['date_of_birth']
+            person['date_of_birth'] = day.replace(day=day.day % 28 + 1)
+        # Duplicates are registered with a new email address: the unique email index would reject the old one
+        person['email'] = f'dup{len(planted)}.' + people[original]['email']
+        people.append(person)
+        planted.add((original + 1, len(people)))
+
+    table = Patient.__table__
+    for start in range(0, len(people), INSERT_BATCH):
+        batch = people[start:start + INSERT_BATCH]
+        encrypted = encrypt_many(value for person in batch for value in (person['email'], person['contact_number']))
+        rows = []
+        for position, person in enumerate(batch):
+            rows.append({
+                'first_name': person['first_name'],
+                'last_name': person['last_name'],
+                'date_of_birth': person['date_of_birth'],
+                'email': encrypted[position * 2],
+                'contact_number': encrypted[position * 2 + 1],
+                'medical_history': None,
+                'email_index': email_blind_index(person['email']),
+                'contact_number_index': phone_blind_index(person['contact_number']),
+            })
+        db.session.execute(table.insert(), rows)
+    db.session.commit()
+
+    return planted
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Duplicate-patient detection scaling')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='Numbers of patients')
+    args = parser.parse_args()
+
+    print(f"{'patients':>9s} {'seconds':>8s} {'us/patient':>10s} {'pairs':>8s} {'naive pairs':>14s} "
+          f"{'decrypted':>9s} {'found':>6s} {'recall':>6s}")
+
+    with app.app_context():
+        for size in args.sizes:
+            planted = _fill(size, random.Random(size))
+
+            start = time.perf_counter()
+            report = find_duplicate_patients()
+            elapsed = time.perf_counter() - start
+
+            found = {tuple(duplicate['patient_ids']) for duplicate in report['duplicates']}
+            recall = len(planted & found) / len(planted) if planted else 1.0
+
+            print(f"{size:9d} {elapsed:8.2f} {elapsed / size * 1e6:10.1f} {report['candidate_pairs']:8d} "
+                  f"{size * (size - 1) // 2:14d} {report['decrypted_patients']:9d} {len(found):6d} {recall:6.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+# benchmarks/bench_heatmap.py
+"""
+Compare the ways of computing the hourly booking heatmap of a period.
+
+The script fills an in-memory SQLite database with synthetic appointments
+(a given number per working day over several years, at random opening
+hours) and times, for a heatmap of the last year:
+
+- loading every Appointment object and counting in Python (the naive way);
+- the GROUP BY on the day and the hour in SQL;
+- numpy.bincount over the start times read as integers (if NumPy is installed);
+- appointment_heatmap with a cold cache and then with a warm cache, where
+  only today and the days ahead are counted again.
+
+Usage: python benchmarks/bench_heatmap.py [--years 3] [--per-day 40]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.fernet import Fernet
+
+os.environ.setdefault('ENCRYPTION_KEY', Fernet.generate_key().decode())
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from app import app, db
+from app.models import Patient, Appointment
+from app.utils import appointment_stats
+from app.utils.appointment_stats import appointment_heatmap, clear_appointment_stats
+
+# Rows inserted per statement while filling the table
+INSERT_BATCH = 10000
+
+
+def _fill(years, per_day, rng):
+    """
+    Recreate the tables with one patient and per_day appointments per working day over years years, ending in 30 days.
+
+    :return: The number of appointments
+    """
+    db.drop_all()
+    db.create_all()
+    db.session.add(Patient(first_name='Bench', last_name='Patient', date_of_birth=date(1980, 1, 1),
+                           contact_number='+212 600000000', email='bench@example.com', medical_history=None))
+    db.session.commit()
+
+    rows = []
+    day = date.today() - timedelta(days=365 * years)
+    last_day = date.today() + timedelta(days=30)
+    while day <= last_day:
+        if day.weekday() < 5:
+            opening = datetime.combine(day, datetime.min.time()) + timedelta(hours=8)
+            for _ in range(per_day):
+                rows.append({
+                    'patient_id': 1,
+                    'appointment_date': opening + timedelta(minutes=rng.randrange(10 * 60)),
+                    'duration_minutes': 30,
+                    'notes': None,
+                })
+        day += timedelta(days=1)
+
+    table = Appointment.__table__
+    for start in range(0, len(rows), INSERT_BATCH):
+        db.session.execute(table.insert(), rows[start:start + INSERT_BATCH])
+    db.session.commit()
+    return len(rows)
+
+
+def _naive(first_day, last_day):
+    """
+    Count the appointments of a period per hour by loading every appointment.
+    """
+    start = datetime.combine(first_day, datetime.min.time())
+    end = datetime.combine(last_day + timedelta(days=1), datetime.min.time())
+    counts = {}
+    for appointment in Appointment.query.filter(Appointment.appointment_date >= start, Appointment.appointment_date < end):
+        key = (appointment.appointment_date.date(), appointment.appointment_date.hour)
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def _timed(function, *args, repeat=3):
+    """
+    Return the best run time of a function over repeat runs, in milliseconds.
+    """
+    best = None
+    for _ in range(repeat):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        function(*args)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Booking heatmap computation')
+    parser.add_argument('--years', type=int, default=3, help='Years of appointments in the table')
+    parser.add_argument('--per-day', type=int, default=40, help='Appointments per working day')
+    args = parser.parse_args()
+
+    with app.app_context():
+        size = _fill(args.years, args.per_day, random.Random(0))
+        first_day = date.today() - timedelta(days=365)
+        last_day = date.today() + timedelta(days=30)
+        print(f"{size} appointments in the table, heatmap of {first_day} to {last_day}")
+
+        start = datetime.combine(first_day, datetime.min.time())
+        number_of_days = (last_day - first_day).days + 1
+
+        print(f"{'method':<28s} {'ms':>9s}")
+        print(f"{'load objects (naive)':<28s} {_timed(_naive, first_day, last_day):9.1f}")
+        print(f"{'SQL GROUP BY':<28s} "
+              f"{_timed(appointment_stats._count_with_group_by, start, start + timedelta(days=number_of_days), number_of_days):9.1f}")
+        if appointment_stats.numpy is not None:
+            print(f"{'numpy.bincount':<28s} "
+                  f"{_timed(appointment_stats._count_with_numpy, start, start + timedelta(days=number_of_days), number_of_days):9.1f}")
+        else:
+            print(f"{'numpy.bincount':<28s} {'skipped (NumPy is not installed)':>9s}")
+
+        def cold():
+            clear_appointment_stats()
+            appointment_heatmap(first_day, last_day)
+
+        print(f"{'appointment_heatmap, cold':<28s} {_timed(cold):9.1f}")
+        appointment_heatmap(first_day, last_day)
+        print(f"{'appointment_heatmap, warm':<28s} {_timed(appointment_heatmap, first_day, last_day):9.1f}")
+
+
+if __name__ == '__main__':
+    main()
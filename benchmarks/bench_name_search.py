@@ -0,0 +1,165 @@
+# benchmarks/bench_name_search.py
+"""
+Measure the latency of the fuzzy patient name search.
+
+The script fills the patients table with synthetic names (the encrypted
+columns hold placeholder bytes: the search only reads the names) and times
+search_patients_by_name for an exact name, a partial name and a misspelt
+name, at increasing table sizes. It also times the former unindexed
+'%name%' ILIKE scan for comparison.
+
+The names are built from syllables (about 1,600 first names and 68,000
+last names), so that, as in a real patient table, a trigram matches a few
+percent of the rows at most and a full name a handful. The searched
+patient is one of the generated ones.
+
+By default it runs against an in-memory SQLite database (FTS5 trigram
+table). Point DATABASE_URL at a PostgreSQL database to measure the pg_trgm
+index of the names table instead; the patients table of that database is
+emptied.
+
+Usage: python benchmarks/bench_name_search.py [--sizes 10000 100000 500000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.fernet import Fernet
+
+os.environ.setdefault('ENCRYPTION_KEY', Fernet.generate_key().decode())
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from app import app, db
+from app.models import Patient
+from app.utils import name_search
+from app.utils.name_search import setup_name_search, search_patients_by_name
+
+# Syllables of the synthetic names: first names have two, last names two or three
+FIRST_SYLLABLES = ['jo', 'ma', 'ah', 'fa', 'you', 'sa', 'pi', 'cla', 'hi', 'an', 'li', 'mo', 'ka', 'ele', 'ri',
+                   'to', 'na', 'de', 'lu', 'zo', 'be', 'ta', 'mi', 'ro', 'el', 'vi', 'ha', 'ni', 'so', 'da',
+                   'ya', 'ke', 'ju', 'ra', 'ti', 'ge', 'la', 'no', 'si', 'ar']
+LAST_SYLLABLES = ['ben', 'ala', 'mar', 'dub', 'tan', 'gar', 'ros', 'nov', 'smi', 'jon', 'oui', 'tin', 'ois',
+                  'aka', 'cia', 'si', 'ak', 'el', 'har', 'ber', 'kov', 'ski', 'son', 'man', 'ler', 'ez',
+                  'ana', 'ini', 'ova', 'ric', 'mad', 'zou', 'lam', 'fer', 'kim', 'ito', 'ng', 'ach', 'ovi',
+                  'ert']
+
+# Rows inserted per statement while filling the table
+INSERT_BATCH = 10000
+
+# The generated patient searched for (its row number, clamped to the size of the table)
+SEARCHED_ROW = 123457
+
+
+def _name(rng):
+    """
+    Return a synthetic (first name, last name) pair.
+    """
+    first = ''.join(rng.choice(FIRST_SYLLABLES) for _ in range(2)).capitalize()
+    last = ''.join(rng.choice(LAST_SYLLABLES) for _ in range(rng.choice((2, 3)))).capitalize()
+    return first, last
+
+
+def _queries(first, last):
+    """
+    Return the (label, query) pairs timed for a patient: the full name, the start of the last name and a typo.
+    """
+    # Swap two letters in the middle of the last name
+    middle = len(last) // 2
+    typo = last[:middle - 1] + last[middle] + last[middle - 1] + last[middle + 1:]
+    return [
+        ('exact', f'{first} {last}'),
+        ('partial', last[:5].lower()),
+        ('typo', f'{first} {typo}'),
+    ]
+
+
+def _fill(size):
+    """
+    Recreate the patients table with size patients with synthetic names.
+
+    :return: The (first name, last name) of the searched patient
+    """
+    # End the transaction of the previous searches, which would block the DROP on PostgreSQL
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    setup_name_search()
+
+    rng = random.Random(42)
+    searched = min(SEARCHED_ROW, size - 1)
+    table = Patient.__table__
+    for start in range(0, size, INSERT_BATCH):
+        rows = []
+        for i in range(start, min(start + INSERT_BATCH, size)):
+            first, last = _name(rng)
+            if i == searched:
+                searched_name = (first, last)
+            rows.append({
+                'first_name': first,
+                'last_name': last,
+                'date_of_birth': date(1980, 1, 1),
+                'contact_number': b'placeholder',
+                'email': f'patient{i}'.encode(),
+                'medical_history': b'',
+                'email_index': f'{i:064x}',
+                'contact_number_index': f'{i:064x}',
+            })
+        db.session.execute(table.insert(), rows)
+    db.session.commit()
+    if db.engine.dialect.name == 'postgresql':
+        # Fresh statistics and a flushed GIN pending list, as autovacuum would leave a live table
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(db.text('VACUUM ANALYZE patients'))
+            connection.execute(db.text(f'VACUUM ANALYZE {name_search.NAMES_TABLE}'))
+    return searched_name
+
+
+def _time(function, repeat):
+    """
+    Run function repeat times and return the best wall clock time in milliseconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e3
+
+
+def _ilike_scan(name):
+    """
+    The search as it used to be: an unindexed '%name%' ILIKE scan of both name columns.
+    """
+    return Patient.query.filter(
+        Patient.first_name.ilike(f'%{name}%') | Patient.last_name.ilike(f'%{name}%')
+    ).all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fuzzy patient name search latency')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 500000], help='Table sizes')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetitions per measurement (the best is kept)')
+    args = parser.parse_args()
+
+    with app.app_context():
+        for size in args.sizes:
+            first, last = _fill(size)
+            print(f"\n{size} patients (backend: {name_search._backend}), searching for {first} {last}", flush=True)
+            for label, query in _queries(first, last):
+                matches = search_patients_by_name(query)
+                best = f'{matches[0].first_name} {matches[0].last_name}' if matches else '-'
+                elapsed = _time(lambda: search_patients_by_name(query), args.repeat)
+                print(f"  {label:8s} {query!r:26s} {elapsed:9.2f} ms  best match: {best}", flush=True)
+            partial = last[:5].lower()
+            elapsed = _time(lambda: _ilike_scan(partial), args.repeat)
+            print(f"  {'ilike':8s} {partial!r:26s} {elapsed:9.2f} ms  (unindexed scan)", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# benchmarks/bench_search_queries.py
+"""
+Count the SQL queries issued by the patient name search.
+
+The search used to run one appointments query and one treatment plans query
+per matching patient (2N+1 queries). This script creates 1, 10 and 100
+patients sharing a surname, each with appointments and treatment plans, runs
+the HTML search (/search_patient) and the API search (/api/patient/search),
+and counts the SELECT statements of each request.
+
+The script exits with status 1 if the number of queries grows with the number
+of matching patients; tests/test_search_queries.py runs the same check under
+pytest.
+
+Usage: python benchmarks/bench_search_queries.py
+"""
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.fernet import Fernet
+
+os.environ.setdefault('ENCRYPTION_KEY', Fernet.generate_key().decode())
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from sqlalchemy import event
+from app import app, db
+from app.models import Patient, Appointment, TreatmentPlan
+from app.utils.name_search import setup_name_search
+
+
+def _seed(matching_patients):
+    """
+    Recreate the tables with matching_patients patients called 'Common'.
+    """
+    db.drop_all()
+    db.create_all()
+    setup_name_search()
+    for i in range(matching_patients):
+        patient = Patient(
+            first_name=f'First{i}',
+            last_name='Common',
+            date_of_birth=date(1980, 1, 1),
+            contact_number=f'+1555{i:07d}',
+            email=f'patient{i}@example.com',
+            medical_history='No known allergies.'
+        )
+        db.session.add(patient)
+        db.session.flush()
+        for j in range(3):
+            db.session.add(Appointment(patient_id=patient.id, appointment_date=datetime(2024, 1, 1) + timedelta(days=j)))
+        db.session.add(TreatmentPlan(patient_id=patient.id, diagnosis='Caries', treatment_details='Filling'))
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def _count_selects(client, method, url, **kwargs):
+    """
+    Run one request and return the number of SELECT statements it issued.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = getattr(client, method)(url, **kwargs)
+        assert response.status_code == 200, response.status_code
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    return len(statements)
+
+
+def main():
+    counts = {}
+    with app.app_context():
+        for matching_patients in (1, 10, 100):
+            _seed(matching_patients)
+
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session['user_id'] = 1
+                session['role'] = 'admin'
+
+            counts[matching_patients] = (
+                _count_selects(client, 'post', '/search_patient', data={'patient_name': 'Common'}),
+                _count_selects(client, 'post', '/api/patient/search', json={'patient_name': 'Common'}),
+            )
+            db.session.remove()
+
+    print(f"{'matching patients':>18s} {'/search_patient':>16s} {'/api/patient/search':>20s}")
+    for matching_patients, (html_queries, api_queries) in counts.items():
+        print(f"{matching_patients:18d} {html_queries:16d} {api_queries:20d}")
+
+    if len(set(counts.values())) != 1:
+        print("FAIL: the number of queries grows with the number of matching patients")
+        sys.exit(1)
+
+    print("OK: the number of queries does not depend on the number of matching patients")
+
+
+if __name__ == '__main__':
+    main()
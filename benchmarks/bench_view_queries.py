@@ -0,0 +1,122 @@
+# benchmarks/bench_view_queries.py
+"""
+Count the SQL queries issued by the HTML views that list appointments and treatment plans.
+
+The appointment list, the treatment plan lists and the dashboards show the
+name of the patient of each row. With the default lazy relationships, the
+template loaded each patient with its own SELECT the first time it read
+row.patient (N+1 queries). The views now join the patient names into their
+query (Patient.name_options).
+
+This script creates 10, 100 and 1000 patients, each with one appointment
+in the next two days and one treatment plan, renders every view and counts
+its SELECT statements twice: as the views run now, and with the patients
+loaded lazily as before.
+
+The script exits with status 1 if the number of queries of a view still
+grows with the number of rows, so it can be run as a regression check.
+
+Usage: python benchmarks/bench_view_queries.py
+"""
+import os
+import sys
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.fernet import Fernet
+
+os.environ.setdefault('ENCRYPTION_KEY', Fernet.generate_key().decode())
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from flask import session
+from sqlalchemy import event
+from app import app, db
+from app.models import Patient, Appointment, TreatmentPlan
+
+# The views showing a patient name per row: (label, endpoint, view arguments)
+VIEWS = [
+    ('appointments', 'appointments.get_appointments', {}),
+    ('treatment_plans', 'treatment_plan.view_treatment_plans', {}),
+    ('dashboard (patients)', 'patients.index', {}),
+    ('dashboard (appointments)', 'appointments.index', {}),
+    ('dashboard (inventory)', 'inventory.index', {}),
+    ('dashboard (auth)', 'auth.index', {}),
+]
+
+
+def _seed(patients):
+    """
+    Recreate the tables with patients patients, each with an upcoming appointment and a treatment plan.
+    """
+    db.drop_all()
+    db.create_all()
+    soon = datetime.utcnow() + timedelta(hours=1)
+    for i in range(patients):
+        patient = Patient(
+            first_name=f'First{i}',
+            last_name=f'Last{i}',
+            date_of_birth=date(1980, 1, 1),
+            contact_number=f'+1555{i:07d}',
+            email=f'patient{i}@example.com',
+            medical_history=None
+        )
+        db.session.add(patient)
+        db.session.flush()
+        db.session.add(Appointment(patient_id=patient.id, appointment_date=soon + timedelta(minutes=30 * i)))
+        db.session.add(TreatmentPlan(patient_id=patient.id, diagnosis='Caries', treatment_details='Filling'))
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def _count_selects(endpoint, arguments):
+    """
+    Render one view for a logged-in admin and return the number of SELECT statements it issued.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append(statement)
+
+    with app.test_request_context():
+        session['user_id'] = 1
+        session['role'] = 'admin'
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            app.view_functions[endpoint](**arguments)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        db.session.expunge_all()
+
+    return len(statements)
+
+
+def main():
+    sizes = (10, 100, 1000)
+    counts = {}
+    with app.app_context():
+        for size in sizes:
+            _seed(size)
+            for label, endpoint, arguments in VIEWS:
+                after = _count_selects(endpoint, arguments)
+                # Before: the patients are loaded lazily, one query per row
+                with mock.patch.object(Patient, 'name_options', classmethod(lambda cls, relationship: db.lazyload(relationship))):
+                    before = _count_selects(endpoint, arguments)
+                counts[label, size] = (before, after)
+
+    print(f"{'view':<26s}" + ''.join(f"{f'{size} rows (before/after)':>26s}" for size in sizes))
+    for label, _, _ in VIEWS:
+        print(f"{label:<26s}" + ''.join(f"{'%d / %d' % counts[label, size]:>26s}" for size in sizes))
+
+    growing = [label for label, _, _ in VIEWS if len({counts[label, size][1] for size in sizes}) != 1]
+    if growing:
+        print(f"FAIL: the number of queries grows with the number of rows for: {', '.join(growing)}")
+        sys.exit(1)
+
+    print("OK: the number of queries of every view does not depend on the number of rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+# benchmarks/encryption_suite.py
+"""
+Encryption and decryption microbenchmark suite.
+
+The suite measures:
+
+- encrypt_data / decrypt_data per call, for payloads from 100 B to 100 KB
+  (the range of realistic medical_history sizes), for non-repeating
+  synthetic clinical notes, with compression as configured and with
+  compression disabled, so that both the compressed and the uncompressed
+  paths are measured on the same payloads;
+- decrypting the same batch one call at a time, with decrypt_many without a
+  worker pool ("batched"), and with decrypt_many spread over the worker pool
+  ("pooled");
+- the full "list N patients" path through the get_patients_api endpoint,
+  against an in-memory SQLite database: every page is requested, following
+  next_cursor, with the largest page size.
+
+Everything runs offline: ENCRYPTION_KEY and DATABASE_URL are filled in with a
+throwaway key and an in-memory SQLite database when they are not set.
+
+The results are saved as JSON, together with the current git commit, so that
+runs made on different commits can be compared:
+
+    python benchmarks/encryption_suite.py --output before.json
+    git checkout other-branch
+    python benchmarks/encryption_suite.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.fernet import Fernet
+
+os.environ.setdefault('ENCRYPTION_KEY', Fernet.generate_key().decode())
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from app import app, db
+from app.models import Patient
+from app.utils import encryption
+from app.utils.encryption import encrypt_data, decrypt_data, decrypt_many
+from app.utils.pagination import MAX_PAGE_SIZE
+
+# Payload sizes in bytes, from a short note to a very long pasted history
+PAYLOAD_SIZES = [100, 1000, 10000, 100000]
+
+# Vocabulary of the synthetic clinical notes
+NOTE_SUBJECTS = ['Patient', 'The patient', 'She', 'He', 'Parent', 'Referring dentist']
+NOTE_VERBS = ['reports', 'denies', 'describes', 'was treated for', 'presents with', 'is followed for', 'complains of']
+NOTE_FINDINGS = [
+    'sensitivity to cold', 'spontaneous pain', 'bleeding gums', 'a fractured cusp', 'swelling', 'halitosis',
+    'recurrent caries', 'bruxism', 'a loose filling', 'gingival recession', 'periapical radiolucency',
+    'tooth mobility', 'an abscess', 'dry mouth', 'jaw clicking', 'mild periodontitis', 'enamel erosion',
+]
+NOTE_SITES = ['upper', 'lower']
+NOTE_SIDES = ['left', 'right']
+NOTE_TEETH = ['central incisor', 'lateral incisor', 'canine', 'first premolar', 'second premolar',
+              'first molar', 'second molar', 'third molar']
+NOTE_ACTIONS = [
+    'Prescribed amoxicillin {dose} mg for {days} days.', 'Composite filling placed, shade A{shade}.',
+    'Scaling and root planing, {days} sites.', 'Follow-up in {days} weeks.', 'Radiograph taken, PA #{tooth}.',
+    'Local anaesthesia: articaine {dose} mg.', 'Probing depths up to {shade} mm.', 'Referred to endodontist.',
+    'Allergic to penicillin since {year}.', 'Blood pressure {dose}/{days}.', 'Crown prepared on #{tooth}.',
+]
+
+
+def _payload(size, seed=0):
+    """
+    Return a printable payload of exactly size bytes: dated clinical notes drawn at random.
+
+    The notes combine a vocabulary of findings, teeth and treatments with
+    varying dates and numbers, so no note is repeated verbatim. zlib shrinks
+    them by a factor of about 2 at 1 KB and 8 at 100 KB, whereas a single
+    repeated sentence shrinks to a few hundred bytes whatever its size.
+
+    :param size: The size of the payload in bytes
+    :param seed: The seed of the generator, so that every run encrypts the same payloads
+    """
+    rng = random.Random(f'{size}-{seed}')
+    sentences = []
+    length = 0
+    while length < size:
+        sentence = (
+            f"{rng.randrange(1, 29):02d}/{rng.randrange(1, 13):02d}/{rng.randrange(2005, 2025)}: "
+            f"{rng.choice(NOTE_SUBJECTS)} {rng.choice(NOTE_VERBS)} {rng.choice(NOTE_FINDINGS)} on the "
+            f"{rng.choice(NOTE_SITES)} {rng.choice(NOTE_SIDES)} {rng.choice(NOTE_TEETH)}. "
+            + rng.choice(NOTE_ACTIONS).format(
+                dose=rng.choice((250, 500, 875, 1000, 68, 136)), days=rng.randrange(2, 15),
+                shade=rng.randrange(1, 5), tooth=rng.randrange(11, 49), year=rng.randrange(1990, 2024)
+            ) + ' '
+        )
+        sentences.append(sentence)
+        length += len(sentence)
+    return ''.join(sentences)[:size]
+
+
+def _time(function, repeat):
+    """
+    Run function repeat times and return the best wall clock time in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_payload_sizes(calls, repeat, compress=True):
+    """
+    Measure encrypt_data and decrypt_data per call for each payload size.
+
+    :param compress: False to measure with compression disabled (COMPRESS_THRESHOLD = 0)
+    """
+    configured_threshold = encryption.COMPRESS_THRESHOLD
+    if not compress:
+        encryption.COMPRESS_THRESHOLD = 0
+
+    results = {}
+    try:
+        for size in PAYLOAD_SIZES:
+            results[str(size)] = _bench_payload(_payload(size), calls, repeat)
+    finally:
+        encryption.COMPRESS_THRESHOLD = configured_threshold
+    return results
+
+
+def _bench_payload(plaintext, calls, repeat):
+    """
+    Measure encrypt_data and decrypt_data per call for one payload.
+    """
+    ciphertext = encrypt_data(plaintext)
+
+    encrypt_seconds = _time(lambda: [encrypt_data(plaintext) for _ in range(calls)], repeat)
+    decrypt_seconds = _time(lambda: [decrypt_data(ciphertext) for _ in range(calls)], repeat)
+
+    return {
+        'ciphertext_bytes': len(ciphertext),
+        'encrypt_us_per_call': encrypt_seconds / calls * 1e6,
+        'decrypt_us_per_call': decrypt_seconds / calls * 1e6,
+    }
+
+
+def bench_decryption_modes(values, repeat, workers):
+    """
+    Decrypt the same batch one call at a time, batched without a pool, and pooled.
+    """
+    ciphertexts = [encrypt_data(_payload(200)) for _ in range(values)]
+    configured_workers = encryption.BATCH_WORKERS
+
+    single_seconds = _time(lambda: [decrypt_data(value) for value in ciphertexts], repeat)
+
+    try:
+        encryption.BATCH_WORKERS = 1
+        batched_seconds = _time(lambda: decrypt_many(ciphertexts), repeat)
+
+        encryption.BATCH_WORKERS = workers
+        # Warm the pool up so that starting the worker processes is not measured
+        decrypt_many(ciphertexts[:encryption.BATCH_CHUNK_SIZE * 2])
+        pooled_seconds = _time(lambda: decrypt_many(ciphertexts), repeat)
+    finally:
+        encryption.BATCH_WORKERS = configured_workers
+
+    return {
+        'values': values,
+        'workers': workers,
+        'single_ms': single_seconds * 1e3,
+        'batched_ms': batched_seconds * 1e3,
+        'pooled_ms': pooled_seconds * 1e3,
+    }
+
+
+def bench_list_patients(patients, repeat):
+    """
+    Time listing all the patients through GET /api/patients with the given number of patients in the database.
+
+    The endpoint is paginated: the pages of MAX_PAGE_SIZE patients are
+    requested one after the other, following next_cursor until it is null,
+    and the rows actually received are reported with the time of the whole
+    listing, so the result stays comparable whatever the page size.
+    """
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add_all([
+            Patient(
+                first_name=f'First{i}',
+                last_name=f'Last{i}',
+                date_of_birth=date(1980, 1, 1),
+                contact_number=f'+1555{i:07d}',
+                email=f'patient{i}@example.com',
+                medical_history=_payload(2000)
+            )
+            for i in range(patients)
+        ])
+        db.session.commit()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+        session['role'] = 'admin'
+
+    fetched = {}
+
+    def list_patients():
+        rows = 0
+        pages = 0
+        cursor = None
+        while True:
+            query = {'limit': MAX_PAGE_SIZE}
+            if cursor is not None:
+                query['cursor'] = cursor
+            response = client.get('/api/patients', query_string=query)
+            assert response.status_code == 200
+            body = response.get_json()
+            rows += len(body['patients'])
+            pages += 1
+            cursor = body['next_cursor']
+            if cursor is None:
+                break
+        fetched.update(rows=rows, pages=pages)
+
+    response_seconds = _time(list_patients, repeat)
+    assert fetched['rows'] == patients, f"{fetched['rows']} patients listed out of {patients}"
+
+    return {
+        'patients': fetched['rows'],
+        'pages': fetched['pages'],
+        'page_size': MAX_PAGE_SIZE,
+        'response_ms': response_seconds * 1e3,
+    }
+
+
+def _git_commit():
+    """
+    Return the current git commit, or None outside of a git checkout.
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _flatten(results, prefix=''):
+    """
+    Flatten nested result dictionaries into {'a.b.c': number} pairs.
+    """
+    flat = {}
+    for name, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f'{prefix}{name}.'))
+        elif isinstance(value, (int, float)):
+            flat[f'{prefix}{name}'] = value
+    return flat
+
+
+def compare(previous, current):
+    """
+    Print the ratio of every timing of the current run to the previous run.
+    """
+    print(f"\nComparison with {previous.get('commit')} (ratio > 1 means slower now):")
+    old = _flatten(previous['results'])
+    new = _flatten(current['results'])
+    for name in sorted(new):
+        if name in old and old[name] and (name.endswith('_ms') or name.endswith('_per_call')):
+            print(f"  {name:55s} {old[name]:12.2f} -> {new[name]:12.2f}  x{new[name] / old[name]:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Encryption microbenchmark suite')
+    parser.add_argument('--output', default='encryption_benchmark.json', help='Where to save the JSON results')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare against')
+    parser.add_argument('--calls', type=int, default=200, help='Calls per payload size')
+    parser.add_argument('--values', type=int, default=30000, help='Values in the decryption mode batch')
+    parser.add_argument('--patients', type=int, default=2000, help='Patients in the list endpoint benchmark')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Workers for the pooled mode')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions per measurement (the best is kept)')
+    args = parser.parse_args()
+
+    results = {
+        'payload_sizes': bench_payload_sizes(args.calls, args.repeat),
+        'payload_sizes_uncompressed': bench_payload_sizes(args.calls, args.repeat, compress=False),
+        'decryption_modes': bench_decryption_modes(args.values, args.repeat, args.workers),
+        'list_patients': bench_list_patients(args.patients, args.repeat),
+    }
+
+    run = {
+        'commit': _git_commit(),
+        'timestamp': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+
+    print(json.dumps(run, indent=2))
+
+    with open(args.output, 'w') as output:
+        json.dump(run, output, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(json.load(previous), run)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,17 @@
 # cli_console.py
 import cmd
+import json
+import time
 from app import app, db
 from app.models import User, Appointment, InventoryItem, TreatmentPlan, Patient
-from app.utils.encryption import decrypt_data
+from app.utils.encrypted_types import preload_decrypted
+from app.jobs.blind_index_backfill import backfill_blind_indexes
+from app.jobs.reencrypt import reencrypt_patients
+from app.jobs.patient_import import read_ndjson, read_csv, import_patients
+from app.jobs.duplicate_patients import find_duplicate_patients, MIN_SCORE
+from app.jobs.appointment_reminders import send_due_reminders
+from app.utils.reminder_senders import get_sender
+from app.utils.stock import adjust_stock, record_initial_stock
 
 
 class CrudConsole(cmd.Cmd):
@@ -328,8 +337,9 @@ class CrudConsole(cmd.Cmd):
 
         The method then loops over each Patient object in the list and prints a
         string containing the patient's ID, first name, last name, and medical
-        history. The medical history is decrypted using the decrypt_data()
-        function before it is printed.
+        history. The medical histories of all patients are loaded with the
+        patients and decrypted in one batch using the preload_decrypted()
+        function before they are printed.
 
         The final output string is of the form:
             ID: <patient_id>, Name: <first_name>, Surname: <last_name>, Medical History: <medical_history>
@@ -337,9 +347,10 @@ class CrudConsole(cmd.Cmd):
         This string is then printed to the console to indicate that the
         appointment was created successfully.
         """
-        patients = Patient.query.all()
+        patients = Patient.query.options(db.undefer(Patient.medical_history)).all()
+        preload_decrypted(patients, 'medical_history')
         for patient in patients:
-            print(f"ID: {patient.id}, Name: {patient.first_name}, Surname: {patient.last_name}, Medical History: {decrypt_data(patient.medical_history)}")
+            print(f"ID: {patient.id}, Name: {patient.first_name}, Surname: {patient.last_name}, Medical History: {patient.medical_history}")
 
     def do_update_patient(self, arg):
         """Update a patient's information. Usage: update_patient <id> <name> <dob> <medical_history>
@@ -471,6 +482,8 @@ class CrudConsole(cmd.Cmd):
         name, quantity, description = args
         new_item = InventoryItem(name=name.strip(), quantity=int(quantity.strip()), description=description.strip())
         db.session.add(new_item)
+        db.session.flush()
+        record_initial_stock(new_item)
         db.session.commit()
         print(f"Inventory item {name} created successfully!")
 
@@ -536,13 +549,21 @@ class CrudConsole(cmd.Cmd):
             print("Invalid number of arguments. Usage: update_inventory_item <id> <name> <quantity> <description>")
             return
         item_id, name, quantity, description = args
-        item = InventoryItem.query.get(item_id)
+        # Lock the item while the change of quantity is computed
+        item = db.session.get(InventoryItem, int(item_id), with_for_update=True)
         if not item:
             print(f"Inventory item with ID {item_id} not found.")
             return
         setattr(item, 'name', name.strip())
-        setattr(item, 'quantity', int(quantity.strip()))
         setattr(item, 'description', description.strip())
+        # The new quantity is applied as a movement of the inventory ledger
+        delta = int(quantity.strip()) - item.quantity
+        if delta:
+            _, errors = adjust_stock([{'item_id': item.id, 'delta': delta, 'reason': 'Quantity edited'}])
+            if errors:
+                db.session.rollback()
+                print("The quantity must not be negative.")
+                return
         db.session.commit()
         print(f"Inventory item {item_id} updated successfully!")
 
@@ -729,6 +750,166 @@ class CrudConsole(cmd.Cmd):
         print(f"Treatment plan {plan_id} deleted successfully!")
         
 
+    def do_backfill_blind_indexes(self, arg):
+        """Fill in missing email and phone blind indexes. Usage: backfill_blind_indexes [batch_size] [after_id]
+
+        This method computes the email_index and contact_number_index of the
+        patients that were created before these columns existed. It runs the
+        backfill_blind_indexes() job, which processes the patients in batches
+        ordered by ID and commits once per batch.
+
+        The optional batch_size argument sets the number of patients per batch
+        (500 by default). The optional after_id argument restarts the job after
+        the given patient ID, for example after an interruption.
+
+        When it is done, the method prints the number of updated patients, the
+        last processed ID, and the IDs of the patients whose email address is
+        already indexed for another patient.
+        """
+        args = arg.split()
+        batch_size = int(args[0]) if len(args) > 0 else 500
+        after_id = int(args[1]) if len(args) > 1 else 0
+
+        result = backfill_blind_indexes(batch_size=batch_size, after_id=after_id)
+
+        print(f"Blind indexes backfilled for {result['updated']} patients (last ID: {result['last_id']}).")
+        if result['duplicates']:
+            print(f"Duplicate emails, index left empty for patient IDs: {result['duplicates']}")
+
+    def do_reencrypt_patients(self, arg):
+        """Re-encrypt patient data with the active key. Usage: reencrypt_patients [batch_size] [after_id]
+
+        This method runs the reencrypt_patients() job, which rewrites the
+        contact number, email and medical history of every patient whose
+        ciphertext was written with an older key (or is a legacy Fernet token)
+        using the active key. Run it after rotating ENCRYPTION_KEYS and
+        ENCRYPTION_ACTIVE_KEY_ID; once it reports nothing left to re-encrypt,
+        the old key can be removed from the keyring.
+
+        The patients are processed in batches ordered by ID, with one commit
+        per batch, so the application keeps running while the job is running.
+
+        The optional batch_size argument sets the number of patients per batch
+        (500 by default). The optional after_id argument resumes the job after
+        the given patient ID.
+        """
+        args = arg.split()
+        batch_size = int(args[0]) if len(args) > 0 else 500
+        after_id = int(args[1]) if len(args) > 1 else 0
+
+        result = reencrypt_patients(batch_size=batch_size, after_id=after_id)
+
+        print(f"Re-encrypted {result['reencrypted']} values across {result['patients']} patients (last ID: {result['last_id']}).")
+
+    def do_import_patients(self, arg):
+        """Create patients in bulk from a file. Usage: import_patients <path> [batch_size]
+
+        This method runs the import_patients() job on an NDJSON file (one JSON
+        object per line) or, if the file name ends with .csv, on a CSV file with
+        a header line. Every patient needs the fields first_name, last_name,
+        date_of_birth (YYYY-MM-DD), contact_number and email, and may have a
+        medical_history.
+
+        The file is read as a stream and imported in batches: each batch is
+        validated, encrypted in one go, inserted with a single statement and
+        committed. Invalid patients and already registered emails are skipped
+        and listed with their line number; the rest of the file is imported.
+
+        The optional batch_size argument sets the number of patients per batch
+        (500 by default).
+        """
+        args = arg.split()
+        if not args:
+            print("Usage: import_patients <path> [batch_size]")
+            return
+        path = args[0]
+        batch_size = int(args[1]) if len(args) > 1 else 500
+
+        try:
+            with open(path, encoding='utf-8', newline='') as stream:
+                records = read_csv(stream) if path.lower().endswith('.csv') else read_ndjson(stream)
+                result = import_patients(records, chunk_size=batch_size)
+        except (OSError, ValueError) as e:
+            print(f"Import failed: {e}")
+            return
+
+        print(f"Imported {result['imported']} patients, {result['failed']} rejected.")
+        for error in result['errors']:
+            print(f"  line {error['line']}: {error['error']}")
+
+    def do_find_duplicate_patients(self, arg):
+        """Report patients that are probably duplicates. Usage: find_duplicate_patients [min_score] [output.json]
+
+        This method runs the find_duplicate_patients() job, which compares only
+        the patients sharing a blocking key (date of birth and same-sounding
+        name, same name, same email or same contact number) instead of every
+        pair of patients, and decrypts contact details only for those pairs.
+
+        The candidates are printed best first with their score (between 0 and
+        1) and the reasons for the match. Nothing is merged or deleted: the
+        report is meant for review by the reception staff.
+
+        The optional min_score argument sets the lowest score reported (0.6 by
+        default). The optional output argument saves the full report as JSON.
+        """
+        args = arg.split()
+        min_score = float(args[0]) if len(args) > 0 else MIN_SCORE
+
+        result = find_duplicate_patients(min_score=min_score)
+
+        print(f"Scanned {result['patients']} patients, compared {result['candidate_pairs']} candidate pairs "
+              f"({result['oversized_blocks']} oversized blocks skipped).")
+        for duplicate in result['duplicates']:
+            first_id, second_id = duplicate['patient_ids']
+            print(f"  {duplicate['score']:.3f}  patients {first_id} and {second_id}: {', '.join(duplicate['reasons'])}")
+
+        if len(args) > 1:
+            with open(args[1], 'w') as output:
+                json.dump(result, output, indent=2)
+            print(f"Report saved to {args[1]}")
+
+    def do_send_reminders(self, arg):
+        """Send the appointment reminders that are due. Usage: send_reminders [batch_size] [every_seconds]
+
+        This method runs the send_due_reminders() job, which records a
+        reminder 24 hours and 2 hours before every appointment, by email and by
+        SMS, and sends the pending ones. The job resumes from a watermark
+        stored in the database, so each run only reads the appointments that
+        became due since the previous one, and a reminder is never sent twice.
+
+        The reminders are sent through the SMTP server and the HTTP gateway
+        configured with the REMINDER_SMTP_* and REMINDER_HTTP_* environment
+        variables; without them, they are only logged.
+
+        The optional batch_size argument sets the number of appointments or
+        reminders per batch (200 by default). With the optional every_seconds
+        argument, the job runs again every every_seconds seconds until the
+        console is interrupted with Ctrl+C. A run that fails (e.g. the
+        database is unreachable) is logged and rolled back, and the next run
+        happens as planned: whatever the failed run had not committed is
+        picked up again from the watermark.
+        """
+        args = arg.split()
+        batch_size = int(args[0]) if len(args) > 0 else 200
+        every_seconds = float(args[1]) if len(args) > 1 else None
+
+        sender = get_sender()
+        try:
+            while True:
+                try:
+                    result = send_due_reminders(sender, batch_size=batch_size)
+                    print(f"Reminders: {result['scheduled']} scheduled, {result['sent']} sent, "
+                          f"{result['retrying']} to retry, {result['failed']} failed, {result['skipped']} skipped.")
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.exception("The reminder run failed")
+                    print(f"Reminder run failed: {e}")
+                if every_seconds is None:
+                    break
+                time.sleep(every_seconds)
+        except KeyboardInterrupt:
+            print("Reminder scheduler stopped.")
+
     def do_exit(self, arg):
         """
         Exit the CRUD console
@@ -838,6 +1019,11 @@ class CrudConsole(cmd.Cmd):
                 'list_treatment_plans',
                 'update_treatment_plan',
                 'delete_treatment_plan',
+                'backfill_blind_indexes',
+                'reencrypt_patients',
+                'import_patients',
+                'find_duplicate_patients',
+                'send_reminders',
             ]
             # Print a message to the console indicating that the list of commands
             # is available
@@ -0,0 +1,99 @@
+# tests/test_search_queries.py
+"""
+Check that the patient name search issues a constant number of queries.
+
+The search used to run one appointments query and one treatment plans query
+per matching patient (2N+1 queries). These tests create 1, 10 and 100
+patients sharing a surname, each with appointments and treatment plans, run
+the HTML search (/search_patient) or the API search (/api/patient/search),
+and compare the number of SELECT statements of the requests.
+
+benchmarks/bench_search_queries.py prints the same counts.
+
+Usage: python -m pytest tests
+"""
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.fernet import Fernet
+
+os.environ.setdefault('ENCRYPTION_KEY', Fernet.generate_key().decode())
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from sqlalchemy import event
+from app import app, db
+from app.models import Patient, Appointment, TreatmentPlan
+from app.utils.name_search import setup_name_search
+
+# Numbers of patients matching the searched name
+MATCHING_PATIENTS = (1, 10, 100)
+
+
+def _seed(matching_patients):
+    """
+    Recreate the tables with matching_patients patients called 'Common'.
+    """
+    db.drop_all()
+    db.create_all()
+    setup_name_search()
+    for i in range(matching_patients):
+        patient = Patient(
+            first_name=f'First{i}',
+            last_name='Common',
+            date_of_birth=date(1980, 1, 1),
+            contact_number=f'+1555{i:07d}',
+            email=f'patient{i}@example.com',
+            medical_history='No known allergies.'
+        )
+        db.session.add(patient)
+        db.session.flush()
+        for j in range(3):
+            db.session.add(Appointment(patient_id=patient.id, appointment_date=datetime(2024, 1, 1) + timedelta(days=j)))
+        db.session.add(TreatmentPlan(patient_id=patient.id, diagnosis='Caries', treatment_details='Filling'))
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def _count_selects(method, url, **kwargs):
+    """
+    Run one request as an admin and return the number of SELECT statements it issued.
+    """
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+        session['role'] = 'admin'
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = getattr(client, method)(url, **kwargs)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    assert response.status_code == 200, response.status_code
+    return len(statements)
+
+
+@pytest.mark.parametrize('method, url, request_args', [
+    ('post', '/search_patient', {'data': {'patient_name': 'Common'}}),
+    ('post', '/api/patient/search', {'json': {'patient_name': 'Common'}}),
+])
+def test_search_queries_do_not_grow_with_matches(method, url, request_args):
+    counts = {}
+    with app.app_context():
+        for matching_patients in MATCHING_PATIENTS:
+            _seed(matching_patients)
+            counts[matching_patients] = _count_selects(method, url, **request_args)
+            db.session.remove()
+
+    assert len(set(counts.values())) == 1, f"SELECT statements per number of matching patients: {counts}"